@@ -7,10 +7,21 @@ For more information on this file, see
 https://docs.djangoproject.com/en/4.2/howto/deployment/asgi/
 """
 
+import gc
 import os
 
+# 起動時のimportで作られるオブジェクトはほぼすべて終了まで残るので、その間はGCを止めておき、
+# 最後にgc.freezeで以降のGCの対象から外す(ワーカーの起動が速くなり、fork後のメモリも共有されたままになる)
+gc.disable()
+
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'django_accounts.settings')
+# 設定でASGIの時の値(永続的なDB接続を使わないなど)を選べるようにする
+os.environ.setdefault('SERVER_MODE', 'asgi')
 
-application = get_asgi_application()
+try:
+    application = get_asgi_application()
+finally:
+    gc.freeze()
+    gc.enable()
@@ -13,14 +13,14 @@ https://docs.djangoproject.com/en/4.2/ref/settings/
 import os
 from pathlib import Path
 import datetime
-import environ
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
-# .envファイルを読み込む
-env_by_file = environ.Env()
-env_by_file.read_env(os.path.join(BASE_DIR, '.env')) # .envファイルが存在しなくてもエラーにならない
+# .envファイルがあれば読み込む(django-environは.envがある時だけimportし、起動を速くする)
+if os.path.exists(os.path.join(BASE_DIR, '.env')):
+    import environ
+    environ.Env().read_env(os.path.join(BASE_DIR, '.env'))
 
 # .envを含むホストマシン全体の環境変数
 env = os.environ
@@ -32,9 +32,10 @@ env = os.environ
 SECRET_KEY = env.get('SECRET_KEY')
 
 # SECURITY WARNING: don't run with debug turned on in production!
-DEBUG = True
+# 本番ではDEBUG=Falseにする(DEBUGがTrueの間は、実行したSQLがすべてconnection.queriesに溜まる)
+DEBUG = env.get('DEBUG', 'True').lower() == 'true'
 
-ALLOWED_HOSTS = []
+ALLOWED_HOSTS = env.get('ALLOWED_HOSTS', '').split()
 
 
 # Application definition
@@ -55,16 +56,23 @@ INSTALLED_APPS = [
 AUTH_USER_MODEL = "main_app.User" # カスタムユーザーを認証用ユーザーとして登録
 
 MIDDLEWARE = [
+    'main_app.middleware.RequestMetricsMiddleware', # 処理時間の計測(全体を計測するので先頭に置く)
+    'main_app.middleware.DatabaseRoutingMiddleware', # リクエストごとにDBの読み取り先の固定を初期化する
     "corsheaders.middleware.CorsMiddleware",
     'django.middleware.security.SecurityMiddleware',
-    'django.contrib.sessions.middleware.SessionMiddleware',
+    # 以下のmain_app.middlewareのものは、STATELESS_PATH_PREFIXESへのリクエストでは何もしない
+    'main_app.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
-    'django.middleware.csrf.CsrfViewMiddleware',
-    'django.contrib.auth.middleware.AuthenticationMiddleware',
-    'django.contrib.messages.middleware.MessageMiddleware',
-    'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'main_app.middleware.CsrfViewMiddleware',
+    'main_app.middleware.AuthenticationMiddleware',
+    'main_app.middleware.MessageMiddleware',
+    'main_app.middleware.XFrameOptionsMiddleware',
+    'main_app.middleware.JWTCookieRefreshMiddleware', # 更新したjwtをクッキーにセットする
 ]
 
+# jwtで認証し、セッション・CSRF・ログインユーザーを使わないパス(admin/などは対象外)
+STATELESS_PATH_PREFIXES = ('/api/', '/metrics')
+
 ROOT_URLCONF = 'django_accounts.urls'
 
 TEMPLATES = [
@@ -89,16 +97,58 @@ WSGI_APPLICATION = 'django_accounts.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
 
+# CONN_MAX_AGE秒だけ接続を使い回し、リクエストごとのTCP+認証のハンドシェイクを避ける
+# CONN_HEALTH_CHECKSがTrueなら、使い回す前に接続が生きているか確認する
+# ASGI(SERVER_MODE=asgi)では、同期のORMはsync_to_asyncのスレッドごとに接続を開き、使い回されずに閉じられもしないので、
+# Djangoのドキュメントのとおり永続的な接続を使わない(CONN_MAX_AGE=0)。接続を使い回すならDBの前にProxySQLなどのプールを置く
+SERVER_MODE = env.get('SERVER_MODE', 'wsgi')
+
 DATABASES = {
     'default': {
         #'ENGINE': 'django.db.backends.sqlite3',
         #'NAME': BASE_DIR / 'db.sqlite3',
-        'ENGINE': 'django.db.backends.mysql',
-        'NAME': 'mysql',
+        'ENGINE': env.get('DB_ENGINE', 'main_app.db.mysql'), # 接続の統計を取るMySQLバックエンド
+        'NAME': env.get('DB_NAME', 'mysql'),
         'USER':  env.get('DB_USER'),
         'PASSWORD': env.get('DB_PASSWORD'),
         'HOST': env.get('DB_HOST'),
         'PORT': env.get('DB_PORT'),
+        'CONN_MAX_AGE': 0 if SERVER_MODE == 'asgi' else int(env.get('DB_CONN_MAX_AGE', '600')),
+        'CONN_HEALTH_CHECKS': env.get('DB_CONN_HEALTH_CHECKS', 'True').lower() == 'true',
+    }
+}
+
+# 読み取り専用のレプリカ(スペース区切りのホスト。host:portも可)。DB名・ユーザー・パスワードはdefaultと同じ
+# レプリカがあれば、Userの読み取りはレプリカに、書き込みはdefault(プライマリ)に送る(main_app.db.router)
+for i, replica in enumerate(env.get('DB_REPLICA_HOSTS', '').split()):
+    host, _, port = replica.partition(':')
+    DATABASES['replica%d' % i] = dict(DATABASES['default'], HOST=host, PORT=port or DATABASES['default']['PORT'],
+                                      TEST={'MIRROR': 'default'})
+DATABASE_REPLICAS = [alias for alias in DATABASES if alias != 'default']
+DATABASE_ROUTERS = ['main_app.db.router.PrimaryReplicaRouter']
+
+# 書き込んだユーザーの読み取りをプライマリで行う秒数(レプリカの遅れより長くする)と、その記録を置くキャッシュ
+REPLICA_STICKY_SECONDS = int(env.get('REPLICA_STICKY_SECONDS', '5'))
+REPLICA_STICKY_CACHE_ALIAS = env.get('REPLICA_STICKY_CACHE_ALIAS', 'default')
+# 常にプライマリで読むパス(管理画面は更新した内容をすぐに表示する)
+REPLICA_PRIMARY_PATH_PREFIXES = ('/admin/',)
+
+
+# Cache
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+# ユーザーのスナップショット・レート制限の回数・書き込んだユーザーの記録・メトリクスは、全ワーカーで共有する必要がある
+# (locmemはプロセスごとに別々になるので、テスト(settings_test)でだけ使う)
+# 既定は同じホストのワーカーで共有できるファイル。複数のノードで動かす時はredisやmemcachedを指定する
+#     CACHE_BACKEND=django.core.cache.backends.redis.RedisCache CACHE_LOCATION=redis://redis:6379/0
+
+CACHES = {
+    'default': {
+        'BACKEND': env.get('CACHE_BACKEND', 'django.core.cache.backends.filebased.FileBasedCache'),
+        'LOCATION': env.get('CACHE_LOCATION', '/tmp/django_accounts_cache'),
+        'OPTIONS': {
+            # ファイルのキャッシュは件数がこれを超えると一部を削除する(既定の300ではすぐに溢れる)
+            'MAX_ENTRIES': int(env.get('CACHE_MAX_ENTRIES', '100000')),
+        },
     }
 }
 
@@ -121,15 +171,78 @@ AUTH_PASSWORD_VALIDATORS = [
     },
 ]
 
+# Password hashing
+# https://docs.djangoproject.com/en/4.2/topics/auth/passwords/
+# PASSWORD_HASHER_PROFILEのハッシュで新しいパスワードをハッシュ化し、残りは既存のパスワードの検証に使う
+# パラメーターは manage.py benchmark_hashers の結果を見て、1回のハッシュ化が目標の時間になるように決める
+# argon2を使う場合はargon2-cffiが必要
+
+PASSWORD_HASHER_PROFILES = {
+    'pbkdf2': 'main_app.hashers.TunedPBKDF2PasswordHasher',
+    'scrypt': 'main_app.hashers.TunedScryptPasswordHasher',
+    'argon2': 'main_app.hashers.TunedArgon2PasswordHasher',
+}
+PASSWORD_HASHER_PROFILE = env.get('PASSWORD_HASHER_PROFILE', 'pbkdf2')
+PASSWORD_HASHERS = [PASSWORD_HASHER_PROFILES[PASSWORD_HASHER_PROFILE]] + [
+    hasher for profile, hasher in PASSWORD_HASHER_PROFILES.items() if profile != PASSWORD_HASHER_PROFILE
+]
+PASSWORD_HASHER_PARAMS = {
+    'pbkdf2': {
+        'iterations': env.get('PBKDF2_ITERATIONS', '600000'),
+    },
+    'scrypt': {
+        'work_factor': env.get('SCRYPT_WORK_FACTOR', '16384'),
+        'block_size': env.get('SCRYPT_BLOCK_SIZE', '8'),
+        'parallelism': env.get('SCRYPT_PARALLELISM', '1'),
+    },
+    'argon2': {
+        'time_cost': env.get('ARGON2_TIME_COST', '2'),
+        'memory_cost': env.get('ARGON2_MEMORY_COST', '102400'),
+        'parallelism': env.get('ARGON2_PARALLELISM', '8'),
+    },
+}
+
+# パスワードのハッシュ化を行うワーカープール
+# PASSWORD_HASHING_EXECUTOR: thread, process, inline(リクエストのスレッドで実行)のいずれか
+PASSWORD_HASHING_EXECUTOR = env.get('PASSWORD_HASHING_EXECUTOR', 'thread')
+# プールはgunicornのワーカー(プロセス)ごとに作られるので、既定ではCPUのコア数をワーカー数(WEB_CONCURRENCY)で分ける
+# (プロセスごとにコア数にすると、ホスト全体でコア数の2乗のスレッドがハッシュ化を奪い合う)
+_cpu_count = os.cpu_count() or 1
+_web_concurrency = int(env.get('WEB_CONCURRENCY') or _cpu_count)
+PASSWORD_HASHING_WORKERS = int(env.get('PASSWORD_HASHING_WORKERS') or max(1, _cpu_count // _web_concurrency))
+# ワーカーが埋まっている時に待たせる数。これを超えると503を返す
+PASSWORD_HASHING_QUEUE_SIZE = int(env.get('PASSWORD_HASHING_QUEUE_SIZE', '32'))
+PASSWORD_HASHING_RETRY_AFTER = int(env.get('PASSWORD_HASHING_RETRY_AFTER', '1'))
+
 REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.AllowAny',
     ],  
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'main_app.authentication.CookieJWTAuthentication',
+    ],
+    'DEFAULT_RENDERER_CLASSES': [
+        'main_app.renderers.JSONRenderer', # シリアライズの時間を計測する
+        'rest_framework.renderers.BrowsableAPIRenderer',
     ],
     'NON_FIELD_ERRORS_KEY': 'detail',
-    'TEST_REQUEST_DEFAULT_FORMAT': 'json'
+    'TEST_REQUEST_DEFAULT_FORMAT': 'json',
+    # main_app.throttlingのスコープごとの回数(空文字なら制限しない)
+    'DEFAULT_THROTTLE_RATES': {
+        'login_ip': env.get('LOGIN_THROTTLE_IP_RATE', '30/min'),
+        'login_account': env.get('LOGIN_THROTTLE_ACCOUNT_RATE', '10/min'),
+        'login_global': env.get('LOGIN_THROTTLE_GLOBAL_RATE', '200/s'),
+        'signup_ip': env.get('SIGNUP_THROTTLE_IP_RATE', '10/min'),
+        'signup_global': env.get('SIGNUP_THROTTLE_GLOBAL_RATE', '50/s'),
+        # トークンの一括検証(1回でJWT_BATCH_VERIFY_MAX件まで検証する)
+        'verify_batch_account': env.get('VERIFY_BATCH_THROTTLE_ACCOUNT_RATE', '60/min'),
+        'verify_batch_global': env.get('VERIFY_BATCH_THROTTLE_GLOBAL_RATE', '50/s'),
+        # 登録済みのusername/emailを総当たりで調べられないように、入力中の確認にも制限をかける
+        'availability_ip': env.get('AVAILABILITY_THROTTLE_IP_RATE', '30/min'),
+        'availability_global': env.get('AVAILABILITY_THROTTLE_GLOBAL_RATE', '100/s'),
+    },
+    # プロキシの数(X-Forwarded-Forからクライアントのアドレスを取り出す)
+    'NUM_PROXIES': int(env['NUM_PROXIES']) if env.get('NUM_PROXIES') else None,
 }
 
 SIMPLE_JWT = {
@@ -138,10 +251,84 @@ SIMPLE_JWT = {
     #'AUTH_HEADER_TYPES': env('JWT_AUTH_HEADER_TYPES').split(),
     'AUTH_HEADER_TYPES': env.get('JWT_AUTH_HEADER_TYPES').split(),
     #'AUTH_HEADER_TYPES': ["aaa"],
+    # JWT_ALGORITHMがRS256/ES256/EdDSAなどの時は、main_app.keysの鍵で署名する(manage.py rotate_signing_keyで作成)
+    'AUTH_TOKEN_CLASSES': ('main_app.tokens.AccessToken',),
+    'TOKEN_OBTAIN_SERIALIZER': 'main_app.serializer.TokenObtainPairSerializer',
     'ROTATE_REFRESH_TOKENS': True,
     'ACCESS_TOKEN_LIFETIME': datetime.timedelta(minutes=30),
     'REFRESH_TOKEN_LIFETIME': datetime.timedelta(days=14),
+    # 使用済み・失効したリフレッシュトークンをmain_app.token_storeで管理する
+    'TOKEN_REFRESH_SERIALIZER': 'main_app.serializer.TokenRefreshSerializer',
+    'TOKEN_VERIFY_SERIALIZER': 'main_app.serializer.TokenVerifySerializer',
+    'TOKEN_BLACKLIST_SERIALIZER': 'main_app.serializer.TokenRevokeSerializer',
 }
+
+# 署名用の鍵をプロセス内に保持する秒数と、JWKSをキャッシュさせる秒数
+JWT_KEYRING_TTL = int(env.get('JWT_KEYRING_TTL', '60'))
+JWT_JWKS_MAX_AGE = int(env.get('JWT_JWKS_MAX_AGE', '300'))
+
+# 検証済みjwtのペイロードをプロセス内にキャッシュする件数(0ならキャッシュしない)
+JWT_DECODE_CACHE_SIZE = int(env.get('JWT_DECODE_CACHE_SIZE', '10000'))
+
+# token/verify/batchで一度に検証できるトークンの数
+JWT_BATCH_VERIFY_MAX = int(env.get('JWT_BATCH_VERIFY_MAX', '1000'))
+
+# jwtをセットするクッキーの名前
+JWT_ACCESS_COOKIE = 'Authorization'
+JWT_REFRESH_COOKIE = 'refresh'
+# クッキーのアクセストークンの残り時間がこの秒数を切ったら、リフレッシュトークンで更新する
+JWT_COOKIE_REFRESH_MARGIN = int(env.get('JWT_COOKIE_REFRESH_MARGIN', '300'))
+
+# Trueならis_loginでjwtの署名と有効期限のみを検証し、DBを参照しない
+IS_LOGIN_STATELESS = env.get('IS_LOGIN_STATELESS', 'False').lower() == 'true'
+# ステートレス検証時にユーザーの有効状態をキャッシュする秒数(0なら確認しない)
+IS_LOGIN_ACTIVE_CHECK_TTL = int(env.get('IS_LOGIN_ACTIVE_CHECK_TTL', '0'))
+
+# Trueならtoken, is_login, signupのエンドポイントに非同期版のビューを使う(ASGIで動かす時用)
+ASYNC_API_VIEWS = env.get('ASYNC_API_VIEWS', 'False').lower() == 'true'
+
+# 認証済みユーザーをプロセス内にキャッシュする件数と秒数(どちらかが0ならキャッシュしない)
+# 他のワーカーでの更新はこの秒数だけ遅れて反映されるので、短めにしておく
+USER_CACHE_MAX_SIZE = int(env.get('USER_CACHE_MAX_SIZE', '10000'))
+USER_CACHE_TTL = int(env.get('USER_CACHE_TTL', '5'))
+
+# 全ワーカーで共有するユーザーのスナップショットの設定
+USER_SNAPSHOT_CACHE_ALIAS = env.get('USER_SNAPSHOT_CACHE_ALIAS', 'default')
+USER_SNAPSHOT_TTL = int(env.get('USER_SNAPSHOT_TTL', '300'))
+# キャッシュミス時にDBを参照するワーカーを1つに絞るロックの秒数
+USER_SNAPSHOT_LOCK_TIMEOUT = int(env.get('USER_SNAPSHOT_LOCK_TIMEOUT', '2'))
+# ロックを取れなかったワーカーが、他のワーカーのスナップショットを待つ最大の秒数(過ぎたらDBを参照する)
+USER_SNAPSHOT_WAIT_TIMEOUT = float(env.get('USER_SNAPSHOT_WAIT_TIMEOUT', '0.1'))
+# 存在しないユーザーを記録しておく秒数
+USER_SNAPSHOT_MISSING_TTL = int(env.get('USER_SNAPSHOT_MISSING_TTL', '10'))
+
+# ユーザー登録前の重複確認にブルームフィルタを使うか
+# 使う時は、ワーカーの起動時にバックグラウンドでusername/emailを全件読み込んでフィルタを作成する
+USER_EXISTENCE_FILTER = env.get('USER_EXISTENCE_FILTER', 'False').lower() == 'true'
+USER_EXISTENCE_FILTER_CAPACITY = int(env.get('USER_EXISTENCE_FILTER_CAPACITY', '1000000'))
+USER_EXISTENCE_FILTER_ERROR_RATE = float(env.get('USER_EXISTENCE_FILTER_ERROR_RATE', '0.01'))
+
+# ユーザーの前方一致検索の1ページの最大件数と、結果をキャッシュする秒数(0ならキャッシュしない)
+USER_SEARCH_MAX_LIMIT = int(env.get('USER_SEARCH_MAX_LIMIT', '100'))
+USER_SEARCH_CACHE_TTL = int(env.get('USER_SEARCH_CACHE_TTL', '30'))
+
+# ユーザー一覧の1ページの件数と最大件数、ストリーミング時に1回のfetchで読み込む件数
+USER_LIST_PAGE_SIZE = int(env.get('USER_LIST_PAGE_SIZE', '100'))
+USER_LIST_MAX_PAGE_SIZE = int(env.get('USER_LIST_MAX_PAGE_SIZE', '1000'))
+USER_LIST_STREAM_CHUNK_SIZE = int(env.get('USER_LIST_STREAM_CHUNK_SIZE', '2000'))
+
+# レート制限の回数を保存するキャッシュ(複数のノードで動かす時は共有のキャッシュにする)
+THROTTLE_CACHE_ALIAS = env.get('THROTTLE_CACHE_ALIAS', 'default')
+
+# 処理時間をServer-Timingヘッダーで返すか
+# 内部の処理時間を外部に公開することになるので、指定がなければDEBUGの時だけ返す
+SERVER_TIMING = env.get('SERVER_TIMING', str(DEBUG)).lower() == 'true'
+# /metricsの集計を保存するキャッシュと、各プロセスが集計をキャッシュに足し込む間隔(秒)
+METRICS_CACHE_ALIAS = env.get('METRICS_CACHE_ALIAS', 'default')
+METRICS_FLUSH_INTERVAL = float(env.get('METRICS_FLUSH_INTERVAL', '10'))
+# /metricsにアクセスできるアドレス(プロキシの後ろではREST_FRAMEWORKのNUM_PROXIESでクライアントのアドレスを取り出す)
+METRICS_ALLOWED_IPS = env.get('METRICS_ALLOWED_IPS', '127.0.0.1 ::1').split()
+
 # Internationalization
 # https://docs.djangoproject.com/en/4.2/topics/i18n/
 
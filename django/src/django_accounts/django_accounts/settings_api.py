@@ -0,0 +1,30 @@
+"""
+APIだけを処理するワーカー用の設定
+    DJANGO_SETTINGS_MODULE=django_accounts.settings_api gunicorn -c gunicorn.conf.py django_accounts.wsgi
+admin・セッション・メッセージ・静的ファイル・テンプレートを読み込まず、ワーカーの起動を速くする
+admin/はdjango_accounts.settingsで起動したワーカーで処理する
+"""
+from .settings import *  # noqa
+
+INSTALLED_APPS = [app for app in INSTALLED_APPS if app not in (
+    'django.contrib.admin',
+    'django.contrib.sessions',
+    'django.contrib.messages',
+    'django.contrib.staticfiles',
+)]
+
+# /api/では何もしないミドルウェアは、最初から入れない
+MIDDLEWARE = [middleware for middleware in MIDDLEWARE if middleware not in (
+    'main_app.middleware.SessionMiddleware',
+    'main_app.middleware.CsrfViewMiddleware',
+    'main_app.middleware.AuthenticationMiddleware',
+    'main_app.middleware.MessageMiddleware',
+    'main_app.middleware.XFrameOptionsMiddleware',
+)]
+
+ROOT_URLCONF = 'django_accounts.urls_api'
+
+TEMPLATES = []
+
+# テンプレートを使うBrowsableAPIRendererは使わない
+REST_FRAMEWORK = dict(REST_FRAMEWORK, DEFAULT_RENDERER_CLASSES=['main_app.renderers.JSONRenderer'])
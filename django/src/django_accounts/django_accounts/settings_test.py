@@ -0,0 +1,53 @@
+"""
+テスト用の設定
+    python manage.py test main_app --parallel
+manage.py testはこの設定を使う(DJANGO_SETTINGS_MODULEを指定すればそちらを使う)
+DBはメモリ上のSQLite、パスワードのハッシュは計算量を最小にしたものを使い、MySQLや.envがなくても動く
+"""
+import os
+
+# 必須の環境変数は、指定がなければテスト用の値を使う
+for key, value in {
+    'SECRET_KEY': 'test-secret-key-0123456789abcdef0123456789',
+    'JWT_ALGORITHM': 'HS256',
+    'JWT_AUTH_HEADER_TYPES': 'Bearer',
+    'TRUSTED_ORIGINS': 'http://localhost:3000',
+}.items():
+    os.environ.setdefault(key, value)
+
+from .settings import *  # noqa
+
+# --parallelの時は、ワーカーごとにメモリ上のDBが複製される
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': ':memory:',
+    },
+}
+DATABASE_REPLICAS = []
+
+# ハッシュの種類(pbkdf2/scrypt/argon2)とプロファイルの切り替えは本番と同じにし、計算量だけを最小にする
+PASSWORD_HASHER_PARAMS = {
+    'pbkdf2': {
+        'iterations': '1',
+    },
+    'scrypt': {
+        'work_factor': '16',
+        'block_size': '1',
+        'parallelism': '1',
+    },
+    'argon2': {
+        'time_cost': '1',
+        'memory_cost': '8',
+        'parallelism': '1',
+    },
+}
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+}
+
+DEBUG = False
+ALLOWED_HOSTS = ['testserver', 'localhost']
@@ -16,8 +16,10 @@ Including another URLconf
 """
 from django.contrib import admin
 from django.urls import path,include
+from main_app.urls import lazy_view
 
 urlpatterns = [
     path('admin/', admin.site.urls),
-    path('api/', include("main_app.urls")) # logins.urls.pyを読み込むための設定を追加
+    path('api/', include("main_app.urls")), # logins.urls.pyを読み込むための設定を追加
+    path('metrics', lazy_view('main_app.admin_views.MetricsView'), name='metrics'), # Prometheus形式のメトリクス
 ]
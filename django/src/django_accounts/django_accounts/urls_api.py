@@ -0,0 +1,11 @@
+"""
+APIだけを処理するワーカー(django_accounts.settings_api)のURL設定
+admin/を含まない
+"""
+from django.urls import path,include
+from main_app.urls import lazy_view
+
+urlpatterns = [
+    path('api/', include("main_app.urls")),
+    path('metrics', lazy_view('main_app.admin_views.MetricsView'), name='metrics'), # Prometheus形式のメトリクス
+]
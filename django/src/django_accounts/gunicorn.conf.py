@@ -0,0 +1,56 @@
+"""
+本番用のgunicornの設定
+    gunicorn -c gunicorn.conf.py django_accounts.wsgi
+SERVER_MODE=asgiなら、uvicornのワーカーでdjango_accounts.asgiを動かす(ASYNC_API_VIEWS=Trueと合わせて使う)
+(その時はDBの永続的な接続を使わない。DB_CONN_MAX_AGEは無視され、常に0になる)
+    gunicorn -c gunicorn.conf.py django_accounts.asgi
+APIだけを処理するワーカーはDJANGO_SETTINGS_MODULE=django_accounts.settings_apiで起動すると速い
+マスタープロセスにSIGHUPを送ると、新しいワーカーを起動してから古いワーカーを終了する(graceful reload)
+"""
+import multiprocessing
+import os
+
+env = os.environ
+
+bind = env.get("GUNICORN_BIND", "0.0.0.0:8000")
+
+# ワーカー数は指定がなければCPUのコア数にする
+# パスワードのハッシュ化でCPUを使い切るので、コア数より多くしてもスループットは上がらない
+# ハッシュ化のプール(PASSWORD_HASHING_WORKERS)はワーカーごとに作られ、既定ではコア数をこの数で分けた大きさになる
+# (ワーカー数をコア数より減らした時は、その分だけ各ワーカーのプールが大きくなる)
+workers = int(env.get("WEB_CONCURRENCY") or multiprocessing.cpu_count())
+
+if env.get("SERVER_MODE", "wsgi") == "asgi":
+    worker_class = "uvicorn.workers.UvicornWorker"
+else:
+    # DB待ちの間も他のリクエストを処理できるように、1ワーカーを複数スレッドで動かす
+    worker_class = "gthread"
+    threads = int(env.get("GUNICORN_THREADS", "4"))
+
+# ワーカーが一定数のリクエストを処理したら入れ替え、メモリの増加を抑える(全ワーカーが同時に入れ替わらないようにずらす)
+max_requests = int(env.get("GUNICORN_MAX_REQUESTS", "10000"))
+max_requests_jitter = int(env.get("GUNICORN_MAX_REQUESTS_JITTER", "1000"))
+
+timeout = int(env.get("GUNICORN_TIMEOUT", "30"))
+graceful_timeout = int(env.get("GUNICORN_GRACEFUL_TIMEOUT", "30"))
+keepalive = int(env.get("GUNICORN_KEEPALIVE", "5"))
+
+# 開発時はコードの変更でワーカーを再起動する
+reload = env.get("GUNICORN_RELOAD", "False").lower() == "true"
+
+# マスタープロセスでアプリケーションを読み込んでからforkし、ワーカーの入れ替えでimportし直さない
+# (SIGHUPでコードの変更は反映されなくなるので、デプロイ時はマスターごと再起動する)
+preload_app = env.get("GUNICORN_PRELOAD", "False").lower() == "true"
+
+accesslog = env.get("GUNICORN_ACCESS_LOG", "-")
+errorlog = "-"
+
+
+def post_worker_init(worker):
+    """
+    ワーカーがアプリケーションを読み込んだ後、リクエストを受ける前に呼ばれる
+    重複確認のブルームフィルタ(USER_EXISTENCE_FILTER)の作成をバックグラウンドで始める
+    """
+    from django.contrib.auth import get_user_model
+    from main_app.user_index import user_index
+    user_index.start_build(get_user_model())
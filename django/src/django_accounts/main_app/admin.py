@@ -1,4 +1,12 @@
 from django.contrib import admin
 from .models import User
 
-admin.site.register(User)  # Userモデルを登録
+
+@admin.register(User)  # Userモデルを登録
+class UserAdmin(admin.ModelAdmin):
+    list_display = ("username", "email", "is_active", "is_staff", "created_at")
+    # "^"で前方一致(istartswith)にし、部分一致(icontains)の全件走査をしない
+    search_fields = ("^username", "^email")
+    # 件数が多いので、ページングのたびに全件数を数えない
+    show_full_result_count = False
+    ordering = ("-id",)
@@ -0,0 +1,110 @@
+"""
+管理者や監視用のビュー達
+通常のリクエストでは使わないので、main_app.urlsのlazy_viewで最初のリクエストの時にimportする
+"""
+from django.conf import settings
+from django.db import router
+from django.http import HttpResponse, HttpResponseForbidden, StreamingHttpResponse
+from django.views import View
+from rest_framework import status
+from rest_framework.generics import ListAPIView
+from rest_framework.permissions import IsAdminUser
+from rest_framework.response import Response
+from rest_framework.settings import api_settings as drf_settings
+from rest_framework.views import APIView
+from .db.metrics import pool_stats
+from .instrumentation import metrics, render_prometheus
+from .models import User
+from .pagination import CreatedAtKeysetPagination, created_at_batches
+from .renderers import NDJSONRenderer
+from .serializer import UserSerializer, UserSearchSerializer
+from .throttling import get_client_ip, throttle_stats
+from .user_search import cached_search_users
+import os
+
+class DBPoolStatsView(APIView):
+  """
+  このプロセスのDB接続の統計を返すビュー(管理者のみ)
+  """
+  permission_classes = (IsAdminUser,)
+
+  def get(self, request, format=None, *args, **kwargs):
+    return Response(data = pool_stats.snapshot(),
+                    status = status.HTTP_200_OK)
+
+class ThrottleStatsView(APIView):
+  """
+  このプロセスのレート制限の統計を返すビュー(管理者のみ)
+  """
+  permission_classes = (IsAdminUser,)
+
+  def get(self, request, format=None, *args, **kwargs):
+    return Response(data = throttle_stats.snapshot(),
+                    status = status.HTTP_200_OK)
+
+class UserSearchView(APIView):
+  """
+  username/emailの前方一致でユーザーを検索するビュー(管理者のみ)
+  ?q=...&field=username|email&limit=20 を受け取り、次のページはレスポンスのnextをcursorに指定する
+  """
+  permission_classes = (IsAdminUser,)
+
+  def get(self, request, format=None, *args, **kwargs):
+    serializer = UserSearchSerializer(data=request.query_params)
+    serializer.is_valid(raise_exception=True)
+    params = serializer.validated_data
+    return Response(data = cached_search_users(params["field"], params["q"],
+                                               params.get("cursor"), params["limit"]),
+                    status = status.HTTP_200_OK)
+
+class UserListView(ListAPIView):
+  """
+  ユーザー一覧を(created_at, id)の順に返すビュー(管理者・サービス間連携用)
+  次のページはレスポンスのnextをたどる
+  Accept: application/x-ndjson(または?format=ndjson)なら、カーソル以降の全ユーザーを1行1件でストリーミングする
+  """
+  permission_classes = (IsAdminUser,)
+  queryset = User.objects.all()
+  serializer_class = UserSerializer
+  pagination_class = CreatedAtKeysetPagination
+  renderer_classes = tuple(drf_settings.DEFAULT_RENDERER_CLASSES) + (NDJSONRenderer,)
+
+  def list(self, request, *args, **kwargs):
+    if(isinstance(request.accepted_renderer, NDJSONRenderer)):
+      return self.stream(request)
+    return super().list(request, *args, **kwargs)
+
+  def stream(self, request):
+    queryset = self.paginator.filter_queryset(self.filter_queryset(self.get_queryset()), request)
+    renderer = request.accepted_renderer
+    # ジェネレーターはリクエストの処理(routing_scope)が終わってから動くので、読み取り先はここで決めておく
+    queryset = queryset.using(router.db_for_read(queryset.model))
+
+    def rows():
+      # キーセットでチャンクごとに読み込み、全件をメモリに載せない
+      for user in created_at_batches(queryset, settings.USER_LIST_STREAM_CHUNK_SIZE):
+        yield renderer.render(self.get_serializer(user).data)
+
+    return StreamingHttpResponse(rows(), content_type=renderer.media_type)
+
+class MetricsView(View):
+  """
+  Prometheus形式のメトリクスを返すビュー(METRICS_ALLOWED_IPSからのみ)
+  エンドポイントごとのヒストグラムとレート制限の回数は全ワーカーの合計、DB接続の統計はこのプロセスの値
+  プロキシの後ろではNUM_PROXIESを設定し、クライアントのアドレスで確認する(設定しないとプロキシのアドレスで確認される)
+  外部に公開するプロキシでは/metricsを転送せず、内部のネットワークからだけ参照するのが望ましい
+  """
+
+  def get(self, request, *args, **kwargs):
+    if(get_client_ip(request) not in settings.METRICS_ALLOWED_IPS):
+      return HttpResponseForbidden()
+    pool = pool_stats.snapshot()
+    pid = {"pid": os.getpid()}
+    extra = [
+      ("accounts_db_connections_open", "gauge", [(pid, pool["open_connections"])]),
+      ("accounts_db_connections_opened_total", "counter", [(pid, pool["opened"])]),
+      ("accounts_db_connection_checkouts_total", "counter", [(pid, pool["checkouts"])]),
+      ("accounts_db_connection_reused_total", "counter", [(pid, pool["reused"])]),
+    ]
+    return HttpResponse(render_prometheus(metrics.collect(), extra),
+                        content_type="text/plain; version=0.0.4; charset=utf-8")
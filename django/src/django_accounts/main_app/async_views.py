@@ -0,0 +1,244 @@
+"""
+ASGIで動かす時の、非同期ORMとワーカープールでのハッシュ化を使った非同期版のビュー
+DRFのビューと同じURL・同じレスポンスの形で、settings.ASYNC_API_VIEWSがTrueの時にurls.pyで使われる
+"""
+from django.conf import settings
+from django.db import IntegrityError
+from django.http import JsonResponse
+from django.utils import timezone
+from django.utils.decorators import classonlymethod
+from django.utils.translation import gettext_lazy as _
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework import status
+from rest_framework.exceptions import APIException, AuthenticationFailed, ParseError, Throttled
+from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
+from rest_framework_simplejwt.settings import api_settings
+from .authentication import CookieJWTAuthentication
+from .db.router import sticky_writes, user_key, login_key
+from .keys import keyring, is_asymmetric
+from .models import User
+from .serializer import UserSerializer
+from .user_index import user_index
+from .throttling import LoginThrottle, SignupThrottle
+from .tokens import RefreshToken, UntypedToken, token_backend
+from .utils import get_jwt_and_set_cookie, ais_user_active
+from . import hashing, token_store
+import json
+
+
+class AsyncAPIView(View):
+  """
+  非同期ビューの基底クラス
+  DRFのAPIViewと同じように、CSRFの確認を行わず、APIExceptionをJSONのエラーレスポンスにする
+  """
+  throttle_classes = ()
+
+  @classonlymethod
+  def as_view(cls, **initkwargs):
+    return csrf_exempt(super().as_view(**initkwargs))
+
+  async def dispatch(self, request, *args, **kwargs):
+    try:
+      await self.prepare_keys()
+      return await super().dispatch(request, *args, **kwargs)
+    except APIException as exc:
+      return self.handle_exception(exc)
+
+  def handle_exception(self, exc):
+    data = exc.detail if isinstance(exc.detail, (dict, list)) else {"detail": exc.detail}
+    response = JsonResponse(data, status=exc.status_code, safe=False)
+    if getattr(exc, "wait", None):
+      response["Retry-After"] = "%d" % exc.wait
+    if isinstance(exc, AuthenticationFailed):
+      response["WWW-Authenticate"] = CookieJWTAuthentication().authenticate_header(self.request)
+    return response
+
+  def get_data(self, request):
+    """
+    リクエストのbodyのJSONを辞書にする
+    """
+    try:
+      data = json.loads(request.body or b"{}")
+    except ValueError as exc:
+      raise ParseError("JSON parse error - %s" % exc)
+    if not isinstance(data, dict):
+      raise ParseError()
+    return data
+
+  async def check_throttles(self, request, data):
+    """
+    レート制限を超えていればThrottledを送出する
+    """
+    waits = []
+    for throttle_class in self.throttle_classes:
+      throttle = throttle_class()
+      if not await throttle.acheck(request, data):
+        waits.append(throttle.wait())
+    if waits:
+      raise Throttled(wait=max(waits))
+
+  async def prepare_keys(self, raw_token=None):
+    """
+    RS256などの時は、トークンを発行・検証する前に署名の鍵を読み込んでおく(イベントループ上ではDBを参照しないため)
+    raw_tokenを渡すと、そのトークンのkidの公開鍵がなければ読み込み直す
+    """
+    if is_asymmetric(token_backend.algorithm):
+      await keyring.aensure_loaded(raw_token)
+
+  async def get_token(self, token_class, raw_token):
+    await self.prepare_keys(raw_token)
+    try:
+      return token_class(raw_token)
+    except TokenError as e:
+      raise InvalidToken(e.args[0])
+
+  def required(self, data, *fields):
+    errors = {field: [_("This field is required.")] for field in fields if not data.get(field)}
+    if errors:
+      return JsonResponse(errors, status=status.HTTP_400_BAD_REQUEST)
+    return None
+
+class AsyncIsLoginView(AsyncAPIView):
+  """
+  ログイン確認用ビュー(非同期版)
+  """
+
+  async def get(self, request, *args, **kwargs):
+    data = {"loginFlg": False}
+    authentication = CookieJWTAuthentication()
+    raw_token, _from_cookie = authentication.get_raw_token_from_request(request)
+    if(raw_token is not None):
+      await self.prepare_keys(raw_token)
+      validated_token = authentication.get_validated_token(raw_token)
+      if(settings.IS_LOGIN_STATELESS):
+        user_id = validated_token.get(api_settings.USER_ID_CLAIM)
+        data["loginFlg"] = settings.IS_LOGIN_ACTIVE_CHECK_TTL <= 0 or (
+          user_id is not None and await ais_user_active(user_id)
+        )
+      else:
+        data["loginFlg"] = bool(await authentication.aget_user(validated_token))
+    return JsonResponse(data, status=status.HTTP_200_OK)
+
+class AsyncSignupView(AsyncAPIView):
+  """
+  ユーザー登録用ビュー(非同期版)
+  """
+  throttle_classes = (SignupThrottle,)
+  valid_fields = ("username", "email", "password")
+
+  async def post(self, request, *args, **kwargs):
+    data = self.get_data(request)
+    await self.check_throttles(request, data)
+    serializer = UserSerializer(data=data, context={"check_exists": False})
+    if not serializer.is_valid(valid_fields=self.valid_fields):
+      return JsonResponse(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+    # パスワードをハッシュ化する前に重複を確認する
+    taken = await user_index.ataken_fields(User, serializer.validated_data)
+    if taken:
+      return JsonResponse(serializer.taken_errors(taken), status=status.HTTP_400_BAD_REQUEST)
+
+    validated_data = dict(serializer.validated_data)
+    password = validated_data.pop("password", None)
+    user = User(**validated_data)
+    user.email = User.objects.normalize_email(user.email)
+    user.password = await hashing.amake_password(password)
+    try:
+      await user.asave()
+    except IntegrityError:
+      return JsonResponse(serializer.exists_errors(), status=status.HTTP_400_BAD_REQUEST)
+
+    # JWTを発行してクッキーにセットする。そのレスポンスを返す
+    response = JsonResponse(UserSerializer(user).data, status=status.HTTP_201_CREATED)
+    return get_jwt_and_set_cookie(user, response)
+
+class AsyncTokenObtainPairView(AsyncAPIView):
+  """
+  トークン発行用ビュー(非同期版)
+  """
+  throttle_classes = (LoginThrottle,)
+  username_field = User.USERNAME_FIELD
+
+  async def post(self, request, *args, **kwargs):
+    data = self.get_data(request)
+    await self.check_throttles(request, data)
+    errors = self.required(data, self.username_field, "password")
+    if errors:
+      return errors
+
+    password = data["password"]
+    await sticky_writes.acheck(login_key(data[self.username_field]))
+    user = await User.objects.filter(**{self.username_field: data[self.username_field]}).afirst()
+    if(user is None):
+      # ユーザーが存在しない時も同じだけ時間をかけ、ユーザーの有無を推測されないようにする
+      await hashing.amake_password(password)
+    else:
+      is_correct, must_update = await hashing.acheck_password(password, user.password)
+      if(is_correct and must_update):
+        user.password = await hashing.amake_password(password)
+        await user.asave(update_fields=["password"])
+      if(not is_correct):
+        user = None
+
+    if not api_settings.USER_AUTHENTICATION_RULE(user):
+      raise AuthenticationFailed(_("No active account found with the given credentials"),
+                                 code="no_active_account")
+
+    refresh = RefreshToken.for_user(user)
+    if api_settings.UPDATE_LAST_LOGIN:
+      user.last_login = timezone.now()
+      await user.asave(update_fields=["last_login"])
+    return JsonResponse({"refresh": str(refresh), "access": str(refresh.access_token)},
+                        status=status.HTTP_200_OK)
+
+class AsyncTokenRefreshView(AsyncAPIView):
+  """
+  トークン更新用ビュー(非同期版)
+  """
+
+  async def post(self, request, *args, **kwargs):
+    data = self.get_data(request)
+    errors = self.required(data, "refresh")
+    if errors:
+      return errors
+
+    refresh = await self.get_token(RefreshToken, data["refresh"])
+    if api_settings.ROTATE_REFRESH_TOKENS:
+      # 使用済みのトークンを失効リストに記録し、記録済みなら再利用とみなして弾く
+      if not await token_store.arevoke(refresh):
+        raise InvalidToken(_("Token is blacklisted"))
+    elif await token_store.ais_revoked(refresh):
+      raise InvalidToken(_("Token is blacklisted"))
+
+    user_id = refresh.payload.get(api_settings.USER_ID_CLAIM)
+    if user_id:
+      await sticky_writes.acheck(user_key(user_id))
+      user = await User.objects.filter(**{api_settings.USER_ID_FIELD: user_id}).afirst()
+      if not api_settings.USER_AUTHENTICATION_RULE(user):
+        raise AuthenticationFailed(_("No active account found for the given token."),
+                                   code="no_active_account")
+
+    result = {"access": str(refresh.access_token)}
+    if api_settings.ROTATE_REFRESH_TOKENS:
+      refresh.set_jti()
+      refresh.set_exp()
+      refresh.set_iat()
+      result["refresh"] = str(refresh)
+    return JsonResponse(result, status=status.HTTP_200_OK)
+
+class AsyncTokenVerifyView(AsyncAPIView):
+  """
+  トークン検証用ビュー(非同期版)
+  """
+
+  async def post(self, request, *args, **kwargs):
+    data = self.get_data(request)
+    errors = self.required(data, "token")
+    if errors:
+      return errors
+
+    token = await self.get_token(UntypedToken, data["token"])
+    if token.get(api_settings.TOKEN_TYPE_CLAIM) == "refresh" and await token_store.ais_revoked(token):
+      return JsonResponse({"detail": [_("Token is blacklisted")]}, status=status.HTTP_400_BAD_REQUEST)
+    return JsonResponse({}, status=status.HTTP_200_OK)
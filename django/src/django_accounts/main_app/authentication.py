@@ -0,0 +1,138 @@
+"""
+このアプリで使う認証クラス達
+"""
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+from rest_framework_simplejwt.utils import datetime_from_epoch, aware_utcnow
+from django.conf import settings
+from django.utils.translation import gettext_lazy as _
+from rest_framework.exceptions import ValidationError
+from .db.router import sticky_writes, user_key
+from .user_cache import user_cache, shared_user_cache
+import datetime
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """
+    jwtのuser_idをキーにして、取得したユーザーをキャッシュに保持する認証クラス
+    プロセス内のLRUキャッシュ、全ワーカー共有のスナップショット、DBの順に参照する
+    同じユーザーからの連続したリクエストではDBを参照しない
+    """
+
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_("Token contained no recognizable user identification"))
+
+        user = user_cache.get(user_id)
+        if(user is None):
+          sticky_writes.check(user_key(user_id))
+          user = shared_user_cache.get_or_load(self.user_model, user_id)
+          if(user is None):
+            raise AuthenticationFailed(_("User not found"), code="user_not_found")
+          user_cache.set(user_id, user)
+
+        self.check_user(user, validated_token)
+        return user
+
+    async def aget_user(self, validated_token):
+        """
+        get_userの非同期版(非同期ビュー用)
+        共有スナップショットは参照せず、プロセス内のキャッシュになければ非同期ORMで取得する
+        """
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_("Token contained no recognizable user identification"))
+
+        user = user_cache.get(user_id)
+        if(user is None):
+          await sticky_writes.acheck(user_key(user_id))
+          user = await self.user_model.objects.filter(**{api_settings.USER_ID_FIELD: user_id}).afirst()
+          if(user is None):
+            raise AuthenticationFailed(_("User not found"), code="user_not_found")
+          user_cache.set(user_id, user)
+
+        self.check_user(user, validated_token)
+        return user
+
+    def check_user(self, user, validated_token):
+        """
+        キャッシュから取り出したユーザーにも、JWTAuthenticationと同じ確認を行う
+        """
+        if api_settings.CHECK_USER_IS_ACTIVE and not user.is_active:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+
+        if api_settings.CHECK_REVOKE_TOKEN:
+            # 共有スナップショットから作ったユーザーはパスワードのハッシュを持たないので、そのmd5で比べる
+            password_md5 = getattr(user, "password_md5", None) or get_md5_hash_password(user.password)
+            if validated_token.get(api_settings.REVOKE_TOKEN_CLAIM) != password_md5:
+                raise AuthenticationFailed(_("The user's password has been changed."), code="password_changed")
+
+
+class CookieJWTAuthentication(CachedJWTAuthentication):
+    """
+    Authorizationヘッダー、なければget_jwt_and_set_cookieがセットしたクッキーからjwtを読み込む認証クラス
+    結果はリクエストごとに保持し、同じリクエストの中で何度呼ばれてもjwtの検証は1回だけ行う
+    クッキーのアクセストークンの期限が近ければ、リフレッシュトークンのクッキーで更新する
+    (新しいトークンはJWTCookieRefreshMiddlewareがレスポンスのクッキーにセットする)
+    """
+
+    def get_raw_token_from_request(self, request):
+        """
+        (jwt, クッキーから読み込んだか)を返す。jwtがなければ(None, False)
+        """
+        header = self.get_header(request)
+        if(header is not None):
+          raw_token = self.get_raw_token(header)
+          if(raw_token is not None):
+            return raw_token, False
+
+        cookie = request.COOKIES.get(settings.JWT_ACCESS_COOKIE)
+        if(cookie):
+          return self.get_raw_token(cookie.encode()), True
+        return None, False
+
+    def authenticate(self, request):
+        http_request = getattr(request, "_request", request)
+        if(hasattr(http_request, "_jwt_authentication")):
+          return http_request._jwt_authentication
+
+        result = None
+        raw_token, from_cookie = self.get_raw_token_from_request(request)
+        if(raw_token is not None):
+          validated_token = self.get_validated_token(raw_token)
+          result = (self.get_user(validated_token), validated_token)
+          if(from_cookie):
+            self.refresh_if_expiring(http_request, validated_token)
+
+        http_request._jwt_authentication = result
+        return result
+
+    def refresh_if_expiring(self, http_request, validated_token):
+        """
+        アクセストークンの残り時間がJWT_COOKIE_REFRESH_MARGIN秒を切っていたら、
+        リフレッシュトークンのクッキーで新しいトークンを発行してリクエストに保持する
+        """
+        refresh_cookie = http_request.COOKIES.get(settings.JWT_REFRESH_COOKIE)
+        if(not refresh_cookie or "exp" not in validated_token):
+          return
+        remaining = datetime_from_epoch(validated_token["exp"]) - aware_utcnow()
+        if(remaining > datetime.timedelta(seconds=settings.JWT_COOKIE_REFRESH_MARGIN)):
+          return
+
+        from .serializer import TokenRefreshSerializer
+
+        serializer = TokenRefreshSerializer(data={"refresh": refresh_cookie})
+        try:
+          serializer.is_valid(raise_exception=True)
+        except (InvalidToken, AuthenticationFailed, ValidationError):
+          # 同時に来た別のリクエストが先に更新した場合など。アクセストークンはまだ有効なのでそのまま続ける
+          return
+        http_request._jwt_refreshed = {
+          "access": serializer.validated_data["access"],
+          "refresh": serializer.validated_data.get("refresh", refresh_cookie),
+        }
@@ -0,0 +1,98 @@
+"""
+DB接続の再利用状況を計測する
+"""
+import threading
+import time
+
+
+class PoolStats:
+    """
+    プロセス内のDB接続の統計
+    checkouts: リクエスト(またはタスク)がDB接続を使い始めた回数
+    reused: そのうち永続接続を再利用できた回数
+    connect_wait: 新しく接続する(TCP+認証のハンドシェイク)のにかかった時間
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+          self.open_connections = 0
+          self.max_open_connections = 0
+          self.opened = 0
+          self.closed = 0
+          self.checkouts = 0
+          self.reused = 0
+          self.connect_wait_total = 0.0
+          self.connect_wait_max = 0.0
+
+    def record_connect(self, seconds):
+        with self._lock:
+          self.opened += 1
+          self.open_connections += 1
+          self.max_open_connections = max(self.max_open_connections, self.open_connections)
+          self.connect_wait_total += seconds
+          self.connect_wait_max = max(self.connect_wait_max, seconds)
+
+    def record_close(self):
+        with self._lock:
+          self.closed += 1
+          self.open_connections = max(self.open_connections - 1, 0)
+
+    def record_checkout(self, reused):
+        with self._lock:
+          self.checkouts += 1
+          if(reused):
+            self.reused += 1
+
+    def snapshot(self):
+        with self._lock:
+          new_connections = self.checkouts - self.reused
+          return {
+            "open_connections": self.open_connections,
+            "max_open_connections": self.max_open_connections,
+            "opened": self.opened,
+            "closed": self.closed,
+            "checkouts": self.checkouts,
+            "reused": self.reused,
+            "reuse_ratio": self.reused / self.checkouts if self.checkouts else 0.0,
+            "connect_wait_total": self.connect_wait_total,
+            "connect_wait_max": self.connect_wait_max,
+            "connect_wait_avg": self.connect_wait_total / self.opened if self.opened else 0.0,
+            "new_connections": new_connections,
+          }
+
+
+pool_stats = PoolStats()
+
+
+class PoolMetricsMixin:
+    """
+    DatabaseWrapperに混ぜて、接続の作成・再利用・切断を計測する
+    """
+    _pool_checked_out = False
+
+    def get_new_connection(self, conn_params):
+        start = time.perf_counter()
+        connection = super().get_new_connection(conn_params)
+        pool_stats.record_connect(time.perf_counter() - start)
+        return connection
+
+    def ensure_connection(self):
+        # リクエストの中で最初にDBを使う時だけ数える
+        if(not self._pool_checked_out):
+          self._pool_checked_out = True
+          pool_stats.record_checkout(reused=self.connection is not None)
+        super().ensure_connection()
+
+    def close_if_unusable_or_obsolete(self):
+        # リクエストの開始・終了時に呼ばれるので、ここで貸し出しを区切る
+        self._pool_checked_out = False
+        super().close_if_unusable_or_obsolete()
+
+    def _close(self):
+        if(self.connection is not None):
+          pool_stats.record_close()
+        super()._close()
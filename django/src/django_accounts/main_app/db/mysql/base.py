@@ -0,0 +1,10 @@
+"""
+接続の統計を取るMySQLバックエンド
+DATABASESのENGINEに'main_app.db.mysql'を指定して使う
+"""
+from django.db.backends.mysql import base
+from ..metrics import PoolMetricsMixin
+
+
+class DatabaseWrapper(PoolMetricsMixin, base.DatabaseWrapper):
+    pass
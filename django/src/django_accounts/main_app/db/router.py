@@ -0,0 +1,129 @@
+"""
+Userの読み取りをレプリカに振り分けるDBルーター
+DATABASE_REPLICAS(DB_REPLICA_HOSTSから作る)があれば、Userの読み取りはレプリカのどれかに、書き込みはdefault(プライマリ)に送る
+レプリカへの反映は遅れるので、書き込んだユーザーの読み取りはREPLICA_STICKY_SECONDS秒だけプライマリで行う
+書き込んだユーザーの記録はCACHES(REPLICA_STICKY_CACHE_ALIAS)に置くので、全ワーカー・全ノードで共有される
+"""
+from contextlib import contextmanager
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS, connections
+import contextvars
+import random
+
+# 処理中のリクエストの読み取りをプライマリに固定しているか(リクエストの外ではNone)
+_pinned = contextvars.ContextVar("db_pinned", default=None)
+
+
+@contextmanager
+def routing_scope(pinned=False):
+    """
+    withブロックの中を1リクエストとして、読み取り先の固定を初期化する
+    """
+    token = _pinned.set(pinned)
+    try:
+      yield
+    finally:
+      _pinned.reset(token)
+
+def pin_primary():
+    """
+    処理中のリクエストの残りの読み取りをプライマリで行う
+    リクエストの外(管理コマンドなど)では、以降のすべての読み取りが固定されないように何もしない
+    """
+    if(_pinned.get() is not None):
+      _pinned.set(True)
+
+def is_pinned():
+    return bool(_pinned.get())
+
+def user_key(user_id):
+    return "user:%s" % user_id
+
+def login_key(value):
+    # ログインに使う値(USERNAME_FIELD)は大文字小文字を区別しない
+    return "login:%s" % str(value).strip().lower()
+
+
+class StickyWrites:
+    """
+    書き込んだユーザーをseconds秒だけ記録し、その間のそのユーザーの読み取りをプライマリに固定する
+    キーはユーザーのid(user_key)とログインに使う値(login_key)
+    レプリカがなければ何もしない
+    """
+    key_prefix = "db_sticky:"
+
+    def __init__(self, alias, seconds):
+        self.alias = alias
+        self.seconds = seconds
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    @property
+    def enabled(self):
+        return bool(settings.DATABASE_REPLICAS) and self.seconds > 0
+
+    def stick(self, *keys):
+        """
+        keysのユーザーに書き込んだことを記録し、処理中のリクエストの読み取りもプライマリに固定する
+        """
+        if(not self.enabled):
+          return
+        pin_primary()
+        self.cache.set_many({self.key_prefix + key: 1 for key in keys}, self.seconds)
+
+    def check(self, *keys):
+        """
+        keysのどれかに最近書き込んでいれば、処理中のリクエストの読み取りをプライマリに固定する
+        """
+        if(not self.enabled or _pinned.get()):
+          return
+        if(self.cache.get_many([self.key_prefix + key for key in keys])):
+          pin_primary()
+
+    async def acheck(self, *keys):
+        """
+        checkの非同期版
+        """
+        if(not self.enabled or _pinned.get()):
+          return
+        if(await self.cache.aget_many([self.key_prefix + key for key in keys])):
+          pin_primary()
+
+
+sticky_writes = StickyWrites(settings.REPLICA_STICKY_CACHE_ALIAS, settings.REPLICA_STICKY_SECONDS)
+
+
+class PrimaryReplicaRouter:
+    """
+    modelsの読み取りをレプリカに、それ以外のモデルと書き込みはすべてdefault(プライマリ)に送る
+    リフレッシュトークンの失効リストなどは書き込んだ直後に読むので、レプリカには送らない
+    """
+    models = ("main_app.User",)
+
+    def db_for_read(self, model, **hints):
+        replicas = settings.DATABASE_REPLICAS
+        if(not replicas or model._meta.label not in self.models or _pinned.get()):
+          return DEFAULT_DB_ALIAS
+        # トランザクションの中では、書き込んだ内容が見えるようにプライマリで読む
+        if(connections[DEFAULT_DB_ALIAS].in_atomic_block):
+          return DEFAULT_DB_ALIAS
+        return random.choice(replicas)
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # レプリカはプライマリの複製なので、どの組み合わせでも関連付けてよい
+        databases = {DEFAULT_DB_ALIAS, *settings.DATABASE_REPLICAS}
+        if(obj1._state.db in databases and obj2._state.db in databases):
+          return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # レプリカにはプライマリから複製されるので、マイグレーションはプライマリにだけ行う
+        if(db in settings.DATABASE_REPLICAS):
+          return False
+        return None
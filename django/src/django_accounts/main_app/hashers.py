@@ -0,0 +1,42 @@
+"""
+パラメーターを設定で調整できるパスワードハッシュ
+PASSWORD_HASHER_PROFILEで選んだハッシュが新しいパスワードに使われ、
+パラメーターが変わった古いハッシュはログイン成功時にハッシュ化し直される
+"""
+from django.conf import settings
+from django.contrib.auth.hashers import (PBKDF2PasswordHasher,
+                                         ScryptPasswordHasher,
+                                         Argon2PasswordHasher)
+
+
+class ProfileParamsMixin:
+    """
+    PASSWORD_HASHER_PARAMS[profile]の値でハッシュのパラメーターを上書きする
+    """
+    profile = None
+
+    def __init__(self, **params):
+        configured = getattr(settings, "PASSWORD_HASHER_PARAMS", {}).get(self.profile, {})
+        for key, value in {**configured, **params}.items():
+            setattr(self, key, int(value))
+
+
+class TunedPBKDF2PasswordHasher(ProfileParamsMixin, PBKDF2PasswordHasher):
+    profile = "pbkdf2"
+
+
+class TunedScryptPasswordHasher(ProfileParamsMixin, ScryptPasswordHasher):
+    profile = "scrypt"
+
+    def __init__(self, **params):
+        super().__init__(**params)
+        # work_factorを上げるとOpenSSLの既定の上限(32MB)を超えるので、必要なメモリから上限を決める
+        if(not self.maxmem):
+          self.maxmem = 256 * self.work_factor * self.block_size
+
+
+class TunedArgon2PasswordHasher(ProfileParamsMixin, Argon2PasswordHasher):
+    """
+    argon2-cffiが必要(pip install argon2-cffi)
+    """
+    profile = "argon2"
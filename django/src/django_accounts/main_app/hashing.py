@@ -0,0 +1,153 @@
+"""
+パスワードのハッシュ化を、同時実行数を制限したワーカープールで行う
+プールとキューが埋まっている時は待たずに503エラーを返し、
+ログインが集中してもis_loginなどの軽いエンドポイントのワーカーを占有しないようにする
+"""
+from asgiref.sync import sync_to_async
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from django.conf import settings
+from django.contrib.auth import hashers
+from django.utils.translation import gettext_lazy as _
+from rest_framework import status
+from rest_framework.exceptions import APIException
+from .instrumentation import timed
+import asyncio
+import threading
+
+
+class HashingBusy(APIException):
+    """
+    ハッシュ化の待ち行列が埋まっている時のエラー(Retry-Afterヘッダー付きの503)
+    """
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = _("Password hashing is busy. Please retry later.")
+    default_code = "hashing_busy"
+
+    def __init__(self, detail=None, code=None, wait=None):
+        super().__init__(detail, code)
+        self.wait = wait
+
+
+class HashingExecutor:
+    """
+    ハッシュ化用のワーカープール
+    kind: "thread"(PBKDF2などGILを解放するハッシュ向け)、"process"、"inline"(リクエストのスレッドで実行)
+    workers: 同時にハッシュ化する数
+    queue_size: ワーカーが埋まっている時に待たせる数。これを超えるとHashingBusyを送出する
+    """
+
+    def __init__(self, kind, workers, queue_size, retry_after=1):
+        self.kind = kind
+        self.workers = workers
+        self.queue_size = queue_size
+        self.retry_after = retry_after
+        self._slots = threading.BoundedSemaphore(workers + queue_size) if workers > 0 else None
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        # preforkするサーバーでは、ワーカープロセスごとに最初に使われた時に作る
+        if(self._executor is None):
+          with self._lock:
+            if(self._executor is None):
+              pool_class = ProcessPoolExecutor if self.kind == "process" else ThreadPoolExecutor
+              self._executor = pool_class(max_workers=self.workers)
+        return self._executor
+
+    def submit(self, fn, *args):
+        """
+        ハッシュ化を投入してFutureを返す。空きがなければHashingBusyを送出する
+        """
+        if(not self._slots.acquire(blocking=False)):
+          raise HashingBusy(wait=self.retry_after)
+        try:
+          future = self._get_executor().submit(fn, *args)
+        except BaseException:
+          self._slots.release()
+          raise
+        future.add_done_callback(lambda _future: self._slots.release())
+        return future
+
+    def run(self, fn, *args):
+        """
+        ハッシュ化を実行して結果を返す
+        """
+        if(self.kind == "inline" or self._slots is None):
+          return fn(*args)
+        return self.submit(fn, *args).result()
+
+    async def arun(self, fn, *args):
+        """
+        イベントループを止めずにハッシュ化を実行して結果を返す
+        inlineやワーカー数が0の時も、イベントループの上では実行せずにスレッドで実行する
+        (イベントループで実行すると、ハッシュ化の間はそのワーカーのすべての接続が止まる)
+        """
+        if(self.kind == "inline" or self._slots is None):
+          return await sync_to_async(fn, thread_sensitive=False)(*args)
+        return await asyncio.wrap_future(self.submit(fn, *args))
+
+
+executor = HashingExecutor(kind=settings.PASSWORD_HASHING_EXECUTOR,
+                           workers=settings.PASSWORD_HASHING_WORKERS,
+                           queue_size=settings.PASSWORD_HASHING_QUEUE_SIZE,
+                           retry_after=settings.PASSWORD_HASHING_RETRY_AFTER)
+
+
+def _verify_password(password, encoded, preferred="default"):
+    """
+    django.contrib.auth.hashers.check_passwordと同じ検証を行い、(一致したか, 再ハッシュが必要か)を返す
+    DBへの書き込みを伴うsetterはワーカーでは呼ばない
+    """
+    if password is None or not hashers.is_password_usable(encoded):
+        return False, False
+    preferred = hashers.get_hasher(preferred)
+    try:
+        hasher = hashers.identify_hasher(encoded)
+    except ValueError:
+        return False, False
+
+    hasher_changed = hasher.algorithm != preferred.algorithm
+    must_update = hasher_changed or preferred.must_update(encoded)
+    is_correct = hasher.verify(password, encoded)
+
+    # 不一致の時も一致した時と同じだけ時間をかけ、タイミング攻撃を防ぐ
+    if not is_correct and not hasher_changed and must_update:
+        hasher.harden_runtime(password, encoded)
+    return is_correct, must_update
+
+
+def make_password(password):
+    """
+    ワーカープールでパスワードをハッシュ化する
+    """
+    with timed("hash"):
+      return executor.run(hashers.make_password, password)
+
+
+def check_password(password, encoded, setter=None, preferred="default"):
+    """
+    ワーカープールでパスワードを検証する
+    一致してハッシュの更新が必要な時は、リクエストのスレッドでsetterを呼ぶ
+    """
+    with timed("hash"):
+      is_correct, must_update = executor.run(_verify_password, password, encoded, preferred)
+    if setter and is_correct and must_update:
+        setter(password)
+    return is_correct
+
+
+async def amake_password(password):
+    """
+    make_passwordの非同期版
+    """
+    with timed("hash"):
+      return await executor.arun(hashers.make_password, password)
+
+
+async def acheck_password(password, encoded, preferred="default"):
+    """
+    check_passwordの非同期版
+    DBへの書き込みは呼び出し側で非同期に行えるように、(一致したか, 再ハッシュが必要か)を返す
+    """
+    with timed("hash"):
+      return await executor.arun(_verify_password, password, encoded, preferred)
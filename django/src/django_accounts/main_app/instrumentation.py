@@ -0,0 +1,244 @@
+"""
+リクエストごとの処理時間の計測
+DBのクエリ・パスワードのハッシュ化・jwtの署名と検証・レスポンスのシリアライズの時間を数え、
+Server-Timingヘッダーで返すとともに、エンドポイントごとのヒストグラムに集計する
+ヒストグラムはプロセス内で差分を溜め、METRICS_FLUSH_INTERVAL秒ごとにCACHES(METRICS_CACHE_ALIAS)へ
+incrで足し込むので、複数のワーカー・ノードの値がそのまま合算される
+"""
+from contextlib import contextmanager
+from django.conf import settings
+from django.core.cache import caches
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+import contextvars
+import threading
+import time
+
+# ヒストグラムのバケットの上限(秒)
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+# 計測する処理と、Prometheusのメトリクス名
+TIMERS = {
+    "total": "accounts_request_duration_seconds",
+    "db": "accounts_db_duration_seconds",
+    "hash": "accounts_password_hash_duration_seconds",
+    "jwt": "accounts_jwt_duration_seconds",
+    "serialize": "accounts_serialize_duration_seconds",
+}
+
+_current = contextvars.ContextVar("request_timings", default=None)
+
+
+class RequestTimings:
+    """
+    1リクエストの処理ごとの合計時間(秒)とクエリ数
+    """
+    __slots__ = ("durations", "db_queries")
+
+    def __init__(self):
+        self.durations = {}
+        self.db_queries = 0
+
+    def add(self, name, seconds):
+        self.durations[name] = self.durations.get(name, 0.0) + seconds
+
+    def server_timing(self):
+        """
+        Server-Timingヘッダーの値(ミリ秒)
+        """
+        entries = []
+        for name in TIMERS:
+          if name in self.durations:
+            entry = "%s;dur=%.2f" % (name, self.durations[name] * 1000)
+            if name == "db":
+              entry += ';desc="%d queries"' % self.db_queries
+            entries.append(entry)
+        return ", ".join(entries)
+
+
+@contextmanager
+def timed(name):
+    """
+    withブロックの時間を、処理中のリクエストの計測に加える(リクエストの外では何もしない)
+    """
+    timings = _current.get()
+    if timings is None:
+      yield
+      return
+    start = time.perf_counter()
+    try:
+      yield
+    finally:
+      timings.add(name, time.perf_counter() - start)
+
+def _db_wrapper(execute, sql, params, many, context):
+    timings = _current.get()
+    if timings is None:
+      return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+      return execute(sql, params, many, context)
+    finally:
+      timings.add("db", time.perf_counter() - start)
+      timings.db_queries += 1
+
+@receiver(connection_created)
+def install_db_wrapper(sender, connection, **kwargs):
+    """
+    DB接続ごとに1回だけクエリの計測を組み込む(リクエストの外では何もしない)
+    リクエストごとにexecute_wrapperを付け外しするより安い
+    """
+    if _db_wrapper not in connection.execute_wrappers:
+      connection.execute_wrappers.append(_db_wrapper)
+
+@contextmanager
+def measure_request():
+    """
+    withブロックの中を1リクエストとして計測し、RequestTimingsを返す
+    """
+    timings = RequestTimings()
+    token = _current.set(timings)
+    start = time.perf_counter()
+    try:
+      yield timings
+    finally:
+      timings.add("total", time.perf_counter() - start)
+      _current.reset(token)
+
+
+class MetricsRegistry:
+    """
+    エンドポイントごとのヒストグラムとカウンタ
+    値はプロセス内に差分として溜め、flushでキャッシュに足し込む。collectはキャッシュから全プロセスの合計を読む
+    系列の一覧もキャッシュに保存し、消えていたらflushのたびに登録し直す
+    """
+    key_prefix = "metrics:"
+    series_key = "metrics:series"
+
+    def __init__(self, alias, flush_interval):
+        self.alias = alias
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._deltas = {}
+        self._registered = set()
+        self._last_flush = time.monotonic()
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def _add(self, series, value):
+        self._deltas[series] = self._deltas.get(series, 0) + value
+
+    def observe_request(self, endpoint, timings):
+        with self._lock:
+          for name, seconds in timings.durations.items():
+            index = next((i for i, bound in enumerate(BUCKETS) if seconds <= bound), len(BUCKETS))
+            self._add("h|%s|%s|%d" % (name, endpoint, index), 1)
+            # キャッシュのincrは整数だけなので、合計はマイクロ秒で持つ
+            self._add("s|%s|%s" % (name, endpoint), int(seconds * 1000000))
+          if timings.db_queries:
+            self._add("c|db_queries|%s" % endpoint, timings.db_queries)
+        self.maybe_flush()
+
+    def inc(self, name, label, value=1):
+        with self._lock:
+          self._add("c|%s|%s" % (name, label), value)
+
+    def maybe_flush(self):
+        if time.monotonic() - self._last_flush >= self.flush_interval:
+          self.flush()
+
+    def flush(self):
+        with self._lock:
+          deltas, self._deltas = self._deltas, {}
+          self._last_flush = time.monotonic()
+        if not deltas:
+          return
+        cache = self.cache
+        for series, value in deltas.items():
+          key = self.key_prefix + series
+          cache.add(key, 0, None)
+          try:
+            cache.incr(key, value)
+          except ValueError:
+            cache.set(key, value, None)
+
+        # 系列の一覧は排他せずに更新するので、他のプロセスと競合して消えた分は次のflushで登録し直す
+        registered = set(cache.get(self.series_key, ()))
+        missing = (self._registered | set(deltas)) - registered
+        if missing:
+          cache.set(self.series_key, sorted(registered | missing), None)
+        self._registered |= set(deltas)
+
+    def collect(self):
+        """
+        全プロセスの合計を{系列: 値}で返す
+        """
+        self.flush()
+        series = self.cache.get(self.series_key, ())
+        values = self.cache.get_many([self.key_prefix + name for name in series])
+        return {name: values.get(self.key_prefix + name, 0) for name in series}
+
+    def clear(self):
+        series = self.cache.get(self.series_key, ())
+        self.cache.delete_many([self.key_prefix + name for name in series] + [self.series_key])
+        with self._lock:
+          self._deltas = {}
+          self._registered = set()
+
+
+metrics = MetricsRegistry(settings.METRICS_CACHE_ALIAS, settings.METRICS_FLUSH_INTERVAL)
+
+
+def _format_labels(**labels):
+    return "{%s}" % ",".join('%s="%s"' % (key, str(value).replace("\\", "\\\\").replace('"', '\\"'))
+                             for key, value in labels.items())
+
+def render_prometheus(values, extra=()):
+    """
+    collectの結果をPrometheusのテキスト形式にする
+    extraには(メトリクス名, 種類, [(ラベルの辞書, 値)])を追加で渡せる
+    """
+    histograms = {}
+    sums = {}
+    counters = {}
+    for series, value in values.items():
+      kind, name, label, *rest = series.split("|")
+      if kind == "h":
+        histograms.setdefault((name, label), [0] * (len(BUCKETS) + 1))[int(rest[0])] += value
+      elif kind == "s":
+        sums[(name, label)] = value / 1000000
+      else:
+        counters.setdefault(name, []).append((label, value))
+
+    lines = []
+    for name, metric in TIMERS.items():
+      endpoints = sorted(label for timer, label in histograms if timer == name)
+      if not endpoints:
+        continue
+      lines.append("# TYPE %s histogram" % metric)
+      for endpoint in endpoints:
+        counts = histograms[(name, endpoint)]
+        cumulative = 0
+        for bound, count in zip(BUCKETS + ("+Inf",), counts):
+          cumulative += count
+          lines.append("%s_bucket%s %d" % (metric, _format_labels(endpoint=endpoint, le=bound), cumulative))
+        lines.append("%s_sum%s %f" % (metric, _format_labels(endpoint=endpoint), sums.get((name, endpoint), 0)))
+        lines.append("%s_count%s %d" % (metric, _format_labels(endpoint=endpoint), cumulative))
+
+    if "db_queries" in counters:
+      lines.append("# TYPE accounts_db_queries_total counter")
+      for endpoint, value in sorted(counters["db_queries"]):
+        lines.append("accounts_db_queries_total%s %d" % (_format_labels(endpoint=endpoint), value))
+    for result in ("allowed", "throttled"):
+      name = "throttle_%s" % result
+      if name in counters:
+        lines.append("# TYPE accounts_throttle_%s_total counter" % result)
+        for scope, value in sorted(counters[name]):
+          lines.append("accounts_throttle_%s_total%s %d" % (result, _format_labels(scope=scope), value))
+
+    for metric, kind, samples in extra:
+      lines.append("# TYPE %s %s" % (metric, kind))
+      for labels, value in samples:
+        lines.append("%s%s %s" % (metric, _format_labels(**labels), value))
+    return "\n".join(lines) + "\n"
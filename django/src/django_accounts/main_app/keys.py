@@ -0,0 +1,181 @@
+"""
+jwtの署名に使う非対称鍵の管理
+鍵はSigningKeyモデルに保存し、各プロセスではJWT_KEYRING_TTL秒だけメモリに保持する
+イベントループ上(非同期のビュー)ではDBを参照しないので、aensure_loadedで読み込んでからトークンを扱う
+"""
+from asgiref.sync import sync_to_async
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec, ed25519, rsa
+from django.conf import settings
+from django.core.exceptions import SynchronousOnlyOperation
+from django.db import transaction
+from django.utils import timezone
+from jwt.algorithms import ECAlgorithm, OKPAlgorithm, RSAAlgorithm
+from rest_framework_simplejwt.settings import api_settings
+from .models import SigningKey
+from .token_cache import decoded_token_cache
+import asyncio
+import jwt
+import threading
+import time
+import uuid
+
+ASYMMETRIC_ALGORITHMS = ("RS256", "RS384", "RS512", "ES256", "ES384", "ES512", "EdDSA")
+
+
+def is_asymmetric(algorithm):
+    return algorithm in ASYMMETRIC_ALGORITHMS
+
+def _in_event_loop():
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return False
+    return True
+
+def _passphrase():
+    return settings.SECRET_KEY.encode()
+
+def generate_private_key(algorithm):
+    if algorithm.startswith("RS"):
+        return rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    if algorithm.startswith("ES"):
+        curve = {"ES256": ec.SECP256R1, "ES384": ec.SECP384R1, "ES512": ec.SECP521R1}[algorithm]
+        return ec.generate_private_key(curve())
+    if algorithm == "EdDSA":
+        return ed25519.Ed25519PrivateKey.generate()
+    raise ValueError("Unsupported algorithm for key generation: %s" % algorithm)
+
+def rotate_signing_key(algorithm):
+    """
+    新しい鍵を作って署名に使い、それまでの鍵を退役させる(検証用には公開し続ける)
+    """
+    private_key = generate_private_key(algorithm)
+    private_pem = private_key.private_bytes(
+        encoding=serialization.Encoding.PEM,
+        format=serialization.PrivateFormat.PKCS8,
+        encryption_algorithm=serialization.BestAvailableEncryption(_passphrase()),
+    ).decode()
+    public_pem = private_key.public_key().public_bytes(
+        encoding=serialization.Encoding.PEM,
+        format=serialization.PublicFormat.SubjectPublicKeyInfo,
+    ).decode()
+    with transaction.atomic():
+        SigningKey.objects.filter(retired_at__isnull=True).update(retired_at=timezone.now())
+        key = SigningKey.objects.create(kid=uuid.uuid4().hex, algorithm=algorithm,
+                                        private_key=private_pem, public_key=public_pem)
+    keyring.reload()
+    return key
+
+def prune_signing_keys():
+    """
+    退役してからリフレッシュトークンの有効期間が過ぎた鍵を削除する
+    """
+    threshold = timezone.now() - api_settings.REFRESH_TOKEN_LIFETIME
+    deleted, _ = SigningKey.objects.filter(retired_at__lt=threshold).delete()
+    keyring.reload()
+    decoded_token_cache.clear()
+    return deleted
+
+def _to_jwk(key, public_key):
+    if key.algorithm.startswith("RS"):
+        jwk = RSAAlgorithm.to_jwk(public_key, as_dict=True)
+    elif key.algorithm.startswith("ES"):
+        jwk = ECAlgorithm.to_jwk(public_key, as_dict=True)
+    else:
+        jwk = OKPAlgorithm.to_jwk(public_key, as_dict=True)
+    jwk.update({"kid": key.kid, "alg": key.algorithm, "use": "sig"})
+    return jwk
+
+
+class KeyRing:
+    """
+    署名用の秘密鍵1つと、検証用の公開鍵(kidごと)をプロセス内に保持する
+    """
+
+    # 不明なkidのトークンが大量に来てもDBを参照し続けないように、読み込み直す間隔の下限を設ける
+    min_reload_interval = 5
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._loaded_at = None
+        self.signing_kid = None
+        self.signing_key = None
+        self.public_keys = {}
+        self.jwks = []
+
+    def reload(self):
+        with self._lock:
+          self._loaded_at = None
+
+    def _load(self):
+        threshold = timezone.now() - api_settings.REFRESH_TOKEN_LIFETIME
+        keys = list(SigningKey.objects.exclude(retired_at__lt=threshold).order_by("-created_at"))
+        signer = next((key for key in keys if key.retired_at is None), None)
+
+        public_keys = {}
+        jwks = []
+        for key in keys:
+            public_key = serialization.load_pem_public_key(key.public_key.encode())
+            public_keys[key.kid] = (key.algorithm, public_key)
+            jwks.append(_to_jwk(key, public_key))
+
+        self.signing_kid = signer.kid if signer else None
+        self.signing_key = serialization.load_pem_private_key(
+            signer.private_key.encode(), password=_passphrase()
+        ) if signer else None
+        self.public_keys = public_keys
+        self.jwks = jwks
+        self._loaded_at = time.monotonic()
+
+    def _is_stale(self):
+        return self._loaded_at is None or time.monotonic() - self._loaded_at > self.ttl
+
+    def ensure_loaded(self, force=False):
+        if(_in_event_loop()):
+          # イベントループ上ではDBを参照せず、aensure_loadedで読み込んだ鍵を使う(期限が切れていても次の読み込みまで使う)
+          if(self._loaded_at is None):
+            raise SynchronousOnlyOperation("The key ring is not loaded. Call 'await keyring.aensure_loaded()' first.")
+          return
+        with self._lock:
+          if(force or self._is_stale()):
+            self._load()
+
+    async def aensure_loaded(self, token=None):
+        """
+        ensure_loadedの非同期版。非同期のビューでトークンを発行・検証する前に呼ぶ
+        tokenを渡すと、ヘッダーのkidの公開鍵がなければ(他のプロセスで鍵が作られた直後)読み込み直す
+        """
+        force = False
+        if(token is not None and self._loaded_at is not None and
+           time.monotonic() - self._loaded_at > self.min_reload_interval):
+          try:
+            force = jwt.get_unverified_header(token).get("kid") not in self.public_keys
+          except jwt.InvalidTokenError:
+            pass
+        if(force or self._is_stale()):
+          await sync_to_async(self.ensure_loaded)(force=force)
+
+    def get_signing_key(self):
+        """
+        (kid, 秘密鍵)を返す。鍵がなければ(None, None)
+        """
+        self.ensure_loaded()
+        return self.signing_kid, self.signing_key
+
+    def get_public_key(self, kid):
+        """
+        (アルゴリズム, 公開鍵)を返す。他のプロセスで鍵が作られた直後のために、見つからなければ1度だけ読み込み直す
+        """
+        self.ensure_loaded()
+        if(kid not in self.public_keys and time.monotonic() - self._loaded_at > self.min_reload_interval):
+          self.ensure_loaded(force=True)
+        return self.public_keys.get(kid, (None, None))
+
+    def get_jwks(self):
+        self.ensure_loaded()
+        return {"keys": self.jwks}
+
+
+keyring = KeyRing(ttl=settings.JWT_KEYRING_TTL)
@@ -0,0 +1,229 @@
+"""
+APIのエンドポイントごとのスループットとレイテンシを計測する
+    python manage.py benchmark_api --requests 500 --concurrency 8 --output bench.json
+    python manage.py benchmark_api --baseline bench.json --max-regression 20
+リクエストはプロセス内のテストクライアントから送るので、ミドルウェアを含むDjangoの処理全体を計測する
+(サーバーやネットワークの時間は含まない)。DBは設定されたもの(SQLiteやローカルのMySQL)をそのまま使い、
+計測用に作ったユーザーは最後に削除する
+"""
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from main_app.models import User
+from main_app.utils import get_jwt
+from main_app import hashing
+import json
+import threading
+import time
+import uuid
+
+ENDPOINTS = ("signup", "token", "token_refresh", "is_login")
+
+
+def percentile(values, p):
+    """
+    最近傍順位法でのパーセンタイル(valuesはソート済み)
+    """
+    if not values:
+        return None
+    index = max(int(round(p / 100 * len(values) + 0.5)) - 1, 0)
+    return values[min(index, len(values) - 1)]
+
+
+class Command(BaseCommand):
+    help = "APIのエンドポイントごとのスループット、p50/p95/p99のレイテンシ、1リクエストあたりのクエリ数を計測する"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--endpoint", action="append", dest="endpoints", choices=ENDPOINTS,
+                            help="計測するエンドポイント(省略時はすべて)")
+        parser.add_argument("--requests", type=int, default=200,
+                            help="エンドポイントごとのリクエスト数")
+        parser.add_argument("--concurrency", type=int, default=8,
+                            help="同時にリクエストを送るスレッド数")
+        parser.add_argument("--warmup", type=int, default=5,
+                            help="計測前に送るリクエスト数")
+        parser.add_argument("--hash-rounds", type=int, default=5,
+                            help="パスワードのハッシュ化の時間を計測する回数")
+        parser.add_argument("--throttle", action="store_true",
+                            help="レート制限を有効にしたまま計測する(省略時は無効にする)")
+        parser.add_argument("--label", default="",
+                            help="結果に記録するラベル(コミットのハッシュなど)")
+        parser.add_argument("--output", help="結果をJSONで保存するファイル")
+        parser.add_argument("--baseline", help="比較する以前の結果のJSONファイル")
+        parser.add_argument("--max-regression", type=float, default=None,
+                            help="p95のレイテンシがbaselineよりこの割合(%%)以上遅くなったらエラーにする")
+
+    def handle(self, *args, **options):
+        # usernameは15文字までなので、接頭辞は短くする
+        self.prefix = "b%s-" % uuid.uuid4().hex[:6]
+        self.concurrency = max(options["concurrency"], 1)
+        self.local = threading.local()
+        endpoints = options["endpoints"] or list(ENDPOINTS)
+
+        overrides = {}
+        if not options["throttle"]:
+            overrides["REST_FRAMEWORK"] = dict(settings.REST_FRAMEWORK, DEFAULT_THROTTLE_RATES={})
+        try:
+            with override_settings(**overrides):
+                results = [self.run_endpoint(endpoint, options["requests"], options["warmup"])
+                           for endpoint in endpoints]
+        finally:
+            User.objects.filter(username__startswith=self.prefix).delete()
+
+        report = {
+            "label": options["label"],
+            "started_at": timezone.now().isoformat(),
+            "database": connection.vendor,
+            "password_hasher": settings.PASSWORD_HASHERS[0],
+            "concurrency": self.concurrency,
+            "hash_ms": self.measure_hash(options["hash_rounds"]),
+            "results": results,
+        }
+        self.print_report(report)
+        if options["output"]:
+            with open(options["output"], "w", encoding="utf-8") as f:
+                json.dump(report, f, indent=2)
+        if options["baseline"]:
+            self.compare(report, options["baseline"], options["max_regression"])
+
+    def create_user(self):
+        name = "%s%s" % (self.prefix, uuid.uuid4().hex[:6])
+        return User.objects.create_user(username=name[:15], email="%s@example.com" % name, password="password")
+
+    def prepare(self, endpoint, count):
+        """
+        エンドポイントごとに、リクエストの引数を1リクエストずつ作る
+        """
+        if endpoint == "signup":
+            return [{"path": reverse("main_app:signup"),
+                     "data": {"username": "%s%d" % (self.prefix, i), "email": "%s%d@example.com" % (self.prefix, i),
+                              "password": "password"}}
+                    for i in range(count)]
+        user = self.create_user()
+        if endpoint == "token":
+            return [{"path": reverse("main_app:token_obtain_pair"),
+                     "data": {User.USERNAME_FIELD: getattr(user, User.USERNAME_FIELD), "password": "password"}}] * count
+        if endpoint == "token_refresh":
+            # リフレッシュトークンはローテーションで使い捨てになるので、リクエストごとに発行する
+            return [{"path": reverse("main_app:token_refresh"), "data": {"refresh": get_jwt(user)["refresh"]}}
+                    for _ in range(count)]
+        access = get_jwt(user)["access"]
+        header = settings.SIMPLE_JWT["AUTH_HEADER_TYPES"][0]
+        return [{"path": reverse("main_app:is_login"), "method": "get",
+                 "cookies": {settings.JWT_ACCESS_COOKIE: "%s %s" % (header, access)}}] * count
+
+    def send(self, request):
+        """
+        1リクエストを送り、(ステータス, ミリ秒, クエリ数)を返す
+        """
+        client = getattr(self.local, "client", None)
+        if client is None:
+            client = self.local.client = Client()
+        client.cookies.clear()
+        for key, value in request.get("cookies", {}).items():
+            client.cookies[key] = value
+        with CaptureQueriesContext(connections["default"]) as queries:
+            start = time.perf_counter()
+            if request.get("method") == "get":
+                response = client.get(request["path"])
+            else:
+                response = client.post(request["path"], request["data"], content_type="application/json")
+            elapsed = (time.perf_counter() - start) * 1000
+        return response.status_code, elapsed, len(queries)
+
+    def run_requests(self, requests):
+        if self.concurrency == 1:
+            return [self.send(request) for request in requests]
+
+        results = [None] * len(requests)
+        indexes = iter(range(len(requests)))
+        lock = threading.Lock()
+
+        def worker():
+            # スレッドごとにDB接続を使い回し、終わったら閉じる
+            try:
+                while True:
+                    with lock:
+                        index = next(indexes, None)
+                    if index is None:
+                        return
+                    results[index] = self.send(requests[index])
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=worker) for _ in range(self.concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def run_endpoint(self, endpoint, count, warmup):
+        requests = self.prepare(endpoint, count + warmup)
+        self.run_requests(requests[:warmup])
+
+        start = time.perf_counter()
+        samples = self.run_requests(requests[warmup:])
+        wall = time.perf_counter() - start
+
+        latencies = sorted(elapsed for _status, elapsed, _queries in samples)
+        errors = sum(1 for status_code, _elapsed, _queries in samples if status_code >= 400)
+        return {
+            "endpoint": endpoint,
+            "requests": len(samples),
+            "errors": errors,
+            "throughput_rps": len(samples) / wall if wall else None,
+            "latency_ms": {
+                "mean": sum(latencies) / len(latencies) if latencies else None,
+                "p50": percentile(latencies, 50),
+                "p95": percentile(latencies, 95),
+                "p99": percentile(latencies, 99),
+                "max": latencies[-1] if latencies else None,
+            },
+            "queries_per_request": sum(queries for _status, _elapsed, queries in samples) / len(samples) if samples else None,
+        }
+
+    def measure_hash(self, rounds):
+        """
+        設定されたハッシュ関数での、1回のハッシュ化の時間(ミリ秒)
+        """
+        timings = []
+        for _ in range(max(rounds, 1)):
+            start = time.perf_counter()
+            hashing.make_password("benchmark-password")
+            timings.append((time.perf_counter() - start) * 1000)
+        timings.sort()
+        return {"p50": percentile(timings, 50), "max": timings[-1]}
+
+    def print_report(self, report):
+        self.stdout.write("database=%(database)s concurrency=%(concurrency)d hash_p50=%(p50).2fms"
+                          % dict(report, p50=report["hash_ms"]["p50"]))
+        for result in report["results"]:
+            self.stdout.write(
+                "%-14s %6d req %4d err %8.1f req/s p50=%7.2fms p95=%7.2fms p99=%7.2fms %5.1f queries/req" % (
+                    result["endpoint"], result["requests"], result["errors"], result["throughput_rps"] or 0,
+                    result["latency_ms"]["p50"] or 0, result["latency_ms"]["p95"] or 0,
+                    result["latency_ms"]["p99"] or 0, result["queries_per_request"] or 0))
+
+    def compare(self, report, path, max_regression):
+        """
+        以前の結果とp95のレイテンシを比べる。max_regressionを超えて遅くなっていればエラーにする
+        """
+        with open(path, encoding="utf-8") as f:
+            baseline = {result["endpoint"]: result for result in json.load(f)["results"]}
+        regressions = []
+        for result in report["results"]:
+            before = baseline.get(result["endpoint"])
+            if not before or not before["latency_ms"]["p95"]:
+                continue
+            change = (result["latency_ms"]["p95"] / before["latency_ms"]["p95"] - 1) * 100
+            self.stdout.write("%-14s p95 %+.1f%% queries/req %+.1f" % (
+                result["endpoint"], change, result["queries_per_request"] - before["queries_per_request"]))
+            if max_regression is not None and change > max_regression:
+                regressions.append(result["endpoint"])
+        if regressions:
+            raise CommandError("p95 latency regressed by more than %s%%: %s" % (max_regression, ", ".join(regressions)))
@@ -0,0 +1,93 @@
+"""
+このマシンでのパスワードハッシュの速度を測り、目標の時間に合うパラメーターを提案する
+    python manage.py benchmark_hashers --target-ms 50
+"""
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils.module_loading import import_string
+import json
+import math
+import time
+
+
+class Command(BaseCommand):
+    help = "パスワードハッシュのプロファイルごとに、1秒あたりのハッシュ化回数を計測する"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--profile", action="append", dest="profiles",
+                            choices=sorted(settings.PASSWORD_HASHER_PROFILES),
+                            help="計測するプロファイル(省略時はすべて)")
+        parser.add_argument("--rounds", type=int, default=5,
+                            help="プロファイルごとにハッシュ化する回数")
+        parser.add_argument("--target-ms", type=float, default=50.0,
+                            help="1回のハッシュ化にかけたい時間(ミリ秒)")
+        parser.add_argument("--json", action="store_true",
+                            help="結果をJSONで出力する")
+
+    def handle(self, *args, **options):
+        profiles = options["profiles"] or list(settings.PASSWORD_HASHER_PROFILES)
+        results = []
+        for profile in profiles:
+            hasher = import_string(settings.PASSWORD_HASHER_PROFILES[profile])()
+            try:
+                ms = self.measure(hasher, options["rounds"])
+            except (ImportError, ValueError) as e:
+                # argon2-cffiが入っていない場合など
+                self.stderr.write("%s: skipped (%s)" % (profile, e))
+                continue
+            results.append({
+                "profile": profile,
+                "algorithm": hasher.algorithm,
+                "params": self.get_params(profile, hasher),
+                "ms_per_hash": ms,
+                "hashes_per_sec": 1000 / ms if ms else math.inf,
+                "suggested_params": self.suggest_params(profile, hasher, ms, options["target_ms"]),
+            })
+
+        if options["json"]:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+        for result in results:
+            self.stdout.write(
+                "%(profile)-8s %(ms_per_hash)8.2f ms/hash %(hashes_per_sec)8.1f hashes/sec "
+                "params=%(params)s suggested=%(suggested_params)s" % result
+            )
+
+    def measure(self, hasher, rounds):
+        """
+        1回のハッシュ化にかかる時間(ミリ秒)の中央値を返す
+        """
+        timings = []
+        for _ in range(max(rounds, 1)):
+            salt = hasher.salt()
+            start = time.perf_counter()
+            hasher.encode("benchmark-password", salt)
+            timings.append((time.perf_counter() - start) * 1000)
+        timings.sort()
+        return timings[len(timings) // 2]
+
+    def get_params(self, profile, hasher):
+        names = {
+            "pbkdf2": ("iterations",),
+            "scrypt": ("work_factor", "block_size", "parallelism"),
+            "argon2": ("time_cost", "memory_cost", "parallelism"),
+        }[profile]
+        return {name: getattr(hasher, name) for name in names}
+
+    def suggest_params(self, profile, hasher, ms, target_ms):
+        """
+        ハッシュ化の時間はコストにほぼ比例するので、目標の時間との比でコストを調整する
+        """
+        params = self.get_params(profile, hasher)
+        ratio = target_ms / ms if ms else 1
+        if profile == "pbkdf2":
+            params["iterations"] = max(int(round(hasher.iterations * ratio, -3)), 1000)
+        elif profile == "scrypt":
+            # work_factorは2のべき乗でなければならない
+            params["work_factor"] = 2 ** max(round(math.log2(hasher.work_factor * ratio)), 10)
+        elif profile == "argon2":
+            params["time_cost"] = max(round(hasher.time_cost * ratio), 1)
+            if hasher.time_cost * ratio < 1:
+                # time_costを1にしても遅い時はメモリ量を減らす
+                params["memory_cost"] = max(int(hasher.memory_cost * hasher.time_cost * ratio), 8 * hasher.parallelism)
+        return params
@@ -0,0 +1,67 @@
+"""
+ユーザーをCSV/JSONLで書き出す
+    python manage.py export_users --format jsonl --output users.jsonl
+テーブル全体をメモリに載せず、主キーのキーセットでchunk_size件ずつ読み込みながら書き出す
+(QuerySet.iteratorはmysqlclientでは結果をすべてクライアントに読み込むので使わない)
+"""
+from django.core.management.base import BaseCommand
+from main_app.models import User
+import csv
+import json
+import sys
+
+FIELDS = ("id", "username", "email", "is_active", "is_staff", "is_superuser", "created_at", "updated_at")
+
+
+class Command(BaseCommand):
+    help = "ユーザーをCSV/JSONLでストリーミングして書き出す"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--format", choices=("csv", "jsonl"), default="jsonl")
+        parser.add_argument("--output", default="-", help="出力ファイル('-'なら標準出力)")
+        parser.add_argument("--chunk-size", type=int, default=2000,
+                            help="DBから一度に読み込む件数")
+        parser.add_argument("--include-password-hash", action="store_true",
+                            help="ハッシュ化済みのパスワードをpassword_hash列として書き出す(import_usersで取り込める)")
+
+    def handle(self, *args, **options):
+        fields = FIELDS + (("password",) if options["include_password_hash"] else ())
+        rows = self.read_rows(fields, max(options["chunk_size"], 1))
+        columns = [("password_hash" if field == "password" else field) for field in fields]
+
+        if options["output"] == "-":
+            count = self.write(self.stdout, rows, columns, options["format"])
+        else:
+            with open(options["output"], "w", newline="", encoding="utf-8") as f:
+                count = self.write(f, rows, columns, options["format"])
+        self.stderr.write("exported=%d" % count)
+
+    def read_rows(self, fields, chunk_size):
+        """
+        主キーの順にchunk_size件ずつ読み込んで1行ずつ返す
+        """
+        last_pk = None
+        while True:
+            queryset = User.objects.order_by("pk")
+            if last_pk is not None:
+                queryset = queryset.filter(pk__gt=last_pk)
+            chunk = list(queryset.values_list("pk", *fields)[:chunk_size])
+            for row in chunk:
+                yield row[1:]
+            if len(chunk) < chunk_size:
+                return
+            last_pk = chunk[-1][0]
+
+    def write(self, f, rows, columns, fmt):
+        count = 0
+        if fmt == "csv":
+            writer = csv.writer(f)
+            writer.writerow(columns)
+            for row in rows:
+                writer.writerow(row)
+                count += 1
+        else:
+            for row in rows:
+                f.write(json.dumps(dict(zip(columns, row)), default=str) + "\n")
+                count += 1
+        return count
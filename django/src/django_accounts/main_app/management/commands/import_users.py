@@ -0,0 +1,198 @@
+"""
+CSV/JSONLからユーザーを一括登録する
+    python manage.py import_users users.jsonl --batch-size 5000
+1行ずつ読み込み、UserSerializerと同じ規則で検証してからbatch_size件ずつbulk_createする
+password_hash列があれば、ハッシュ化済みのパスワードとしてそのまま登録する
+"""
+from concurrent.futures import ThreadPoolExecutor
+from django.contrib.auth import hashers
+from django.core.management.base import BaseCommand, CommandError
+from django.db import IntegrityError, transaction
+from django.db.models.functions import Lower
+from main_app.models import User
+from main_app.serializer import UserSerializer
+from main_app.user_index import user_index
+import csv
+import json
+import os
+import sys
+
+FLAG_FIELDS = ("is_active", "is_staff", "is_superuser")
+
+
+def parse_bool(value):
+    if isinstance(value, bool):
+        return value
+    return str(value).strip().lower() in ("1", "true", "yes")
+
+
+class Command(BaseCommand):
+    help = "CSV/JSONLからユーザーをバッチ単位で一括登録する"
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="入力ファイル('-'なら標準入力)")
+        parser.add_argument("--format", choices=("csv", "jsonl"),
+                            help="入力の形式(省略時は拡張子から判断する)")
+        parser.add_argument("--batch-size", type=int, default=1000,
+                            help="1回のbulk_createで登録する件数")
+        parser.add_argument("--on-conflict", choices=("skip", "fail"), default="skip",
+                            help="usernameやemailが既に存在する時にスキップするか中断するか")
+        # 1プロセスで動くので、webのワーカーで分けたPASSWORD_HASHING_WORKERSではなくコア数を使う
+        parser.add_argument("--hash-workers", type=int, default=os.cpu_count() or 1,
+                            help="平文のパスワードをハッシュ化するスレッド数")
+
+    def handle(self, *args, **options):
+        self.batch_size = max(options["batch_size"], 1)
+        self.on_conflict = options["on_conflict"]
+        self.counts = {"created": 0, "skipped": 0, "invalid": 0}
+        fmt = options["format"] or ("csv" if options["path"].endswith(".csv") else "jsonl")
+
+        with ThreadPoolExecutor(max_workers=max(options["hash_workers"], 1)) as self.hash_pool:
+          if options["path"] == "-":
+            self.import_rows(self.read_rows(sys.stdin, fmt))
+          else:
+            with open(options["path"], newline="", encoding="utf-8") as f:
+              self.import_rows(self.read_rows(f, fmt))
+
+        self.stdout.write("created=%(created)d skipped=%(skipped)d invalid=%(invalid)d" % self.counts)
+
+    def read_rows(self, f, fmt):
+        """
+        (行番号, 行の辞書)を1行ずつ返す
+        """
+        if fmt == "csv":
+            for line_no, row in enumerate(csv.DictReader(f), start=2):
+                yield line_no, row
+        else:
+            for line_no, line in enumerate(f, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    row = json.loads(line)
+                except ValueError as e:
+                    self.report_invalid(line_no, {"detail": str(e)})
+                    continue
+                if not isinstance(row, dict):
+                    self.report_invalid(line_no, {"detail": "Expected a JSON object."})
+                    continue
+                yield line_no, row
+
+    def import_rows(self, rows):
+        batch = []
+        for line_no, row in rows:
+            user = self.build_user(line_no, row)
+            if user is not None:
+                batch.append(user)
+            if len(batch) >= self.batch_size:
+                self.flush(batch)
+                batch = []
+        if batch:
+            self.flush(batch)
+
+    def build_user(self, line_no, row):
+        """
+        行を検証してUserを作成する(まだ保存しない)
+        平文のパスワードは後でまとめてハッシュ化するので_passwordに持っておく
+        """
+        password_hash = row.get("password_hash")
+        fields = ("username", "email") if password_hash else ("username", "email", "password")
+        # 重複はflushでバッチごとにまとめて確認する
+        serializer = UserSerializer(data={field: row.get(field) for field in fields},
+                                    context={"check_exists": False})
+        if not serializer.is_valid():
+            self.report_invalid(line_no, serializer.errors)
+            return None
+
+        missing = [field for field in fields if not serializer.validated_data.get(field)]
+        if missing:
+            self.report_invalid(line_no, {field: ["This field is required."] for field in missing})
+            return None
+        if password_hash and not self.is_valid_hash(password_hash):
+            self.report_invalid(line_no, {"password_hash": ["Unknown password hash format."]})
+            return None
+
+        user = User(username=serializer.validated_data["username"],
+                    email=User.objects.normalize_email(serializer.validated_data["email"]),
+                    **{field: parse_bool(row[field]) for field in FLAG_FIELDS if row.get(field) not in (None, "")})
+        user.password = password_hash or ""
+        user._password = None if password_hash else serializer.validated_data["password"]
+        return user
+
+    def is_valid_hash(self, encoded):
+        try:
+            hashers.identify_hasher(encoded)
+        except ValueError:
+            return False
+        return True
+
+    def flush(self, batch):
+        """
+        バッチ内とDBの重複をまとめて確認し、残りを1回のbulk_createで登録する
+        usernameとemailは大文字小文字を区別せずに比較する(ログインやUserSerializerと同じ)
+        """
+        taken_usernames = set(self.lower_values("username", {user.username.lower() for user in batch}))
+        taken_emails = set(self.lower_values("email", {user.email.lower() for user in batch}))
+
+        users = []
+        for user in batch:
+            username, email = user.username.lower(), user.email.lower()
+            if username in taken_usernames or email in taken_emails:
+                if self.on_conflict == "fail":
+                    raise CommandError("User already exists: username=%s email=%s" % (user.username, user.email))
+                self.counts["skipped"] += 1
+                continue
+            # 同じバッチ内の重複も後勝ちにせずスキップする
+            taken_usernames.add(username)
+            taken_emails.add(email)
+            users.append(user)
+        if not users:
+            return
+
+        plain = [user for user in users if user._password is not None]
+        for user, encoded in zip(plain, self.hash_pool.map(hashers.make_password, [user._password for user in plain])):
+            user.password = encoded
+            user._password = None
+
+        try:
+            with transaction.atomic():
+                # 確認後に他から登録された分はDBの一意制約で弾く
+                User.objects.bulk_create(users, batch_size=self.batch_size,
+                                         ignore_conflicts=self.on_conflict == "skip")
+        except IntegrityError as e:
+            raise CommandError("User already exists: %s" % e)
+
+        # ignore_conflictsで弾かれた行は分からないので、実際に登録された行を読み直す
+        inserted = self.inserted_users(users)
+        self.counts["created"] += len(inserted)
+        self.counts["skipped"] += len(users) - len(inserted)
+        # bulk_createではpost_saveが送られないので、重複確認のフィルタに直接追加する
+        user_index.add_many(inserted)
+
+    def lower_values(self, field, values):
+        """
+        fieldを小文字にした値がvaluesに含まれるユーザーの、小文字にした値を返す(user_*_lower_idxを使う)
+        """
+        return (User.objects.annotate(lower_value=Lower(field))
+                            .filter(lower_value__in=values)
+                            .values_list("lower_value", flat=True))
+
+    def inserted_users(self, users):
+        """
+        usersのうちDBに登録されたものを返す
+        usernameとemailに加えて、ソルトを含むパスワードのハッシュも一致するものを、このバッチで登録した行とみなす
+        """
+        rows = (User.objects.annotate(lower_username=Lower("username"))
+                            .filter(lower_username__in={user.username.lower() for user in users})
+                            .values_list("pk", "username", "email", "password"))
+        pks = {(username.lower(), email.lower(), password): pk for pk, username, email, password in rows}
+        inserted = []
+        for user in users:
+            pk = pks.get((user.username.lower(), user.email.lower(), user.password))
+            if pk is not None:
+                user.pk = pk
+                inserted.append(user)
+        return inserted
+
+    def report_invalid(self, line_no, errors):
+        self.counts["invalid"] += 1
+        self.stderr.write("line %d: %s" % (line_no, json.dumps(errors, default=str)))
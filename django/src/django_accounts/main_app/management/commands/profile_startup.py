@@ -0,0 +1,111 @@
+"""
+ワーカーの起動にかかる時間と、モジュールごとのimportの時間を計測する
+    python manage.py profile_startup --settings-module django_accounts.settings_api --top 20
+新しいPythonプロセスを python -X importtime で起動し、ワーカーと同じようにアプリケーション(django_accounts.wsgiなど)を
+読み込んでから、URLの読み込み・最初のリクエストまでを計測する
+"""
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+import json
+import os
+import subprocess
+import sys
+import time
+
+# 子プロセスで実行するスクリプト。各段階の経過時間(秒)をJSONで標準出力に書く
+SCRIPT = """
+import time
+start = time.perf_counter()
+import importlib, json, sys
+importlib.import_module(sys.argv[2])
+setup = time.perf_counter()
+from django.urls import get_resolver
+get_resolver().url_patterns
+urls = time.perf_counter()
+# テストクライアントのimportはワーカーにはないので、最初のリクエストの時間に含めない
+from django.conf import settings
+from django.test import Client
+hosts = [host for host in settings.ALLOWED_HOSTS if host != "*" and not host.startswith(".")]
+client = Client(HTTP_HOST=hosts[0] if hosts else "localhost")
+request = time.perf_counter()
+response = client.get(sys.argv[1])
+first_request = time.perf_counter()
+print(json.dumps({"setup": setup - start, "urls": urls - setup, "first_request": first_request - request,
+                  "status": response.status_code}))
+"""
+
+
+def parse_importtime(lines):
+    """
+    -X importtimeの出力を[(モジュール, 自身のマイクロ秒, 累積のマイクロ秒, 深さ)]にする
+    """
+    modules = []
+    for line in lines:
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        modules.append((name.strip(), int(self_us), int(cumulative_us), depth))
+    return modules
+
+
+class Command(BaseCommand):
+    help = "ワーカーの起動(アプリケーションの読み込み、URLの読み込み、最初のリクエスト)の時間と、importの遅いモジュールを表示する"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--settings-module", default=os.environ.get("DJANGO_SETTINGS_MODULE"),
+                            help="計測する設定(django_accounts.settings_apiなど)")
+        parser.add_argument("--application", default="django_accounts.wsgi",
+                            help="ワーカーが読み込むアプリケーションのモジュール(django_accounts.asgiなど)")
+        parser.add_argument("--path", default="/api/is_login/",
+                            help="最初のリクエストのパス")
+        parser.add_argument("--top", type=int, default=20,
+                            help="表示するモジュールとパッケージの数")
+        parser.add_argument("--json", action="store_true",
+                            help="結果をJSONで出力する")
+
+    def handle(self, *args, **options):
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE=options["settings_module"])
+        start = time.perf_counter()
+        process = subprocess.run([sys.executable, "-X", "importtime", "-c", SCRIPT, options["path"],
+                                  options["application"]],
+                                 env=env, cwd=settings.BASE_DIR, capture_output=True, text=True)
+        wall = time.perf_counter() - start
+        if process.returncode != 0:
+            raise CommandError(process.stderr.strip().splitlines()[-1] if process.stderr.strip() else "failed")
+
+        phases = json.loads(process.stdout.strip().splitlines()[-1])
+        modules = parse_importtime(process.stderr.splitlines())
+        packages = {}
+        for name, self_us, _cumulative_us, _depth in modules:
+            package = name.split(".")[0]
+            packages[package] = packages.get(package, 0) + self_us
+
+        top = max(options["top"], 1)
+        report = {
+            "settings": options["settings_module"],
+            "wall_ms": wall * 1000,
+            "setup_ms": phases["setup"] * 1000,
+            "urls_ms": phases["urls"] * 1000,
+            "first_request_ms": phases["first_request"] * 1000,
+            "first_request_status": phases["status"],
+            "import_ms": sum(self_us for _name, self_us, _cumulative, _depth in modules) / 1000,
+            "modules_imported": len(modules),
+            "packages": [{"package": package, "self_ms": us / 1000}
+                         for package, us in sorted(packages.items(), key=lambda item: -item[1])[:top]],
+            "modules": [{"module": name, "self_ms": self_us / 1000, "cumulative_ms": cumulative_us / 1000}
+                        for name, self_us, cumulative_us, _depth in sorted(modules, key=lambda m: -m[1])[:top]],
+        }
+
+        if options["json"]:
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+        self.stdout.write("settings=%(settings)s wall=%(wall_ms).1fms setup=%(setup_ms).1fms urls=%(urls_ms).1fms "
+                          "first_request=%(first_request_ms).1fms (status %(first_request_status)d) "
+                          "import=%(import_ms).1fms modules=%(modules_imported)d" % report)
+        self.stdout.write("\npackages (self time)")
+        for package in report["packages"]:
+            self.stdout.write("  %8.2f ms  %s" % (package["self_ms"], package["package"]))
+        self.stdout.write("\nmodules (self time / cumulative)")
+        for module in report["modules"]:
+            self.stdout.write("  %8.2f ms %8.2f ms  %s" % (module["self_ms"], module["cumulative_ms"], module["module"]))
@@ -0,0 +1,28 @@
+"""
+jwtを署名する鍵を新しく作り、それまでの鍵を退役させる
+    python manage.py rotate_signing_key
+    python manage.py rotate_signing_key --prune
+退役した鍵はリフレッシュトークンの有効期間が過ぎるまでJWKSで公開し続ける
+"""
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework_simplejwt.settings import api_settings
+from main_app.keys import ASYMMETRIC_ALGORITHMS, rotate_signing_key, prune_signing_keys
+
+
+class Command(BaseCommand):
+    help = "jwtを署名する非対称鍵をローテーションする"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--algorithm", default=api_settings.ALGORITHM,
+                            help="鍵のアルゴリズム(省略時はJWT_ALGORITHM)")
+        parser.add_argument("--prune", action="store_true",
+                            help="公開期間を過ぎた退役済みの鍵を削除する")
+
+    def handle(self, *args, **options):
+        if options["algorithm"] not in ASYMMETRIC_ALGORITHMS:
+            raise CommandError("%s is not an asymmetric algorithm. Choose from %s."
+                               % (options["algorithm"], ", ".join(ASYMMETRIC_ALGORITHMS)))
+        key = rotate_signing_key(options["algorithm"])
+        self.stdout.write("kid=%s algorithm=%s" % (key.kid, key.algorithm))
+        if options["prune"]:
+            self.stdout.write("pruned=%d" % prune_signing_keys())
@@ -0,0 +1,27 @@
+"""
+有効期限を過ぎたリフレッシュトークンの失効記録を削除する
+    python manage.py sweep_refresh_tokens --chunk-size 10000 --sleep 0.1
+cronなどで定期的に実行する
+"""
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from main_app.token_store import sweep_expired
+import time
+
+
+class Command(BaseCommand):
+    help = "有効期限を過ぎたリフレッシュトークンの失効記録をチャンク単位で削除する"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=10000,
+                            help="1回のDELETEで削除する件数")
+        parser.add_argument("--sleep", type=float, default=0.0,
+                            help="チャンクごとに待つ秒数(DBの負荷を抑える)")
+
+    def handle(self, *args, **options):
+        total = 0
+        for deleted in sweep_expired(timezone.now(), chunk_size=options["chunk_size"]):
+            total += deleted
+            if options["sleep"]:
+                time.sleep(options["sleep"])
+        self.stdout.write("deleted=%d" % total)
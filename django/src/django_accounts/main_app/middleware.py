@@ -0,0 +1,124 @@
+"""
+このアプリで使うミドルウェア達
+"""
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.contrib.auth import middleware as auth_middleware
+from django.contrib.messages import middleware as messages_middleware
+from django.contrib.sessions import middleware as sessions_middleware
+from django.middleware import clickjacking, csrf
+from .db.router import routing_scope
+from .instrumentation import measure_request, metrics
+from .utils import set_jwt_cookie
+
+
+def is_stateless_path(path):
+    return path.startswith(settings.STATELESS_PATH_PREFIXES)
+
+def stateless_exempt(middleware_class):
+    """
+    STATELESS_PATH_PREFIXES(jwtで認証する/api/など)へのリクエストでは何もしないミドルウェアを作る
+    セッション・CSRF・ログインユーザーなどを使わないAPIでは、その準備(セッションの読み込みなど)を省く
+    """
+    def __call__(self, request):
+        if(is_stateless_path(request.path_info)):
+          return self.get_response(request)
+        return middleware_class.__call__(self, request)
+
+    attrs = {"__call__": __call__, "__module__": __name__, "__doc__": middleware_class.__doc__}
+
+    def hook(name):
+        def method(self, request, *args, **kwargs):
+          if(is_stateless_path(request.path_info)):
+            return None
+          return getattr(middleware_class, name)(self, request, *args, **kwargs)
+        return method
+
+    # process_viewなどは、元のミドルウェアにある時だけ定義する(ハンドラが存在を見て呼び出すため)
+    for name in ("process_view", "process_exception", "process_template_response"):
+      if hasattr(middleware_class, name):
+        attrs[name] = hook(name)
+    return type(middleware_class.__name__, (middleware_class,), attrs)
+
+
+SessionMiddleware = stateless_exempt(sessions_middleware.SessionMiddleware)
+CsrfViewMiddleware = stateless_exempt(csrf.CsrfViewMiddleware)
+AuthenticationMiddleware = stateless_exempt(auth_middleware.AuthenticationMiddleware)
+MessageMiddleware = stateless_exempt(messages_middleware.MessageMiddleware)
+XFrameOptionsMiddleware = stateless_exempt(clickjacking.XFrameOptionsMiddleware)
+
+
+class JWTCookieRefreshMiddleware:
+    """
+    CookieJWTAuthenticationがリクエスト中に更新したjwtを、レスポンスのクッキーにセットする
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        token = getattr(request, "_jwt_refreshed", None)
+        if(token):
+          set_jwt_cookie(response, token)
+        return response
+
+
+class RequestMetricsMiddleware:
+    """
+    リクエストの処理時間を計測し、Server-Timingヘッダーを付けてエンドポイントごとのヒストグラムに加える
+    全体の時間を計測できるように、MIDDLEWAREの先頭に置く
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if(self.async_mode):
+          markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if(self.async_mode):
+          return self.__acall__(request)
+        with measure_request() as timings:
+          response = self.get_response(request)
+        return self.finish(request, response, timings)
+
+    async def __acall__(self, request):
+        with measure_request() as timings:
+          response = await self.get_response(request)
+        return self.finish(request, response, timings)
+
+    def finish(self, request, response, timings):
+        match = getattr(request, "resolver_match", None)
+        endpoint = match.url_name if match is not None and match.url_name else "other"
+        metrics.observe_request(endpoint, timings)
+        if(settings.SERVER_TIMING):
+          response["Server-Timing"] = timings.server_timing()
+        return response
+
+
+class DatabaseRoutingMiddleware:
+    """
+    リクエストごとにDBの読み取り先の固定(main_app.db.router)を初期化する
+    REPLICA_PRIMARY_PATH_PREFIXES(admin/など)へのリクエストは、最初からプライマリで読む
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if(self.async_mode):
+          markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if(self.async_mode):
+          return self.__acall__(request)
+        with routing_scope(pinned=request.path_info.startswith(settings.REPLICA_PRIMARY_PATH_PREFIXES)):
+          return self.get_response(request)
+
+    async def __acall__(self, request):
+        with routing_scope(pinned=request.path_info.startswith(settings.REPLICA_PRIMARY_PATH_PREFIXES)):
+          return await self.get_response(request)
@@ -0,0 +1,21 @@
+# Generated by Django 4.2 on 2026-10-18 17:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main_app', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RevokedRefreshToken',
+            fields=[
+                ('jti_hash', models.CharField(max_length=32, primary_key=True, serialize=False, verbose_name='jti_hash')),
+                ('user_id', models.BigIntegerField(db_index=True, null=True, verbose_name='user_id')),
+                ('exp', models.DateTimeField(db_index=True, verbose_name='exp')),
+            ],
+        ),
+    ]
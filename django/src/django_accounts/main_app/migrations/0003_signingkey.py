@@ -0,0 +1,24 @@
+# Generated by Django 4.2 on 2026-10-18 18:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main_app', '0002_revokedrefreshtoken'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SigningKey',
+            fields=[
+                ('kid', models.CharField(max_length=32, primary_key=True, serialize=False, verbose_name='kid')),
+                ('algorithm', models.CharField(max_length=10, verbose_name='algorithm')),
+                ('private_key', models.TextField(verbose_name='private_key')),
+                ('public_key', models.TextField(verbose_name='public_key')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='created_at')),
+                ('retired_at', models.DateTimeField(blank=True, null=True, verbose_name='retired_at')),
+            ],
+        ),
+    ]
@@ -1,11 +1,51 @@
-from django.db import models
+from django.db import models, router
 from django.contrib.auth.models import (BaseUserManager,
                                         AbstractBaseUser,
                                         PermissionsMixin)
+from django.db.models import F
+from django.db.models.functions import Lower
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
+from . import hashing
 
 
-class UserManager(BaseUserManager):
+class UserQuerySet(models.QuerySet):
+    def update_users(self, batch_size=1000, **fields):
+        """
+        管理画面やバッチ処理用の一括更新
+        対象ユーザーを主キーの順にbatch_size件ずつ選び、1回のUPDATEで指定したカラムとupdated_atだけを書き換えて、
+        そのユーザーのキャッシュを破棄する(IN句の大きさとキャッシュへの問い合わせの回数がbatch_sizeで抑えられる)
+        バッチごとにコミットされるので、全体を1つのトランザクションにしたい時は呼び出し元でatomicで囲む
+        パスワードは1件ずつハッシュ化が必要なので、ここでは更新できない
+        """
+        from .signals import invalidate_users
+
+        if "password" in fields:
+            raise ValueError("update_users() cannot update password. Use User.update_user().")
+        if "email" in fields:
+            fields["email"] = BaseUserManager.normalize_email(fields["email"])
+        fields["updated_at"] = timezone.now()
+
+        # 更新するユーザーはレプリカの遅れの影響を受けないように、書き込み先(プライマリ)から選ぶ
+        queryset = self if self._db else self.using(router.db_for_write(self.model))
+        queryset = queryset.order_by("pk")
+        deactivated = fields.get("is_active") is False
+        updated = 0
+        last_pk = None
+        while True:
+            batch = queryset if last_pk is None else queryset.filter(pk__gt=last_pk)
+            pks = list(batch.values_list("pk", flat=True)[:batch_size])
+            if not pks:
+                break
+            updated += self.model._default_manager.filter(pk__in=pks).update(**fields)
+            invalidate_users(pks, evict_tokens=deactivated, login=fields.get(self.model.USERNAME_FIELD))
+            if len(pks) < batch_size:
+                break
+            last_pk = pks[-1]
+        return updated
+
+
+class UserManager(BaseUserManager.from_queryset(UserQuerySet)):
     def _create_user(self, username, email, password, **extra_fields):
         email = self.normalize_email(email)
         user = self.model(username=username, email=email, **extra_fields)
@@ -35,17 +75,22 @@ class UserManager(BaseUserManager):
             password=password,
             **extra_fields,
         )
-    
-    def update_user(self, fields):
-        for key, value in fields.items():
-            if(key=="password"):
-                self.set_password(value)
-            else:
-                if(key=="email") : 
-                    value = self.normalize_email(value)
-                setattr(self, key, value)
-        self.save(using=self._db)
-        return self
+
+    def bulk_update_users(self, users, fields, batch_size=None):
+        """
+        ユーザーごとに異なる値をまとめて更新するbulk_update
+        指定したカラムとupdated_atだけを書き換え、対象ユーザーのキャッシュを破棄する
+        """
+        from .signals import invalidate_user
+
+        now = timezone.now()
+        for user in users:
+            user.updated_at = now
+        updated = self.bulk_update(users, list(fields) + ["updated_at"], batch_size=batch_size)
+        for user in users:
+            invalidate_user(user.pk, evict_tokens=not user.is_active, login=user.get_username())
+            user._loaded_values = user.get_field_values()
+        return updated
 
 class User(AbstractBaseUser, PermissionsMixin):
 
@@ -83,8 +128,140 @@ class User(AbstractBaseUser, PermissionsMixin):
 
     objects = UserManager()
 
+    class Meta:
+        indexes = [
+            # 大文字小文字を区別しない前方一致検索とキーセットページング用(main_app.user_search)
+            models.Index(Lower("username"), F("id"), name="user_username_lower_idx"),
+            models.Index(Lower("email"), F("id"), name="user_email_lower_idx"),
+            # 登録順の一覧のキーセットページング用(main_app.pagination)
+            models.Index(fields=["created_at", "id"], name="user_created_at_id_idx"),
+        ]
+
     USERNAME_FIELD = 'email' # ログイン時、ユーザー名の代わりにemailを使用
     REQUIRED_FIELDS = ['username']  # スーパーユーザー作成時にusernameも設定する
 
     def __str__(self):
         return self.username
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        """
+        DBから読み込んだ時の値を保持し、変更されたカラムを判定できるようにする
+        """
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+
+    def get_field_values(self):
+        return {field.attname: getattr(self, field.attname)
+                for field in self._meta.concrete_fields
+                if field.attname not in self.get_deferred_fields()}
+
+    def get_dirty_fields(self):
+        """
+        DBから読み込んだ後に変更されたカラムの名前のリストを返す
+        """
+        loaded = getattr(self, "_loaded_values", None)
+        if loaded is None:
+            return [field.name for field in self._meta.concrete_fields if not field.primary_key]
+        return [field.name for field in self._meta.concrete_fields
+                if field.attname in loaded and getattr(self, field.attname) != loaded[field.attname]]
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        self._loaded_values = self.get_field_values()
+
+    def update_user(self, fields):
+        """
+        指定されたフィールドを更新し、変更されたカラムとupdated_atだけをUPDATEする
+        何も変わっていなければ書き込まない。パスワードは指定された時だけハッシュ化する
+        """
+        for key, value in fields.items():
+            if(key=="password"):
+                self.set_password(value)
+            else:
+                if(key=="email") :
+                    value = User.objects.normalize_email(value)
+                setattr(self, key, value)
+
+        if self._state.adding:
+            self.save()
+            return self
+        dirty_fields = self.get_dirty_fields()
+        if dirty_fields:
+            self.save(update_fields=dirty_fields + ["updated_at"])
+        return self
+
+    def set_password(self, raw_password):
+        """
+        パスワードのハッシュ化をワーカープールで行う
+        """
+        self.password = hashing.make_password(raw_password)
+        self._password = raw_password
+
+    def check_password(self, raw_password):
+        """
+        パスワードの検証をワーカープールで行う
+        ハッシュの設定が変わっていれば、一致した時に新しい設定でハッシュ化し直す
+        """
+        def setter(raw_password):
+            self.set_password(raw_password)
+            # パスワードは変わっていないので、パスワード変更時の処理は行わない
+            self._password = None
+            self.save(update_fields=["password"])
+
+        return hashing.check_password(raw_password, self.password, setter)
+
+
+class RevokedRefreshToken(models.Model):
+    """
+    使用済み(ローテーション済み)・失効したリフレッシュトークン
+    行を小さく保つため、jtiのハッシュ・user_id・有効期限だけを持つ
+    有効期限を過ぎた行は sweep_refresh_tokens コマンドで削除する
+    """
+    jti_hash = models.CharField(
+        verbose_name=_("jti_hash"),
+        max_length=32,
+        primary_key=True
+    )
+    user_id = models.BigIntegerField(
+        verbose_name=_("user_id"),
+        null=True,
+        db_index=True
+    )
+    exp = models.DateTimeField(
+        verbose_name=_("exp"),
+        db_index=True
+    )
+
+
+class SigningKey(models.Model):
+    """
+    jwtを署名する非対称鍵のペア(RS256/ES256/EdDSAを使う時)
+    最も新しい未退役の鍵で署名し、退役した鍵もリフレッシュトークンの有効期間が過ぎるまでは検証用に公開する
+    秘密鍵はSECRET_KEYで暗号化したPEMで保存する
+    """
+    kid = models.CharField(
+        verbose_name=_("kid"),
+        max_length=32,
+        primary_key=True
+    )
+    algorithm = models.CharField(
+        verbose_name=_("algorithm"),
+        max_length=10
+    )
+    private_key = models.TextField(
+        verbose_name=_("private_key")
+    )
+    public_key = models.TextField(
+        verbose_name=_("public_key")
+    )
+    created_at = models.DateTimeField(
+        verbose_name=_("created_at"),
+        auto_now_add=True
+    )
+    retired_at = models.DateTimeField(
+        verbose_name=_("retired_at"),
+        null=True,
+        blank=True
+    )
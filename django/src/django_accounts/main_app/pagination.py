@@ -0,0 +1,123 @@
+"""
+キーセット(カーソル)によるページング
+最後に返した行の(並び順の値, 主キー)をカーソルにして、その次の行から取得する
+OFFSETを使わないので、何ページ目でもインデックスの読み込みは1ページ分で済む
+"""
+from django.conf import settings
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from django.utils.translation import gettext_lazy as _
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+import base64
+import json
+
+
+def encode_cursor(value, pk):
+    return base64.urlsafe_b64encode(json.dumps([value, pk]).encode()).decode().rstrip("=")
+
+def decode_cursor(cursor):
+    """
+    カーソルを(値, 主キー)に戻す。不正なカーソルならValueErrorを送出する
+    """
+    try:
+        value, pk = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except Exception:
+        raise ValueError("Invalid cursor.")
+    if not isinstance(value, str) or not isinstance(pk, int):
+        raise ValueError("Invalid cursor.")
+    return value, pk
+
+def created_at_after(queryset, created_at, pk):
+    """
+    (created_at, id)が(created_at, pk)より後ろの行に絞り込む
+    """
+    return queryset.filter(Q(created_at__gt=created_at) | Q(created_at=created_at, id__gt=pk))
+
+def created_at_batches(queryset, batch_size):
+    """
+    querysetを(created_at, id)のキーセットでbatch_size件ずつ読み込み、1行ずつ返す
+    QuerySet.iteratorはmysqlclientでは結果をすべてクライアントに読み込むので、ストリーミングにはこちらを使う
+    """
+    queryset = queryset.order_by("created_at", "id")
+    batch = list(queryset[:batch_size])
+    while batch:
+        yield from batch
+        if len(batch) < batch_size:
+            return
+        last = batch[-1]
+        batch = list(created_at_after(queryset, last.created_at, last.pk)[:batch_size])
+
+
+class CreatedAtKeysetPagination(BasePagination):
+    """
+    (created_at, id)の順に並べ、最後の行の(created_at, id)より後ろを次のページとして返す
+    User.Metaの(created_at, id)の複合インデックスを範囲検索する
+    """
+    cursor_query_param = "cursor"
+    page_size_query_param = "limit"
+    invalid_cursor_message = _("Invalid cursor")
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return settings.USER_LIST_PAGE_SIZE
+        return min(max(page_size, 1), settings.USER_LIST_MAX_PAGE_SIZE)
+
+    def decode_cursor(self, request):
+        """
+        リクエストのカーソルを(created_at, id)にする。カーソルがなければNoneを返す
+        """
+        cursor = request.query_params.get(self.cursor_query_param)
+        if cursor is None:
+            return None
+        try:
+            value, pk = decode_cursor(cursor)
+        except ValueError:
+            raise NotFound(self.invalid_cursor_message)
+        created_at = parse_datetime(value)
+        if created_at is None:
+            raise NotFound(self.invalid_cursor_message)
+        return created_at, pk
+
+    def filter_queryset(self, queryset, request):
+        """
+        カーソルより後ろの行を(created_at, id)の順に並べたクエリセットを返す
+        """
+        queryset = queryset.order_by("created_at", "id")
+        cursor = self.decode_cursor(request)
+        if cursor is not None:
+            created_at, pk = cursor
+            queryset = created_at_after(queryset, created_at, pk)
+        return queryset
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        page_size = self.get_page_size(request)
+        rows = list(self.filter_queryset(queryset, request)[:page_size + 1])
+        page = rows[:page_size]
+        self.next_cursor = None
+        if len(rows) > page_size:
+            last = page[-1]
+            self.next_cursor = encode_cursor(last.created_at.isoformat(), last.pk)
+        return page
+
+    def get_next_link(self):
+        if self.next_cursor is None:
+            return None
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param, self.next_cursor)
+
+    def get_paginated_response(self, data):
+        return Response({"next": self.get_next_link(), "results": data})
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            "type": "object",
+            "properties": {
+                "next": {"type": "string", "nullable": True, "format": "uri"},
+                "results": schema,
+            },
+        }
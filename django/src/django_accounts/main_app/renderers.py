@@ -0,0 +1,29 @@
+from rest_framework import renderers
+from .instrumentation import timed
+
+
+class JSONRenderer(renderers.JSONRenderer):
+    """
+    シリアライズの時間を計測するJSONRenderer
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        with timed("serialize"):
+            return super().render(data, accepted_media_type, renderer_context)
+
+
+class NDJSONRenderer(renderers.JSONRenderer):
+    """
+    1行に1つのJSONを書き出す(改行区切りJSON)
+    リストは要素ごとに1行にする。一覧をストリーミングする時はビューが行ごとにこのrenderを使う
+    """
+    media_type = "application/x-ndjson"
+    format = "ndjson"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b""
+        if not isinstance(data, list):
+            data = [data]
+        return b"".join(super(NDJSONRenderer, self).render(item, accepted_media_type, renderer_context) + b"\n"
+                        for item in data)
@@ -1,5 +1,18 @@
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils.translation import gettext_lazy as _
 from rest_framework import serializers
+from rest_framework.exceptions import ErrorDetail
+from rest_framework_simplejwt import serializers as jwt_serializers
+from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
+from rest_framework_simplejwt.settings import api_settings
+from .db.router import sticky_writes, user_key, login_key
 from .models import User
+from .tokens import RefreshToken, UntypedToken
+from .user_index import user_index
+from .pagination import decode_cursor
+from .user_search import SEARCH_FIELDS
+from . import token_store
 
 class UserSerializer(serializers.ModelSerializer):
     
@@ -12,11 +25,44 @@ class UserSerializer(serializers.ModelSerializer):
             'password': {'write_only': True, 'required':False},
         }
 
+    default_error_messages = {
+        "taken": _("A user with that %(field)s already exists."),
+        "exists": _("A user with that username or email already exists."),
+    }
+
+    def taken_errors(self, taken):
+        """
+        登録済みのフィールドのエラー(非同期版のビューも同じ形で返す)
+        """
+        return {field: [self.error_messages["taken"] % {"field": field}] for field in taken}
+
+    def exists_errors(self):
+        """
+        確認後に他から登録されて、DBの一意制約で弾かれた時のエラー
+        """
+        return {"detail": [self.error_messages["exists"]]}
+
+    def validate(self, attrs):
+        """
+        新規登録の時は、パスワードをハッシュ化する前にusername/emailの重複を確認します。
+        まとめて確認する呼び出し元はcontextのcheck_existsをFalseにします。
+        """
+        if self.instance is None and self.context.get("check_exists", True):
+            taken = user_index.taken_fields(User, attrs)
+            if taken:
+                raise serializers.ValidationError(self.taken_errors(taken))
+        return attrs
+
     def create(self, validated_data):
         """
         新しいUserインスタンスを作成します。
         """
-        return User.objects.create_user(**validated_data)
+        try:
+            with transaction.atomic():
+                return User.objects.create_user(**validated_data)
+        except IntegrityError:
+            # 確認後に他から登録された分はDBの一意制約で弾く
+            raise serializers.ValidationError(self.exists_errors())
     
     def update(self, instance, validated_data):
         """
@@ -26,7 +72,137 @@ class UserSerializer(serializers.ModelSerializer):
         return instance
 
     def is_valid(self, valid_fields=(), **kwargs):
+        """
+        valid_fieldsを指定すると、それ以外のフィールドは無視する
+        新規登録の時は、valid_fieldsのうち送られていないフィールドも必須のエラーにする
+        (username/emailはupdateで一部だけ更新できるように、Metaでは必須にしていない)
+        """
         if valid_fields:
             self.initial_data = {k: v for k, v in self.initial_data.items() if(k in valid_fields)}
-        return super().is_valid(**kwargs)
+        valid = super().is_valid(**kwargs)
+        missing = [field for field in valid_fields if field not in self.initial_data]
+        if self.instance is None and missing:
+            for field in missing:
+                self._errors.setdefault(field, [ErrorDetail(self.fields[field].error_messages["required"],
+                                                            code="required")])
+            self._validated_data = {}
+            valid = False
+        if not valid and kwargs.get("raise_exception"):
+            raise serializers.ValidationError(self.errors)
+        return valid
+
+
+class UserAvailabilitySerializer(serializers.Serializer):
+    """
+    username/emailが使えるかを確認するクエリパラメータ
+    """
+    username = serializers.CharField(required=False, max_length=15)
+    email = serializers.EmailField(required=False)
+
+    def validate(self, attrs):
+        if not attrs:
+            raise serializers.ValidationError(_("Specify username or email."))
+        taken = user_index.taken_fields(User, attrs)
+        return {field: field not in taken for field in attrs}
+
+
+class UserSearchSerializer(serializers.Serializer):
+    """
+    ユーザーの前方一致検索のクエリパラメータ
+    """
+    q = serializers.CharField(max_length=254)
+    field = serializers.ChoiceField(choices=SEARCH_FIELDS, default="username")
+    cursor = serializers.CharField(required=False)
+    limit = serializers.IntegerField(min_value=1, max_value=settings.USER_SEARCH_MAX_LIMIT, default=20)
+
+    def validate_cursor(self, value):
+        try:
+            return decode_cursor(value)
+        except ValueError as e:
+            raise serializers.ValidationError(str(e))
+
+
+class TokenObtainPairSerializer(jwt_serializers.TokenObtainPairSerializer):
+    """
+    main_app.tokensのトークンを発行する
+    """
+    token_class = RefreshToken
+
+    def validate(self, attrs):
+        # 登録した直後のユーザーは、レプリカに反映される前でもログインできるようにプライマリで読む
+        sticky_writes.check(login_key(attrs[self.username_field]))
+        return super().validate(attrs)
+
+
+class TokenRefreshSerializer(jwt_serializers.TokenRefreshSerializer):
+    """
+    リフレッシュトークンの失効リストを確認してからトークンを更新する
+    ローテーションする時は、使用済みのトークンを失効リストに記録して再利用できないようにする
+    """
+    token_class = RefreshToken
+
+    def validate(self, attrs):
+        refresh = self.token_class(attrs["refresh"])
+        if api_settings.ROTATE_REFRESH_TOKENS:
+            # 記録に失敗したら使用済みなので、同じトークンでの同時更新もどちらか一方しか通らない
+            if not token_store.revoke(refresh):
+                raise InvalidToken(_("Token is blacklisted"))
+        elif token_store.is_revoked(refresh):
+            raise InvalidToken(_("Token is blacklisted"))
+        sticky_writes.check(user_key(refresh.get(api_settings.USER_ID_CLAIM)))
+        return super().validate(attrs)
+
+
+class TokenVerifySerializer(jwt_serializers.TokenVerifySerializer):
+    """
+    リフレッシュトークンの場合は失効リストも確認する
+    """
+
+    def validate(self, attrs):
+        token = UntypedToken(attrs["token"])
+        if token.get(api_settings.TOKEN_TYPE_CLAIM) == "refresh" and token_store.is_revoked(token):
+            raise serializers.ValidationError(_("Token is blacklisted"))
+        return {}
+
+
+class TokenBatchVerifySerializer(serializers.Serializer):
+    """
+    複数のトークンをまとめて検証し、トークンごとの結果を返す
+    検証には全トークンで同じトークンバックエンド(準備済みの鍵)を使い、失効リストの確認も1回の問い合わせで行う
+    """
+    tokens = serializers.ListField(
+        child=serializers.CharField(),
+        allow_empty=False,
+        max_length=settings.JWT_BATCH_VERIFY_MAX,
+    )
+
+    def validate(self, attrs):
+        results = []
+        refresh_tokens = []
+        for raw_token in attrs["tokens"]:
+            try:
+                token = UntypedToken(raw_token)
+            except TokenError as e:
+                results.append({"valid": False, "detail": e.args[0], "code": "token_not_valid"})
+                continue
+            results.append({"valid": True, "claims": token.payload})
+            if token.get(api_settings.TOKEN_TYPE_CLAIM) == "refresh":
+                refresh_tokens.append((len(results) - 1, token))
+
+        revoked = token_store.revoked_among([token for _index, token in refresh_tokens])
+        for index, token in refresh_tokens:
+            if token_store.hash_jti(token[api_settings.JTI_CLAIM]) in revoked:
+                results[index] = {"valid": False, "detail": _("Token is blacklisted"), "code": "token_blacklisted"}
+        return {"results": results}
+
+
+class TokenRevokeSerializer(serializers.Serializer):
+    """
+    リフレッシュトークンを失効させる(ログアウト用)
+    """
+    refresh = serializers.CharField(write_only=True)
+    token_class = RefreshToken
 
+    def validate(self, attrs):
+        token_store.revoke(self.token_class(attrs["refresh"]))
+        return {}
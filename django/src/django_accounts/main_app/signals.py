@@ -0,0 +1,56 @@
+"""
+Userモデルの変更を各キャッシュに反映するシグナル
+"""
+from django.core.cache import cache
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from .db.router import sticky_writes, user_key, login_key
+from .models import User
+from .user_cache import user_cache, shared_user_cache
+from .token_cache import decoded_token_cache
+from .user_index import user_index
+
+
+def invalidate_user(pk, evict_tokens=False, login=None):
+    """
+    ユーザーのキャッシュを破棄し、しばらくの間ユーザーの読み取りをプライマリで行うようにする
+    evict_tokensがTrueなら、ユーザーのトークンを検証済みトークンのキャッシュからも捨てる
+    loginにはログインに使う値(USERNAME_FIELD)が変わった時の新しい値を渡す
+    """
+    sticky_writes.stick(user_key(pk), *([login_key(login)] if login else []))
+    user_cache.invalidate(pk)
+    shared_user_cache.invalidate(pk)
+    cache.delete("user_active:%s" % pk)
+    if(evict_tokens):
+      decoded_token_cache.evict_user(pk)
+
+def invalidate_users(pks, evict_tokens=False, login=None):
+    """
+    invalidate_userの一括版(一括更新用)。共有のキャッシュへの問い合わせはユーザーの数によらず数回で済む
+    """
+    sticky_writes.stick(*[user_key(pk) for pk in pks], *([login_key(login)] if login else []))
+    for pk in pks:
+      user_cache.invalidate(pk)
+      if(evict_tokens):
+        decoded_token_cache.evict_user(pk)
+    shared_user_cache.invalidate_many(pks)
+    cache.delete_many(["user_active:%s" % pk for pk in pks])
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_user_cache(sender, instance, **kwargs):
+    """
+    ユーザーの保存(更新・無効化を含む)や削除時にキャッシュを破棄する
+    無効化・削除されたユーザーのトークンは、検証済みトークンのキャッシュからも捨てる
+    """
+    invalidate_user(instance.pk,
+                    evict_tokens=kwargs.get("signal") is post_delete or not instance.is_active,
+                    login=instance.get_username())
+
+@receiver(post_save, sender=User)
+def add_user_to_index(sender, instance, created, **kwargs):
+    """
+    登録されたユーザーを重複確認のフィルタに追加する
+    """
+    if(created):
+      user_index.add(instance)
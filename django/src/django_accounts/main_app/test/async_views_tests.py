@@ -0,0 +1,189 @@
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.test import TestCase, AsyncRequestFactory, override_settings
+from django.urls import reverse
+from rest_framework import status
+from ..models import User
+from .helpers import create_default_user
+from ..utils import get_jwt
+from ..user_cache import user_cache
+from ..user_index import user_index
+from ..keys import keyring, rotate_signing_key
+from ..tokens import token_backend
+from ..async_views import (AsyncIsLoginView, AsyncSignupView, AsyncTokenObtainPairView,
+                           AsyncTokenRefreshView, AsyncTokenVerifyView)
+from unittest import mock
+import json
+import jwt
+import os
+
+JWT_HEADER = os.environ.get("JWT_AUTH_HEADER_TYPES")
+
+class AsyncViewsTests(TestCase):
+
+  def setUp(self):
+    user_cache.clear()
+    self.factory = AsyncRequestFactory()
+
+  async def post(self, view, data):
+    request = self.factory.post("/", json.dumps(data), content_type="application/json")
+    return await view.as_view()(request)
+
+  async def test_is_login_view_get_with_jwt(self):
+    """
+    非同期版のis_login_viewに有効なjwtを付与してGETメソッドを送ったときにTrueが返ってくる
+    """
+    user = await User.objects.acreate(username="Test User", email="example@example.com")
+    request = self.factory.get("/", headers={"Authorization": JWT_HEADER+" "+get_jwt(user)["access"]})
+    response = await AsyncIsLoginView.as_view()(request)
+    self.assertEqual(response.status_code, status.HTTP_200_OK)
+    self.assertTrue(json.loads(response.content)["loginFlg"])
+
+  async def test_is_login_view_get_with_invalid_jwt(self):
+    """
+    非同期版のis_login_viewに無効なjwtを付与してGETメソッドを送ったときに401エラーが返ってくる
+    """
+    user = await User.objects.acreate(username="Test User", email="example@example.com")
+    request = self.factory.get("/", headers={"Authorization": JWT_HEADER+" "+get_jwt(user)["access"]+"invalid"})
+    response = await AsyncIsLoginView.as_view()(request)
+    self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+  async def test_is_login_view_get_with_not_jwt(self):
+    """
+    非同期版のis_login_viewにjwtを付与しないときにFalseが返ってくる
+    """
+    response = await AsyncIsLoginView.as_view()(self.factory.get("/"))
+    self.assertEqual(response.status_code, status.HTTP_200_OK)
+    self.assertFalse(json.loads(response.content)["loginFlg"])
+
+  async def test_signup_view_post(self):
+    """
+    非同期版のsignup_viewにPOSTメソッドを送ったときにユーザーが追加されてログインされている
+    """
+    response = await self.post(AsyncSignupView, {"username": "Test User",
+                                                 "email": "example@example.com",
+                                                 "password": "password"})
+    self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+    self.assertNotIn("password", json.loads(response.content))
+    user = await User.objects.aget(email="example@example.com")
+    self.assertTrue(user.check_password("password"))
+    self.assertTrue("Authorization" in response.cookies)
+    self.assertTrue("refresh" in response.cookies)
+
+  async def test_signup_view_post_with_invalid_params(self):
+    """
+    非同期版のsignup_viewに無効なパラメータでPOSTメソッドを送ったときにユーザーが追加されない
+    """
+    response = await self.post(AsyncSignupView, {"username": "a"*16,
+                                                 "email": "example@example.com",
+                                                 "password": "password"})
+    self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+    self.assertFalse(await User.objects.filter(email="example@example.com").aexists())
+
+  async def test_signup_responses_match_sync_view(self):
+    """
+    非同期版のユーザー登録は、成功・重複・無効な入力・必須項目の不足・DBの一意制約のどれでも同期版と同じレスポンスを返す
+    """
+    await sync_to_async(create_default_user)()
+    cases = [
+      {"username": "New User", "email": "new@example.com", "password": "password"},
+      {"username": "Test User", "email": "EXAMPLE@example.com", "password": "password"},
+      {"username": "a"*16, "email": "invalid", "password": "password"},
+      {"username": "", "email": "", "password": ""},
+      {"email": "other@example.com"},
+    ]
+
+    async def sync_signup(data):
+      self.client.cookies.clear()
+      return await sync_to_async(self.client.post)(reverse("main_app:signup"), data,
+                                                   content_type="application/json")
+
+    for data in cases:
+      with self.subTest(data=data):
+        cache.clear()
+        expected = await sync_signup(data)
+        await User.objects.filter(username="New User").adelete()
+        cache.clear()
+        response = await self.post(AsyncSignupView, data)
+        await User.objects.filter(username="New User").adelete()
+        self.assertEqual(response.status_code, expected.status_code)
+        body, expected_body = json.loads(response.content), json.loads(expected.content)
+        # idは登録ごとに変わる
+        body.pop("id", None), expected_body.pop("id", None)
+        self.assertEqual(body, expected_body)
+        if(response.status_code == status.HTTP_201_CREATED):
+          self.assertEqual(body, {"username": "New User", "email": "new@example.com"})
+
+    # 確認後に他から登録され、DBの一意制約で弾かれた時
+    data = {"username": "Test User", "email": "other@example.com", "password": "password"}
+    with mock.patch.object(user_index, "taken_fields", return_value=[]), \
+         mock.patch.object(user_index, "ataken_fields", return_value=[]):
+      cache.clear()
+      expected = await sync_signup(data)
+      cache.clear()
+      response = await self.post(AsyncSignupView, data)
+    self.assertEqual(expected.status_code, status.HTTP_400_BAD_REQUEST)
+    self.assertEqual(response.status_code, expected.status_code)
+    self.assertEqual(json.loads(response.content), json.loads(expected.content))
+
+  async def test_token_obtain_refresh_and_verify(self):
+    """
+    非同期版のトークンエンドポイントで、発行・更新・検証ができる
+    """
+    await sync_to_async(create_default_user)()
+    response = await self.post(AsyncTokenObtainPairView, {"email": "example@example.com",
+                                                          "password": "password"})
+    self.assertEqual(response.status_code, status.HTTP_200_OK)
+    tokens = json.loads(response.content)
+
+    response = await self.post(AsyncTokenRefreshView, {"refresh": tokens["refresh"]})
+    self.assertEqual(response.status_code, status.HTTP_200_OK)
+    refreshed = json.loads(response.content)
+    self.assertNotEqual(refreshed["refresh"], tokens["refresh"])
+
+    response = await self.post(AsyncTokenVerifyView, {"token": refreshed["access"]})
+    self.assertEqual(response.status_code, status.HTTP_200_OK)
+    response = await self.post(AsyncTokenVerifyView, {"token": refreshed["access"]+"invalid"})
+    self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+  async def test_token_obtain_with_wrong_password(self):
+    """
+    非同期版のトークン発行でパスワードが違う時、401エラーが返ってくる
+    """
+    await User.objects.acreate(username="Test User", email="example@example.com")
+    response = await self.post(AsyncTokenObtainPairView, {"email": "example@example.com",
+                                                          "password": "wrong"})
+    self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+    response = await self.post(AsyncTokenObtainPairView, {"email": "example@example.com"})
+    self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+  @override_settings(ASYNC_API_VIEWS=True)
+  async def test_views_with_asymmetric_keys(self):
+    """
+    RS256の時も、非同期版のビューでDBの鍵を使ってトークンを発行・検証できる(イベントループ上で同期のORMを使わない)
+    """
+    await sync_to_async(rotate_signing_key)("RS256")
+    with mock.patch.object(token_backend, "algorithm", "RS256"):
+      response = await self.post(AsyncSignupView, {"username": "Test User",
+                                                   "email": "example@example.com",
+                                                   "password": "password"})
+      self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+      self.assertTrue("Authorization" in response.cookies)
+      access = response.cookies["Authorization"].value
+
+      # 他のプロセスで鍵がローテーションされ、このプロセスの鍵が古くなっていても読み込み直す
+      keyring.reload()
+      request = self.factory.get("/", headers={"Authorization": access})
+      response = await AsyncIsLoginView.as_view()(request)
+      self.assertEqual(response.status_code, status.HTTP_200_OK)
+      self.assertTrue(json.loads(response.content)["loginFlg"])
+
+      response = await self.post(AsyncTokenObtainPairView, {"email": "example@example.com",
+                                                            "password": "password"})
+      self.assertEqual(response.status_code, status.HTTP_200_OK)
+      tokens = json.loads(response.content)
+      self.assertEqual(jwt.get_unverified_header(tokens["access"])["alg"], "RS256")
+      response = await self.post(AsyncTokenRefreshView, {"refresh": tokens["refresh"]})
+      self.assertEqual(response.status_code, status.HTTP_200_OK)
+      response = await self.post(AsyncTokenVerifyView, {"token": tokens["access"]})
+      self.assertEqual(response.status_code, status.HTTP_200_OK)
@@ -0,0 +1,258 @@
+from django.test import TestCase
+from django.core.cache import cache
+from django.http import HttpRequest
+from django.urls import reverse
+from rest_framework.request import Request
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+from rest_framework_simplejwt.utils import get_md5_hash_password
+from ..models import User
+from .helpers import create_default_user
+from ..authentication import CachedJWTAuthentication, CookieJWTAuthentication
+from ..user_cache import user_cache, shared_user_cache, UserLRUCache, SharedUserCache
+from ..utils import get_jwt
+from unittest import mock
+import datetime
+import os
+
+# 環境変数を読み込む
+JWT_HEADER = os.environ.get("JWT_AUTH_HEADER_TYPES")
+
+def create_jwt_request(user):
+  """
+  jwtをヘッダーにセットしたリクエストを作成する
+  """
+  request = Request(HttpRequest())
+  request.META["HTTP_AUTHORIZATION"] = JWT_HEADER+" "+get_jwt(user)["access"]
+  return request
+
+class CachedJWTAuthenticationTests(TestCase):
+
+  @classmethod
+  def setUpTestData(cls):
+    cls.user = create_default_user()
+
+  def setUp(self):
+    cache.clear()
+    user_cache.clear()
+    self.request = create_jwt_request(self.user)
+
+  def test_authenticate_queries_database_once(self):
+    """
+    同じユーザーで連続して認証したとき、DBへの問い合わせは1回だけ
+    """
+    with self.assertNumQueries(1):
+      for _ in range(5):
+        user, _token = CachedJWTAuthentication().authenticate(self.request)
+    self.assertEqual(user.pk, self.user.pk)
+
+  def test_save_user_invalidates_cache(self):
+    """
+    ユーザーを更新するとキャッシュが破棄され、更新後のユーザーが返ってくる
+    """
+    CachedJWTAuthentication().authenticate(self.request)
+    self.user.username = "Updated User"
+    self.user.save()
+    user, _token = CachedJWTAuthentication().authenticate(self.request)
+    self.assertEqual(user.username, "Updated User")
+
+  def test_deactivated_user_is_rejected(self):
+    """
+    キャッシュ済みのユーザーを無効化すると、認証に失敗する
+    """
+    CachedJWTAuthentication().authenticate(self.request)
+    self.user.is_active = False
+    self.user.save()
+    with self.assertRaises(AuthenticationFailed):
+      CachedJWTAuthentication().authenticate(self.request)
+
+  def test_deleted_user_is_rejected(self):
+    """
+    キャッシュ済みのユーザーを削除すると、認証に失敗する
+    """
+    CachedJWTAuthentication().authenticate(self.request)
+    self.user.delete()
+    with self.assertRaises(AuthenticationFailed):
+      CachedJWTAuthentication().authenticate(self.request)
+
+  def test_lru_cache_evicts_oldest_entry(self):
+    """
+    上限を超えたとき、最も古く使われたユーザーが捨てられる
+    """
+    cache = UserLRUCache(max_size=2, ttl=60)
+    cache.set(1, self.user)
+    cache.set(2, self.user)
+    cache.get(1)
+    cache.set(3, self.user)
+    self.assertTrue(cache.get(1))
+    self.assertIsNone(cache.get(2))
+    self.assertTrue(cache.get(3))
+
+class SharedUserCacheTests(TestCase):
+
+  @classmethod
+  def setUpTestData(cls):
+    cls.user = create_default_user()
+
+  def setUp(self):
+    cache.clear()
+    user_cache.clear()
+
+  def test_snapshot_is_shared_between_processes(self):
+    """
+    プロセス内のキャッシュが空でも、共有スナップショットがあればDBを参照しない
+    """
+    shared_user_cache.get_or_load(User, self.user.pk)
+    with self.assertNumQueries(0):
+      user = shared_user_cache.get_or_load(User, self.user.pk)
+    self.assertEqual(user.email, self.user.email)
+    self.assertFalse(user._state.adding)
+
+  def test_snapshot_does_not_contain_password(self):
+    """
+    スナップショットにパスワードのハッシュは含まれず、必要な時だけDBから読み込む
+    """
+    shared_user_cache.get_or_load(User, self.user.pk)
+    version = shared_user_cache.get_version(self.user.pk)
+    snapshot = cache.get(shared_user_cache.snapshot_key % (self.user.pk, version))
+    self.assertNotIn(self.user.password, str(snapshot))
+    user = shared_user_cache.get_or_load(User, self.user.pk)
+    self.assertIn("password", user.get_deferred_fields())
+    with self.assertNumQueries(1):
+      self.assertTrue(user.check_password("password"))
+
+    # トークンの失効の確認は、パスワードのハッシュを読み込まずにできる
+    token = {api_settings.REVOKE_TOKEN_CLAIM: get_md5_hash_password(self.user.password)}
+    user = shared_user_cache.get_or_load(User, self.user.pk)
+    with mock.patch.object(api_settings, "CHECK_REVOKE_TOKEN", True), self.assertNumQueries(0):
+      CachedJWTAuthentication().check_user(user, token)
+      with self.assertRaises(AuthenticationFailed):
+        CachedJWTAuthentication().check_user(user, {api_settings.REVOKE_TOKEN_CLAIM: "changed"})
+
+  def test_save_user_bumps_snapshot_version(self):
+    """
+    ユーザーを更新するとバージョンが上がり、更新後のユーザーが返ってくる
+    """
+    shared_user_cache.get_or_load(User, self.user.pk)
+    version = shared_user_cache.get_version(self.user.pk)
+    self.user.username = "Updated User"
+    self.user.save()
+    self.assertNotEqual(shared_user_cache.get_version(self.user.pk), version)
+    user = shared_user_cache.get_or_load(User, self.user.pk)
+    self.assertEqual(user.username, "Updated User")
+
+  def shared_cache(self):
+    return SharedUserCache(alias="default", ttl=60, lock_timeout=60, missing_ttl=10, wait_timeout=0.05)
+
+  def test_uses_previous_snapshot_while_locked(self):
+    """
+    他のワーカーがDBから取得中の時は、1つ前のバージョンのスナップショットがあれば待たずにそれを使う
+    """
+    shared = self.shared_cache()
+    shared.get_or_load(User, self.user.pk)
+    shared.invalidate(self.user.pk)
+    cache.add(shared.lock_key % self.user.pk, 1)
+    with mock.patch("time.sleep") as sleep, self.assertNumQueries(0):
+      user = shared.get_or_load(User, self.user.pk)
+    self.assertEqual(user.pk, self.user.pk)
+    sleep.assert_not_called()
+
+  def test_waits_for_snapshot_while_locked(self):
+    """
+    1つ前のスナップショットがなければ、ロックを取ったワーカーが格納するのを待つ
+    """
+    shared = self.shared_cache()
+    cache.add(shared.lock_key % self.user.pk, 1)
+    key = shared.snapshot_key % (self.user.pk, shared.get_version(self.user.pk))
+
+    def other_worker_stores(seconds):
+      cache.set(key, shared._dump(self.user))
+    with mock.patch("time.sleep", side_effect=other_worker_stores), self.assertNumQueries(0):
+      user = shared.get_or_load(User, self.user.pk)
+    self.assertEqual(user.pk, self.user.pk)
+
+  def test_loads_from_database_when_wait_times_out(self):
+    """
+    待っても格納されなければ、DBから取得する(スナップショットは格納しない)
+    """
+    shared = self.shared_cache()
+    cache.add(shared.lock_key % self.user.pk, 1)
+    with self.assertNumQueries(1):
+      user = shared.get_or_load(User, self.user.pk)
+    self.assertEqual(user.pk, self.user.pk)
+    self.assertIsNone(cache.get(shared.snapshot_key % (self.user.pk, shared.get_version(self.user.pk))))
+
+  def test_missing_user_returns_none(self):
+    """
+    存在しないユーザーの時はNoneが返ってくる
+    """
+    self.assertIsNone(shared_user_cache.get_or_load(User, self.user.pk + 1))
+
+  def test_missing_user_is_cached(self):
+    """
+    存在しないユーザーもしばらく記録され、続くリクエストではDBを参照しない
+    """
+    shared_user_cache.get_or_load(User, self.user.pk + 1)
+    with self.assertNumQueries(0):
+      self.assertIsNone(shared_user_cache.get_or_load(User, self.user.pk + 1))
+
+class CookieJWTAuthenticationTests(TestCase):
+
+  @classmethod
+  def setUpTestData(cls):
+    cls.user = create_default_user()
+
+  def setUp(self):
+    cache.clear()
+    user_cache.clear()
+    self.is_login_url = reverse("main_app:is_login")
+
+  def test_authenticate_with_cookie(self):
+    """
+    Authorizationヘッダーがなくても、クッキーのjwtで認証される
+    """
+    request = Request(HttpRequest())
+    request.COOKIES["Authorization"] = JWT_HEADER+" "+get_jwt(self.user)["access"]
+    user, _token = CookieJWTAuthentication().authenticate(request)
+    self.assertEqual(user.pk, self.user.pk)
+
+  def test_authenticate_parses_jwt_once_per_request(self):
+    """
+    同じリクエストで何度認証しても、jwtの検証は1回だけ行われる
+    """
+    request = create_jwt_request(self.user)
+    authentication = CookieJWTAuthentication()
+    with mock.patch.object(authentication, "get_validated_token",
+                           wraps=authentication.get_validated_token) as get_validated_token:
+      first = authentication.authenticate(request)
+      second = authentication.authenticate(request)
+    self.assertEqual(get_validated_token.call_count, 1)
+    self.assertIs(first, second)
+
+  def test_cookie_is_refreshed_when_access_token_is_expiring(self):
+    """
+    クッキーのアクセストークンの期限が近い時、リフレッシュトークンで更新されたjwtがクッキーにセットされる
+    """
+    refresh = RefreshToken.for_user(self.user)
+    access = refresh.access_token
+    access.set_exp(lifetime=datetime.timedelta(seconds=10))
+    self.client.cookies["Authorization"] = JWT_HEADER+" "+str(access)
+    self.client.cookies["refresh"] = str(refresh)
+
+    response = self.client.get(self.is_login_url)
+    self.assertTrue(response.data.get("loginFlg"))
+    self.assertNotEqual(response.cookies["Authorization"].value, JWT_HEADER+" "+str(access))
+    self.assertNotEqual(response.cookies["refresh"].value, str(refresh))
+
+  def test_cookie_is_not_refreshed_when_access_token_is_fresh(self):
+    """
+    クッキーのアクセストークンの期限がまだ先の時は、クッキーは更新されない
+    """
+    jwt = get_jwt(self.user)
+    self.client.cookies["Authorization"] = JWT_HEADER+" "+jwt["access"]
+    self.client.cookies["refresh"] = jwt["refresh"]
+
+    response = self.client.get(self.is_login_url)
+    self.assertTrue(response.data.get("loginFlg"))
+    self.assertNotIn("Authorization", response.cookies)
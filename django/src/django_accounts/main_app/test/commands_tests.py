@@ -0,0 +1,174 @@
+from django.test import TestCase
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from ..management.commands.import_users import Command as ImportCommand
+from ..models import User
+from .helpers import create_default_user
+from unittest import mock
+from io import StringIO
+import json
+import os
+import tempfile
+
+def write_temp_file(content, suffix):
+  """
+  一時ファイルに書き込んでパスを返す
+  """
+  f = tempfile.NamedTemporaryFile("w", suffix=suffix, delete=False, encoding="utf-8")
+  f.write(content)
+  f.close()
+  return f.name
+
+class ImportUsersCommandTests(TestCase):
+
+  def import_users(self, content, suffix=".jsonl", **options):
+    path = write_temp_file(content, suffix)
+    self.addCleanup(os.remove, path)
+    out = StringIO()
+    call_command("import_users", path, stdout=out, stderr=StringIO(), **options)
+    return out.getvalue()
+
+  def test_import_jsonl_with_conflicts_and_invalid_rows(self):
+    """
+    JSONLを取り込むと、重複する行と無効な行はスキップされ、残りがバッチ単位で登録される
+    """
+    create_default_user()
+    lines = [
+      {"username": "user1", "email": "user1@example.com", "password": "password"},
+      {"username": "Test User", "email": "other@example.com", "password": "password"},
+      {"username": "user2", "email": "user1@example.com", "password": "password"},
+      {"username": "a"*16, "email": "user3@example.com", "password": "password"},
+      {"username": "user4", "email": "user4@EXAMPLE.com", "password": "password", "is_active": False},
+    ]
+    out = self.import_users("\n".join(json.dumps(line) for line in lines), batch_size=2)
+    self.assertIn("created=2 skipped=2 invalid=1", out)
+    self.assertTrue(User.objects.get(username="user1").check_password("password"))
+    self.assertFalse(User.objects.get(email="user4@example.com").is_active)
+
+  def test_import_csv_with_password_hash(self):
+    """
+    password_hash列があれば、ハッシュ化済みのパスワードがそのまま登録される
+    """
+    password_hash = create_default_user().password
+    content = "username,email,password_hash\nuser1,user1@example.com,%s\n" % password_hash
+    out = self.import_users(content, suffix=".csv")
+    self.assertIn("created=1", out)
+    user = User.objects.get(username="user1")
+    self.assertEqual(user.password, password_hash)
+    self.assertTrue(user.check_password("password"))
+
+  def test_import_fails_on_conflict(self):
+    """
+    --on-conflict failの時、重複があればエラーになる
+    """
+    create_default_user()
+    content = json.dumps({"username": "Test User", "email": "x@example.com", "password": "password"})
+    with self.assertRaises(CommandError):
+      self.import_users(content, on_conflict="fail")
+
+  def test_import_conflicts_ignore_case_and_non_object_rows(self):
+    """
+    usernameとemailの重複は大文字小文字を区別せずに確認され、JSONのオブジェクトでない行は無効になる
+    """
+    create_default_user()
+    lines = [
+      json.dumps({"username": "TEST USER", "email": "user1@example.com", "password": "password"}),
+      json.dumps({"username": "user2", "email": "EXAMPLE@example.com", "password": "password"}),
+      json.dumps(["user3", "user3@example.com", "password"]),
+      json.dumps("user4"),
+      json.dumps({"username": "user5", "email": "user5@example.com", "password": "password"}),
+    ]
+    out = self.import_users("\n".join(lines))
+    self.assertIn("created=1 skipped=2 invalid=2", out)
+    self.assertEqual(User.objects.count(), 2)
+
+  def test_import_counts_only_inserted_rows(self):
+    """
+    重複の確認後に他から登録された行は、skipならスキップした件数に数え、failならエラーになる
+    """
+    content = json.dumps({"username": "Test User", "email": "example@example.com", "password": "password"})
+    create_default_user()
+    with mock.patch.object(ImportCommand, "lower_values", return_value=[]):
+      out = self.import_users(content)
+      self.assertIn("created=0 skipped=1 invalid=0", out)
+      with self.assertRaises(CommandError):
+        self.import_users(content, on_conflict="fail")
+
+class ExportUsersCommandTests(TestCase):
+
+  def test_export_and_import_round_trip(self):
+    """
+    --include-password-hashで書き出したファイルを、import_usersでそのまま取り込める
+    """
+    create_default_user()
+    create_default_user(username="user2", email="user2@example.com")
+    out = StringIO()
+    call_command("export_users", include_password_hash=True, chunk_size=1, stdout=out, stderr=StringIO())
+    rows = [json.loads(line) for line in out.getvalue().splitlines()]
+    self.assertEqual([row["username"] for row in rows], ["Test User", "user2"])
+    self.assertTrue(rows[0]["password_hash"].startswith("pbkdf2_sha256$"))
+
+    User.objects.all().delete()
+    path = write_temp_file(out.getvalue(), ".jsonl")
+    self.addCleanup(os.remove, path)
+    call_command("import_users", path, stdout=StringIO(), stderr=StringIO())
+    self.assertTrue(User.objects.get(username="user2").check_password("password"))
+
+class BenchmarkApiCommandTests(TestCase):
+
+  def test_benchmark_api_writes_json(self):
+    """
+    エンドポイントごとの結果がJSONで保存され、計測用のユーザーは削除される
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+      path = os.path.join(tmp, "bench.json")
+      call_command("benchmark_api", requests=3, concurrency=1, warmup=1, hash_rounds=1,
+                   output=path, label="test", stdout=StringIO())
+      with open(path) as f:
+        report = json.load(f)
+
+      self.assertEqual(report["label"], "test")
+      self.assertEqual([result["endpoint"] for result in report["results"]],
+                       ["signup", "token", "token_refresh", "is_login"])
+      for result in report["results"]:
+        self.assertEqual(result["requests"], 3)
+        self.assertEqual(result["errors"], 0)
+        self.assertIsNotNone(result["queries_per_request"])
+        self.assertLessEqual(result["latency_ms"]["p50"], result["latency_ms"]["p99"])
+      self.assertFalse(User.objects.exists())
+
+      # baselineより大きく遅くなったらエラーになる
+      for result in report["results"]:
+        result["latency_ms"]["p95"] = 0.0001
+      with open(path, "w") as f:
+        json.dump(report, f)
+      with self.assertRaises(CommandError):
+        call_command("benchmark_api", endpoints=["is_login"], requests=2, concurrency=1, warmup=0,
+                     hash_rounds=1, baseline=path, max_regression=10, stdout=StringIO())
+
+class ProfileStartupCommandTests(TestCase):
+
+  def test_parse_importtime(self):
+    """
+    -X importtimeの出力から、モジュールごとの時間と深さを読み取る
+    """
+    from ..management.commands.profile_startup import parse_importtime
+    lines = ["import time: self [us] | cumulative | imported package",
+             "import time:       120 |        120 |   json.decoder",
+             "import time:       300 |        420 | json",
+             "other output"]
+    self.assertEqual(parse_importtime(lines), [("json.decoder", 120, 120, 1), ("json", 300, 420, 0)])
+
+  def test_profile_startup_reports_json(self):
+    """
+    新しいプロセスでの起動と最初のリクエストの時間、importの遅いモジュールがJSONで出力される
+    """
+    out = StringIO()
+    call_command("profile_startup", "--json", "--top", "3", stdout=out)
+    report = json.loads(out.getvalue())
+
+    self.assertEqual(report["first_request_status"], 200)
+    self.assertGreater(report["setup_ms"], 0)
+    self.assertGreater(report["modules_imported"], 0)
+    self.assertEqual(len(report["modules"]), 3)
+    self.assertIn("django", [package["package"] for package in report["packages"]])
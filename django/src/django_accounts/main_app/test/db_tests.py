@@ -0,0 +1,33 @@
+from django.test import TestCase
+from ..db.metrics import PoolStats
+
+class PoolStatsTests(TestCase):
+
+  def setUp(self):
+    self.stats = PoolStats()
+
+  def test_record_connect_and_close(self):
+    """
+    接続と切断を記録すると、開いている接続数と接続にかかった時間が集計される
+    """
+    self.stats.record_connect(0.2)
+    self.stats.record_connect(0.4)
+    self.stats.record_close()
+    snapshot = self.stats.snapshot()
+    self.assertEqual(snapshot["open_connections"], 1)
+    self.assertEqual(snapshot["max_open_connections"], 2)
+    self.assertAlmostEqual(snapshot["connect_wait_avg"], 0.3)
+    self.assertAlmostEqual(snapshot["connect_wait_max"], 0.4)
+
+  def test_record_checkout(self):
+    """
+    貸し出しを記録すると、再利用された割合が集計される
+    """
+    self.stats.record_checkout(reused=False)
+    self.stats.record_checkout(reused=True)
+    self.stats.record_checkout(reused=True)
+    self.stats.record_checkout(reused=True)
+    snapshot = self.stats.snapshot()
+    self.assertEqual(snapshot["checkouts"], 4)
+    self.assertEqual(snapshot["new_connections"], 1)
+    self.assertEqual(snapshot["reuse_ratio"], 0.75)
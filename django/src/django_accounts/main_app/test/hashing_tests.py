@@ -0,0 +1,119 @@
+from django.test import TestCase, override_settings
+from django.core.management import call_command
+from django.urls import reverse
+from django.contrib.auth.hashers import PBKDF2PasswordHasher
+from rest_framework import status
+from unittest import mock
+from ..models import User
+from ..hashing import HashingExecutor, HashingBusy, executor
+from ..hashers import TunedPBKDF2PasswordHasher
+from io import StringIO
+import json
+import threading
+
+class HashingExecutorTests(TestCase):
+
+  def test_run_returns_result(self):
+    """
+    run()でワーカーの実行結果が返ってくる
+    """
+    pool = HashingExecutor(kind="thread", workers=1, queue_size=0)
+    self.assertEqual(pool.run(sum, [1, 2, 3]), 6)
+
+  async def test_arun_inline_does_not_block_event_loop(self):
+    """
+    inlineやワーカー数が0の時も、arun()はイベントループのスレッドでハッシュ化しない
+    """
+    loop_thread = threading.get_ident()
+    for pool in (HashingExecutor(kind="inline", workers=1, queue_size=0),
+                 HashingExecutor(kind="thread", workers=0, queue_size=0)):
+      self.assertNotEqual(await pool.arun(threading.get_ident), loop_thread)
+
+  def test_submit_raises_when_queue_is_full(self):
+    """
+    ワーカーと待ち行列が埋まっている時、HashingBusyが送出される
+    """
+    pool = HashingExecutor(kind="thread", workers=1, queue_size=1, retry_after=3)
+    release = threading.Event()
+    futures = [pool.submit(release.wait), pool.submit(release.wait)]
+    with self.assertRaises(HashingBusy) as context:
+      pool.submit(release.wait)
+    self.assertEqual(context.exception.wait, 3)
+
+    # 空きができたら再び受け付ける
+    release.set()
+    for future in futures:
+      future.result()
+    self.assertTrue(pool.submit(release.wait).result())
+
+  def test_check_password_rehashes_outdated_hash(self):
+    """
+    古い設定のハッシュでログインに成功した時、新しい設定でハッシュ化し直される
+    """
+    user = User.objects.create_user(username="Test User",
+                                    email="example@example.com",
+                                    password="password")
+    # 古い設定(少ない反復回数)のハッシュで保存されている状態にする
+    old_password = PBKDF2PasswordHasher().encode("password", "salt", iterations=1000)
+    user.password = old_password
+    user.save()
+    self.assertTrue(user.check_password("password"))
+    user.refresh_from_db()
+    self.assertNotEqual(user.password, old_password)
+    self.assertTrue(user.check_password("password"))
+
+class HashingBackpressureViewTests(TestCase):
+
+  def test_signup_returns_503_when_hashing_is_busy(self):
+    """
+    ハッシュ化の待ち行列が埋まっている時、signupは503とRetry-Afterを返す
+    """
+    post_data = { "username": "Test User",
+                  "email": "example@example.com",
+                  "password": "password" }
+    with mock.patch.object(executor, "submit", side_effect=HashingBusy(wait=1)):
+      response = self.client.post(reverse("main_app:signup"),
+                                  post_data,
+                                  content_type="application/json")
+    self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+    self.assertEqual(response["Retry-After"], "1")
+    self.assertFalse(User.objects.filter(email="example@example.com").exists())
+
+class HasherProfileTests(TestCase):
+
+  @override_settings(PASSWORD_HASHER_PARAMS={"pbkdf2": {"iterations": "1000"}})
+  def test_hasher_uses_profile_params(self):
+    """
+    PASSWORD_HASHER_PARAMSのパラメーターでハッシュ化される
+    """
+    hasher = TunedPBKDF2PasswordHasher()
+    self.assertEqual(hasher.iterations, 1000)
+    self.assertTrue(hasher.encode("password", hasher.salt()).startswith("pbkdf2_sha256$1000$"))
+
+  def test_benchmark_hashers_command(self):
+    """
+    benchmark_hashersコマンドで、計測結果と提案するパラメーターが出力される
+    """
+    out = StringIO()
+    call_command("benchmark_hashers", profiles=["scrypt"], rounds=1, json=True, stdout=out)
+    results = json.loads(out.getvalue())
+    self.assertEqual(results[0]["profile"], "scrypt")
+    self.assertGreater(results[0]["hashes_per_sec"], 0)
+    self.assertIn("work_factor", results[0]["suggested_params"])
+
+  def test_token_obtain_upgrades_hash_to_new_profile(self):
+    """
+    プロファイルを変更した後にトークンエンドポイントでログインすると、新しいハッシュで保存し直される
+    """
+    user = User.objects.create_user(username="Test User",
+                                    email="example@example.com",
+                                    password="password")
+    self.assertTrue(user.password.startswith("pbkdf2_sha256$"))
+    with override_settings(PASSWORD_HASHERS=["main_app.hashers.TunedScryptPasswordHasher",
+                                             "main_app.hashers.TunedPBKDF2PasswordHasher"]):
+      response = self.client.post(reverse("main_app:token_obtain_pair"),
+                                  {"email": "example@example.com", "password": "password"},
+                                  content_type="application/json")
+    self.assertEqual(response.status_code, status.HTTP_200_OK)
+    user.refresh_from_db()
+    self.assertTrue(user.password.startswith("scrypt$"))
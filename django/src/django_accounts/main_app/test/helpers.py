@@ -0,0 +1,27 @@
+"""
+テストで共通して使う関数達
+"""
+from django.test import override_settings
+from ..models import User
+
+def create_default_user(username="Test User",
+                        email="example@example.com",
+                        password="password"):
+  """
+  ユーザーを作成する
+  """
+  user= User.objects.create_user(username=username,
+                                 email=email,
+                                 password=password)
+  return user
+
+def throttle_rates(**rates):
+  """
+  レート制限の回数(DEFAULT_THROTTLE_RATES)をratesだけにする
+  """
+  return override_settings(REST_FRAMEWORK={
+    "DEFAULT_AUTHENTICATION_CLASSES": ["main_app.authentication.CookieJWTAuthentication"],
+    "NON_FIELD_ERRORS_KEY": "detail",
+    "TEST_REQUEST_DEFAULT_FORMAT": "json",
+    "DEFAULT_THROTTLE_RATES": rates,
+  })
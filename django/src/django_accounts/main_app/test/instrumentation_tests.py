@@ -0,0 +1,92 @@
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.settings import api_settings as drf_settings
+from unittest import mock
+from ..models import User
+from ..instrumentation import RequestTimings, MetricsRegistry, metrics, render_prometheus, timed
+import os
+
+JWT_HEADER = os.environ.get("JWT_AUTH_HEADER_TYPES")
+
+class InstrumentationTests(TestCase):
+
+  def setUp(self):
+    metrics.clear()
+
+  def test_timed_outside_request_does_nothing(self):
+    with timed("hash"):
+      pass
+
+  def test_server_timing(self):
+    timings = RequestTimings()
+    timings.add("total", 0.012)
+    timings.add("db", 0.001)
+    timings.db_queries = 2
+    self.assertEqual(timings.server_timing(), 'total;dur=12.00, db;dur=1.00;desc="2 queries"')
+
+  def test_registry_combines_processes(self):
+    """
+    別々のプロセス(レジストリ)の値がキャッシュで合算される
+    """
+    worker1 = MetricsRegistry("default", 3600)
+    worker2 = MetricsRegistry("default", 3600)
+    for worker in (worker1, worker2):
+      timings = RequestTimings()
+      timings.add("total", 0.003)
+      timings.db_queries = 1
+      worker.observe_request("signup", timings)
+      worker.flush()
+    values = worker1.collect()
+    self.assertEqual(values["c|db_queries|signup"], 2)
+    self.assertEqual(values["h|total|signup|2"], 2)
+    text = render_prometheus(values)
+    self.assertIn('accounts_request_duration_seconds_bucket{endpoint="signup",le="0.005"} 2', text)
+    self.assertIn('accounts_request_duration_seconds_count{endpoint="signup"} 2', text)
+    self.assertIn('accounts_db_queries_total{endpoint="signup"} 2', text)
+
+  @override_settings(SERVER_TIMING=True)
+  def test_signup_reports_server_timing_and_metrics(self):
+    """
+    signupのレスポンスにServer-Timingヘッダーが付き、/metricsにエンドポイントごとの値が出る
+    """
+    response = self.client.post(reverse("main_app:signup"),
+                                {"username": "Test User", "email": "example@example.com", "password": "password"},
+                                content_type="application/json")
+    self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+    server_timing = response["Server-Timing"]
+    for name in ("total", "db", "hash", "jwt", "serialize"):
+      self.assertIn(name + ";dur=", server_timing)
+
+    response = self.client.get("/metrics")
+    self.assertEqual(response.status_code, status.HTTP_200_OK)
+    text = response.content.decode()
+    self.assertIn('accounts_password_hash_duration_seconds_count{endpoint="signup"} 1', text)
+    self.assertIn('accounts_jwt_duration_seconds_count{endpoint="signup"} 1', text)
+    self.assertIn("accounts_db_connection_checkouts_total", text)
+
+  @override_settings(METRICS_ALLOWED_IPS=["10.0.0.1"])
+  def test_metrics_is_forbidden_from_other_hosts(self):
+    self.assertEqual(self.client.get("/metrics").status_code, status.HTTP_403_FORBIDDEN)
+
+  def test_metrics_behind_proxy_checks_client_address(self):
+    """
+    プロキシの後ろでは、プロキシのアドレスではなくX-Forwarded-Forのクライアントのアドレスで確認する
+    """
+    with mock.patch.object(drf_settings, "NUM_PROXIES", 1):
+      response = self.client.get("/metrics", REMOTE_ADDR="127.0.0.1", HTTP_X_FORWARDED_FOR="203.0.113.1")
+      self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+      # クライアントが付けたX-Forwarded-Forは、プロキシが追加したアドレスより前にあるので使われない
+      response = self.client.get("/metrics", REMOTE_ADDR="127.0.0.1",
+                                 HTTP_X_FORWARDED_FOR="127.0.0.1, 203.0.113.1")
+      self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+      response = self.client.get("/metrics", REMOTE_ADDR="10.0.0.9", HTTP_X_FORWARDED_FOR="127.0.0.1")
+      self.assertEqual(response.status_code, status.HTTP_200_OK)
+    # プロキシの数の指定がなければX-Forwarded-Forは使わない
+    response = self.client.get("/metrics", REMOTE_ADDR="10.0.0.9", HTTP_X_FORWARDED_FOR="127.0.0.1")
+    self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+  @override_settings(SERVER_TIMING=False)
+  def test_server_timing_can_be_disabled(self):
+    response = self.client.get(reverse("main_app:is_login"))
+    self.assertFalse(response.has_header("Server-Timing"))
@@ -0,0 +1,97 @@
+from asgiref.sync import sync_to_async
+from django.core.exceptions import SynchronousOnlyOperation
+from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import status
+from rest_framework_simplejwt.exceptions import TokenBackendError
+from ..keys import keyring, rotate_signing_key, prune_signing_keys
+from ..models import SigningKey
+from ..tokens import KeyRingTokenBackend
+import datetime
+import jwt
+
+class SigningKeyTests(TestCase):
+
+  def setUp(self):
+    keyring.reload()
+    self.backend = KeyRingTokenBackend("RS256")
+    self.payload = {"user_id": "1", "token_type": "access"}
+
+  def test_encode_with_kid_and_decode(self):
+    """
+    最新の鍵で署名され、ヘッダーのkidの公開鍵で検証される
+    """
+    key = rotate_signing_key("RS256")
+    token = self.backend.encode(self.payload)
+    self.assertEqual(jwt.get_unverified_header(token)["kid"], key.kid)
+    self.assertEqual(self.backend.decode(token)["user_id"], "1")
+
+  def test_token_signed_by_retired_key_is_still_valid(self):
+    """
+    鍵をローテーションしても、退役した鍵で署名されたトークンは検証できる
+    """
+    rotate_signing_key("RS256")
+    old_token = self.backend.encode(self.payload)
+    new_key = rotate_signing_key("RS256")
+    self.assertEqual(jwt.get_unverified_header(self.backend.encode(self.payload))["kid"], new_key.kid)
+    self.assertEqual(self.backend.decode(old_token)["user_id"], "1")
+
+  def test_token_signed_by_pruned_key_is_invalid(self):
+    """
+    公開期間を過ぎて削除された鍵で署名されたトークンは検証に失敗する
+    """
+    rotate_signing_key("RS256")
+    old_token = self.backend.encode(self.payload)
+    rotate_signing_key("RS256")
+    SigningKey.objects.filter(retired_at__isnull=False).update(retired_at=timezone.now() - datetime.timedelta(days=30))
+    self.assertEqual(prune_signing_keys(), 1)
+    with self.assertRaises(TokenBackendError):
+      self.backend.decode(old_token)
+
+  def test_eddsa_key(self):
+    """
+    EdDSAの鍵でも署名と検証ができる
+    """
+    rotate_signing_key("EdDSA")
+    backend = KeyRingTokenBackend("EdDSA")
+    self.assertEqual(backend.decode(backend.encode(self.payload))["user_id"], "1")
+
+  def test_jwks_view(self):
+    """
+    JWKSエンドポイントが公開鍵の一覧を返し、キャッシュさせるヘッダーが付いている
+    """
+    keys = [rotate_signing_key("RS256"), rotate_signing_key("RS256")]
+    response = self.client.get(reverse("main_app:jwks"))
+    self.assertEqual(response.status_code, status.HTTP_200_OK)
+    self.assertEqual({jwk["kid"] for jwk in response.data["keys"]}, {key.kid for key in keys})
+    self.assertNotIn("d", response.data["keys"][0])
+    self.assertIn("max-age", response["Cache-Control"])
+
+    # 他のサービスはJWKSの公開鍵だけでトークンを検証できる
+    token = self.backend.encode(self.payload)
+    jwk = next(jwk for jwk in response.data["keys"] if jwk["kid"] == keys[1].kid)
+    public_key = jwt.PyJWK(jwk).key
+    self.assertEqual(jwt.decode(token, public_key, algorithms=["RS256"])["user_id"], "1")
+
+  async def test_async_code_does_not_query_lazily(self):
+    """
+    イベントループ上ではDBを参照せず、aensure_loadedで読み込んだ鍵で署名・検証する
+    """
+    key = await sync_to_async(rotate_signing_key)("RS256")
+    with self.assertRaises(SynchronousOnlyOperation):
+      self.backend.encode(self.payload)
+
+    await keyring.aensure_loaded()
+    token = self.backend.encode(self.payload)
+    self.assertEqual(jwt.get_unverified_header(token)["kid"], key.kid)
+    self.assertEqual(self.backend.decode(token)["user_id"], "1")
+
+    # 他のプロセスで作られた鍵のトークンは、kidを見て読み込み直す
+    new_key = await sync_to_async(rotate_signing_key)("RS256")
+    await keyring.aensure_loaded()
+    keyring._loaded_at -= keyring.min_reload_interval + 1
+    token = await sync_to_async(self.backend.encode)(self.payload)
+    keyring.public_keys.pop(new_key.kid)
+    await keyring.aensure_loaded(token)
+    self.assertEqual(self.backend.decode(token)["user_id"], "1")
@@ -0,0 +1,49 @@
+from django.http import HttpResponse
+from django.test import TestCase, RequestFactory
+from ..middleware import SessionMiddleware, CsrfViewMiddleware, AuthenticationMiddleware
+
+def get_response(request):
+  return HttpResponse()
+
+def view(request):
+  return HttpResponse()
+
+class StatelessMiddlewareTests(TestCase):
+
+  def setUp(self):
+    self.factory = RequestFactory()
+
+  def run_middlewares(self, request):
+    SessionMiddleware(lambda request: AuthenticationMiddleware(get_response)(request))(request)
+    return request
+
+  def test_api_request_skips_session_and_user(self):
+    """
+    /api/へのリクエストでは、セッションとログインユーザーを準備しない
+    """
+    request = self.run_middlewares(self.factory.get("/api/is_login/"))
+    self.assertFalse(hasattr(request, "session"))
+    self.assertFalse(hasattr(request, "user"))
+
+  def test_admin_request_uses_full_chain(self):
+    """
+    admin/へのリクエストでは、これまで通りセッションとログインユーザーを準備する
+    """
+    request = self.run_middlewares(self.factory.get("/admin/"))
+    self.assertTrue(hasattr(request, "session"))
+    self.assertTrue(hasattr(request, "user"))
+
+  def test_csrf_is_checked_only_outside_api(self):
+    middleware = CsrfViewMiddleware(get_response)
+    request = self.factory.post("/api/token/")
+    self.assertIsNone(middleware.process_view(request, view, (), {}))
+    request = self.factory.post("/admin/login/")
+    self.assertEqual(middleware.process_view(request, view, (), {}).status_code, 403)
+
+  def test_admin_login_page(self):
+    """
+    admin/のログイン画面は、CSRFのクッキーを含めて表示される
+    """
+    response = self.client.get("/admin/login/")
+    self.assertEqual(response.status_code, 200)
+    self.assertIn("csrftoken", response.cookies)
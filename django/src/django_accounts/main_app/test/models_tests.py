@@ -1,6 +1,11 @@
 from django.test import TestCase
 from django.core.exceptions import ValidationError
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from ..models import User
+from .helpers import create_default_user
+from ..user_cache import user_cache
 
 def default_user_model(username="Test User",
                        email="example@example.com",
@@ -105,4 +110,89 @@ class UserModelTests(TestCase):
     test_user.save()
     self.assertTrue(test_user.created_at)
     self.assertTrue(test_user.updated_at)
-  
\ No newline at end of file
+
+class UserPartialUpdateTests(TestCase):
+
+  @classmethod
+  def setUpTestData(cls):
+    User.objects.create_user(username="test_user",
+                             email="example@example.com",
+                             password="password")
+
+  def setUp(self):
+    # update_userは読み込んだ時の値と比べるので、テストごとにDBから読み込む
+    self.user = User.objects.get(email="example@example.com")
+
+  def test_update_user_writes_only_changed_columns(self):
+    """
+    update_userは変更されたカラムとupdated_atだけをUPDATEする
+    """
+    with CaptureQueriesContext(connection) as queries:
+      self.user.update_user({"username": "renamed"})
+    self.assertEqual(len(queries), 1)
+    sql = queries[0]["sql"]
+    self.assertIn("username", sql)
+    self.assertIn("updated_at", sql)
+    self.assertNotIn("password", sql)
+    self.assertNotIn("email", sql)
+    self.assertEqual(User.objects.get(pk=self.user.pk).username, "renamed")
+
+  def test_update_user_without_changes_does_not_query(self):
+    """
+    値が変わっていなければupdate_userはDBに書き込まない
+    """
+    with CaptureQueriesContext(connection) as queries:
+      self.user.update_user({"username": "test_user"})
+    self.assertEqual(len(queries), 0)
+
+  def test_update_user_with_password(self):
+    """
+    パスワードを指定した時だけハッシュ化してpasswordカラムを書き込む
+    """
+    with CaptureQueriesContext(connection) as queries:
+      self.user.update_user({"password": "new_password"})
+    self.assertIn("password", queries[0]["sql"])
+    self.assertTrue(User.objects.get(pk=self.user.pk).check_password("new_password"))
+
+  def test_update_users_invalidates_cache(self):
+    """
+    update_usersは1回のUPDATEで更新し、対象ユーザーのキャッシュを破棄する
+    """
+    user_cache.set(self.user.pk, self.user)
+    cache.set("user_active:%s" % self.user.pk, True)
+    updated = User.objects.filter(pk=self.user.pk).update_users(is_active=False)
+    self.assertEqual(updated, 1)
+    self.assertIsNone(user_cache.get(self.user.pk))
+    self.assertIsNone(cache.get("user_active:%s" % self.user.pk))
+    self.assertFalse(User.objects.get(pk=self.user.pk).is_active)
+
+  def test_update_users_in_batches(self):
+    """
+    update_usersは主キーの順にbatch_size件ずつ更新し、条件が更新で変わっても全員を1回ずつ更新する
+    """
+    users = [create_default_user(username="user%d" % i, email="user%d@example.com" % i) for i in range(4)]
+    for user in users:
+      user_cache.set(user.pk, user)
+    with CaptureQueriesContext(connection) as queries:
+      updated = User.objects.filter(is_active=True).update_users(batch_size=2, is_active=False)
+    self.assertEqual(updated, 5)
+    # 5件を2件ずつ選んで更新するので、UPDATEは3回
+    self.assertEqual(len([query for query in queries if query["sql"].startswith("UPDATE")]), 3)
+    self.assertFalse(User.objects.filter(is_active=True).exists())
+    self.assertTrue(all(user_cache.get(user.pk) is None for user in users))
+
+  def test_update_users_rejects_password(self):
+    """
+    update_usersではパスワードを更新できない
+    """
+    with self.assertRaises(ValueError):
+      User.objects.all().update_users(password="new_password")
+
+  def test_bulk_update_users(self):
+    """
+    bulk_update_usersはユーザーごとの値をまとめて更新する
+    """
+    self.user.username = "bulk"
+    User.objects.bulk_update_users([self.user], ["username"])
+    self.assertEqual(User.objects.get(pk=self.user.pk).username, "bulk")
+    self.assertEqual(self.user.get_dirty_fields(), [])
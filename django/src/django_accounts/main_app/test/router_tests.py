@@ -0,0 +1,128 @@
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.http import HttpResponse
+from django.test import TestCase, RequestFactory, override_settings
+from django.urls import reverse
+from unittest import mock
+from ..db.router import (PrimaryReplicaRouter, StickyWrites, sticky_writes, routing_scope, is_pinned,
+                         user_key, login_key)
+from ..middleware import DatabaseRoutingMiddleware
+from ..models import User, RevokedRefreshToken
+
+@override_settings(DATABASE_REPLICAS=["replica0", "replica1"])
+class ReplicaRouterTests(TestCase):
+
+  def setUp(self):
+    cache.clear()
+    self.router = PrimaryReplicaRouter()
+
+  def outside_transaction(self):
+    """
+    TestCaseはテスト全体をトランザクションで囲むので、その外で読み取った時の振り分けを確認する
+    """
+    return mock.patch.object(connections[DEFAULT_DB_ALIAS], "in_atomic_block", False)
+
+  def test_user_reads_go_to_replicas(self):
+    """
+    Userの読み取りはレプリカに、書き込みと他のモデルの読み取りはプライマリに送られる
+    """
+    with routing_scope(), self.outside_transaction():
+      self.assertIn(self.router.db_for_read(User), ["replica0", "replica1"])
+      self.assertEqual(self.router.db_for_read(RevokedRefreshToken), DEFAULT_DB_ALIAS)
+    self.assertEqual(self.router.db_for_write(User), DEFAULT_DB_ALIAS)
+    self.assertEqual(self.router.db_for_write(RevokedRefreshToken), DEFAULT_DB_ALIAS)
+    self.assertFalse(self.router.allow_migrate("replica0", "main_app"))
+    self.assertIsNone(self.router.allow_migrate(DEFAULT_DB_ALIAS, "main_app"))
+
+  def test_reads_in_transaction_or_pinned_go_to_primary(self):
+    """
+    トランザクションの中と、プライマリに固定したリクエストではプライマリで読む
+    """
+    with routing_scope():
+      self.assertEqual(self.router.db_for_read(User), DEFAULT_DB_ALIAS)
+    with routing_scope(pinned=True), self.outside_transaction():
+      self.assertEqual(self.router.db_for_read(User), DEFAULT_DB_ALIAS)
+
+  @override_settings(DATABASE_REPLICAS=[])
+  def test_without_replicas_everything_goes_to_primary(self):
+    with routing_scope(), self.outside_transaction():
+      self.assertEqual(self.router.db_for_read(User), DEFAULT_DB_ALIAS)
+      sticky_writes.stick(user_key(1))
+      self.assertFalse(is_pinned())
+
+  def test_write_pins_the_user_to_primary(self):
+    """
+    ユーザーを書き込むと、そのリクエストの残りと、しばらくの間のそのユーザーの読み取りがプライマリに固定される
+    """
+    with routing_scope():
+      user = User.objects.create_user(username="Test User", email="Example@example.com", password="password")
+      self.assertTrue(is_pinned())
+
+    # 別のリクエスト(別のワーカーを含む)
+    with routing_scope():
+      sticky_writes.check(user_key(user.pk + 1))
+      self.assertFalse(is_pinned())
+      sticky_writes.check(user_key(user.pk))
+      self.assertTrue(is_pinned())
+    with routing_scope():
+      sticky_writes.check(login_key(" example@EXAMPLE.com"))
+      self.assertTrue(is_pinned())
+
+    # 期限が切れたらレプリカに戻る
+    cache.delete_many([sticky_writes.key_prefix + user_key(user.pk),
+                       sticky_writes.key_prefix + login_key(user.email)])
+    with routing_scope():
+      sticky_writes.check(user_key(user.pk), login_key(user.email))
+      self.assertFalse(is_pinned())
+
+  def test_update_users_pins_updated_users(self):
+    user = User.objects.create_user(username="Test User", email="example@example.com", password="password")
+    cache.clear()
+    with routing_scope():
+      User.objects.filter(pk=user.pk).update_users(email="new@example.com")
+    with routing_scope():
+      sticky_writes.check(login_key("new@example.com"))
+      self.assertTrue(is_pinned())
+
+  def test_disabled_when_window_is_zero(self):
+    sticky = StickyWrites("default", seconds=0)
+    with routing_scope():
+      sticky.stick(user_key(1))
+      sticky.check(user_key(1))
+      self.assertFalse(is_pinned())
+
+  def test_authentication_and_login_check_stickiness(self):
+    """
+    jwtでの認証とログインでは、DBを参照する前に最近書き込まれたユーザーかを確認する
+    """
+    user = User.objects.create_user(username="Test User", email="example@example.com", password="password")
+    with mock.patch.object(sticky_writes, "check", wraps=sticky_writes.check) as check:
+      response = self.client.post(reverse("main_app:token_obtain_pair"),
+                                  {"email": "example@example.com", "password": "password"},
+                                  content_type="application/json")
+      self.assertEqual(response.status_code, 200)
+      check.assert_any_call(login_key("example@example.com"))
+
+      response = self.client.post(reverse("main_app:token_refresh"), {"refresh": response.data["refresh"]},
+                                  content_type="application/json")
+      self.assertEqual(response.status_code, 200)
+      check.assert_any_call(user_key(user.pk))
+
+  def test_middleware_resets_and_pins_admin(self):
+    """
+    リクエストごとに固定が初期化され、admin/へのリクエストは最初からプライマリで読む
+    """
+    factory = RequestFactory()
+    seen = []
+
+    def get_response(request):
+      seen.append(is_pinned())
+      sticky_writes.stick(user_key(1))
+      return HttpResponse()
+
+    middleware = DatabaseRoutingMiddleware(get_response)
+    middleware(factory.get("/api/is_login/"))
+    middleware(factory.get("/admin/"))
+    middleware(factory.get("/api/is_login/"))
+    self.assertEqual(seen, [False, True, False])
+    self.assertFalse(is_pinned())
@@ -0,0 +1,144 @@
+from django.core.cache import cache
+from django.test import TestCase, AsyncRequestFactory
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.settings import api_settings
+from unittest import mock
+from ..models import User
+from ..throttling import SlidingWindowLimiter, parse_rate, throttle_stats
+from ..async_views import AsyncTokenObtainPairView
+from .helpers import throttle_rates
+import json
+
+class ThrottlingTests(TestCase):
+
+  @classmethod
+  def setUpTestData(cls):
+    User.objects.create_user(username="Test User",
+                             email="example@example.com",
+                             password="password")
+
+  def setUp(self):
+    cache.clear()
+    throttle_stats.reset()
+    self.token_url = reverse("main_app:token_obtain_pair")
+    self.signup_url = reverse("main_app:signup")
+
+  def login(self, email="example@example.com", **extra):
+    return self.client.post(self.token_url, {"email": email, "password": "wrong"},
+                            content_type="application/json", **extra)
+
+  def test_parse_rate(self):
+    self.assertEqual(parse_rate("10/min"), (10, 60))
+    self.assertEqual(parse_rate("5/s"), (5, 1))
+    self.assertIsNone(parse_rate(""))
+
+  def test_sliding_window_limiter(self):
+    """
+    1つ前のウィンドウの回数も経過時間に応じて数える
+    """
+    limiter = SlidingWindowLimiter("default")
+    with mock.patch("main_app.throttling.time.time", return_value=120.0):
+      self.assertIsNone(limiter.hit("test", "a", (2, 60)))
+      self.assertIsNone(limiter.hit("test", "a", (2, 60)))
+      self.assertEqual(limiter.hit("test", "a", (2, 60)), 60)
+    # 次のウィンドウの半分の時点では、前のウィンドウの3回が1.5回として数えられる
+    with mock.patch("main_app.throttling.time.time", return_value=210.0):
+      self.assertIsNotNone(limiter.hit("test", "a", (2, 60)))
+    with mock.patch("main_app.throttling.time.time", return_value=300.0):
+      self.assertIsNone(limiter.hit("test", "a", (2, 60)))
+
+  @throttle_rates(login_account="2/min")
+  def test_login_throttled_per_account_before_hashing(self):
+    """
+    アカウントごとの回数を超えたら、パスワードを確認せずに429エラーになる
+    """
+    self.assertEqual(self.login().status_code, status.HTTP_401_UNAUTHORIZED)
+    self.assertEqual(self.login(email="EXAMPLE@example.com").status_code, status.HTTP_401_UNAUTHORIZED)
+    with mock.patch("main_app.hashing.check_password") as check_password:
+      response = self.login()
+    self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+    self.assertTrue(response["Retry-After"])
+    check_password.assert_not_called()
+    # 別のアカウントは制限されない
+    self.assertEqual(self.login(email="other@example.com").status_code, status.HTTP_401_UNAUTHORIZED)
+    self.assertEqual(throttle_stats.snapshot()["login_account"], {"allowed": 3, "throttled": 1})
+
+  @throttle_rates(login_ip="1/min")
+  def test_login_throttled_per_ip(self):
+    self.assertEqual(self.login(REMOTE_ADDR="10.0.0.1").status_code, status.HTTP_401_UNAUTHORIZED)
+    self.assertEqual(self.login(REMOTE_ADDR="10.0.0.1").status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+    self.assertEqual(self.login(REMOTE_ADDR="10.0.0.2").status_code, status.HTTP_401_UNAUTHORIZED)
+
+  @throttle_rates(login_ip="2/min")
+  def test_login_throttled_per_ip_with_forged_forwarded_for(self):
+    """
+    プロキシの数の指定がなければX-Forwarded-Forは使わないので、毎回変えても同じIPとして数えられる
+    """
+    codes = [self.login(REMOTE_ADDR="10.0.0.6", HTTP_X_FORWARDED_FOR="192.0.2.%d" % i).status_code
+             for i in range(4)]
+    self.assertEqual(codes, [status.HTTP_401_UNAUTHORIZED] * 2 + [status.HTTP_429_TOO_MANY_REQUESTS] * 2)
+
+  @throttle_rates(login_ip="1/min")
+  def test_login_throttled_per_client_behind_proxy(self):
+    """
+    NUM_PROXIESを指定すると、プロキシが追加したX-Forwarded-Forのアドレスごとに数える
+    """
+    with mock.patch.object(api_settings, "NUM_PROXIES", 1):
+      self.assertEqual(self.login(REMOTE_ADDR="10.0.0.7", HTTP_X_FORWARDED_FOR="192.0.2.1").status_code,
+                       status.HTTP_401_UNAUTHORIZED)
+      self.assertEqual(self.login(REMOTE_ADDR="10.0.0.7", HTTP_X_FORWARDED_FOR="192.0.2.2").status_code,
+                       status.HTTP_401_UNAUTHORIZED)
+      # クライアントが付けた値はプロキシが追加した値より前にあるので使われない
+      response = self.login(REMOTE_ADDR="10.0.0.7", HTTP_X_FORWARDED_FOR="192.0.2.3, 192.0.2.1")
+      self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+
+  @throttle_rates(signup_global="1/min")
+  def test_signup_throttled_globally(self):
+    post_data = {"username": "New User", "email": "new@example.com", "password": "password"}
+    self.assertEqual(self.client.post(self.signup_url, post_data, content_type="application/json").status_code,
+                     status.HTTP_201_CREATED)
+    post_data = {"username": "New User2", "email": "new2@example.com", "password": "password"}
+    response = self.client.post(self.signup_url, post_data, content_type="application/json",
+                                REMOTE_ADDR="10.0.0.3")
+    self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+    self.assertFalse(User.objects.filter(email="new2@example.com").exists())
+
+  @throttle_rates(availability_ip="2/min")
+  def test_availability_throttled_per_ip(self):
+    """
+    登録可否の確認もIPごとの回数を超えたら429エラーになり、登録済みのユーザーを総当たりで調べられない
+    """
+    url = reverse("main_app:user_availability")
+    for _ in range(2):
+      response = self.client.get(url, {"email": "example@example.com"}, REMOTE_ADDR="10.0.0.4")
+      self.assertEqual(response.status_code, status.HTTP_200_OK)
+    response = self.client.get(url, {"email": "other@example.com"}, REMOTE_ADDR="10.0.0.4")
+    self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+    self.assertTrue(response["Retry-After"])
+    self.assertEqual(self.client.get(url, {"email": "other@example.com"}, REMOTE_ADDR="10.0.0.5").status_code,
+                     status.HTTP_200_OK)
+
+  @throttle_rates(availability_ip="2/min")
+  def test_availability_throttled_with_forged_forwarded_for(self):
+    """
+    X-Forwarded-Forを毎回変えても、登録可否の確認の回数の制限は回避できない
+    """
+    url = reverse("main_app:user_availability")
+    codes = [self.client.get(url, {"email": "user%d@example.com" % i}, REMOTE_ADDR="10.0.0.8",
+                             HTTP_X_FORWARDED_FOR="192.0.2.%d" % i).status_code for i in range(4)]
+    self.assertEqual(codes, [status.HTTP_200_OK] * 2 + [status.HTTP_429_TOO_MANY_REQUESTS] * 2)
+
+  @throttle_rates(login_account="1/min")
+  async def test_async_login_throttled(self):
+    """
+    非同期版のトークン発行用ビューにもレート制限がかかる
+    """
+    async def login():
+      request = AsyncRequestFactory().post("/", json.dumps({"email": "example@example.com", "password": "wrong"}),
+                                           content_type="application/json")
+      return await AsyncTokenObtainPairView.as_view()(request)
+    self.assertEqual((await login()).status_code, status.HTTP_401_UNAUTHORIZED)
+    response = await login()
+    self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+    self.assertTrue(response["Retry-After"])
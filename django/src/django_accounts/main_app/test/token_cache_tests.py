@@ -0,0 +1,63 @@
+from django.test import TestCase
+from rest_framework_simplejwt.backends import jwt as backend_jwt
+from .helpers import create_default_user
+from ..token_cache import decoded_token_cache, DecodedTokenCache
+from ..tokens import AccessToken, RefreshToken
+from .. import token_store
+from unittest import mock
+import time
+
+class DecodedTokenCacheTests(TestCase):
+
+  @classmethod
+  def setUpTestData(cls):
+    cls.user = create_default_user()
+
+  def setUp(self):
+    decoded_token_cache.clear()
+    self.refresh = RefreshToken.for_user(self.user)
+    self.access = str(self.refresh.access_token)
+
+  def test_signature_is_verified_once_per_token(self):
+    """
+    同じトークンを何度検証しても、署名の検証とデコードは1回だけ行われる
+    """
+    with mock.patch.object(backend_jwt, "decode", wraps=backend_jwt.decode) as decode:
+      for _ in range(3):
+        token = AccessToken(self.access)
+    self.assertEqual(decode.call_count, 1)
+    self.assertEqual(token["user_id"], str(self.user.id))
+
+  def test_cached_payload_is_a_copy(self):
+    """
+    キャッシュから取り出したペイロードを書き換えても、キャッシュには影響しない
+    """
+    AccessToken(self.access)["user_id"] = "changed"
+    self.assertEqual(AccessToken(self.access)["user_id"], str(self.user.id))
+
+  def test_expired_entry_is_not_returned(self):
+    """
+    expを過ぎたエントリは返されない
+    """
+    cache = DecodedTokenCache(max_size=10)
+    cache.set("token", {"exp": time.time() - 1, "user_id": "1"})
+    self.assertIsNone(cache.get("token"))
+
+  def test_deactivating_user_evicts_tokens(self):
+    """
+    ユーザーを無効化すると、そのユーザーのトークンがキャッシュから捨てられる
+    """
+    AccessToken(self.access)
+    self.assertEqual(len(decoded_token_cache), 1)
+    self.user.is_active = False
+    self.user.save()
+    self.assertEqual(len(decoded_token_cache), 0)
+
+  def test_revoking_refresh_token_evicts_it(self):
+    """
+    リフレッシュトークンを失効させると、キャッシュから捨てられる
+    """
+    refresh = RefreshToken(str(self.refresh))
+    self.assertIsNotNone(decoded_token_cache.get(str(self.refresh)))
+    token_store.revoke(refresh)
+    self.assertIsNone(decoded_token_cache.get(str(self.refresh)))
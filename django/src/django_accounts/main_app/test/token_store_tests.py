@@ -0,0 +1,135 @@
+from django.core.cache import cache
+from django.test import TestCase
+from django.core.management import call_command
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import status
+from ..models import RevokedRefreshToken
+from .helpers import create_default_user, throttle_rates
+from ..tokens import RefreshToken
+from .. import token_store
+from ..utils import get_jwt
+from io import StringIO
+from unittest import mock
+import datetime
+import os
+
+JWT_HEADER = os.environ.get("JWT_AUTH_HEADER_TYPES")
+
+class TokenStoreTests(TestCase):
+
+  @classmethod
+  def setUpTestData(cls):
+    cls.user = create_default_user()
+
+  def setUp(self):
+    self.refresh = RefreshToken.for_user(self.user)
+    self.content_type = "application/json"
+
+  def post(self, name, data):
+    return self.client.post(reverse(name), data, content_type=self.content_type)
+
+  def test_rotated_refresh_token_cannot_be_reused(self):
+    """
+    ローテーションで使用済みになったリフレッシュトークンは、再び使うと401エラーになる
+    """
+    response = self.post("main_app:token_refresh", {"refresh": str(self.refresh)})
+    self.assertEqual(response.status_code, status.HTTP_200_OK)
+    self.assertTrue(response.data["refresh"])
+
+    response = self.post("main_app:token_refresh", {"refresh": str(self.refresh)})
+    self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+  def test_revoked_refresh_token_fails_verification(self):
+    """
+    失効させたリフレッシュトークンは、検証でエラーになる
+    """
+    response = self.post("main_app:token_revoke", {"refresh": str(self.refresh)})
+    self.assertEqual(response.status_code, status.HTTP_200_OK)
+    response = self.post("main_app:token_verify", {"token": str(self.refresh)})
+    self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+  def test_revoke_returns_false_when_already_revoked(self):
+    """
+    同じトークンを2回失効させると、2回目はFalseが返ってくる
+    """
+    self.assertTrue(token_store.revoke(self.refresh))
+    self.assertFalse(token_store.revoke(self.refresh))
+    self.assertTrue(token_store.is_revoked(self.refresh))
+
+  def test_sweep_refresh_tokens_command(self):
+    """
+    sweep_refresh_tokensコマンドで、有効期限を過ぎた行だけがチャンク単位で削除される
+    """
+    now = timezone.now()
+    RevokedRefreshToken.objects.bulk_create([
+      RevokedRefreshToken(jti_hash="%032d" % i, user_id=self.user.id,
+                          exp=now + datetime.timedelta(days=-1 if i < 5 else 1))
+      for i in range(8)
+    ])
+    out = StringIO()
+    call_command("sweep_refresh_tokens", chunk_size=2, stdout=out)
+    self.assertIn("deleted=5", out.getvalue())
+    self.assertEqual(RevokedRefreshToken.objects.count(), 3)
+
+class TokenBatchVerifyViewTests(TestCase):
+
+  @classmethod
+  def setUpTestData(cls):
+    cls.user = create_default_user()
+
+  def setUp(self):
+    cache.clear()
+    self.url = reverse("main_app:token_verify_batch")
+    self.auth = {"HTTP_AUTHORIZATION": JWT_HEADER+" "+get_jwt(self.user)["access"]}
+
+  def post(self, tokens, **extra):
+    return self.client.post(self.url, {"tokens": tokens}, content_type="application/json", **extra)
+
+  def test_batch_verify_returns_result_per_token(self):
+    """
+    複数のトークンを送ると、同じ順番でトークンごとの結果が返ってくる
+    失効リストの確認は1回の問い合わせで行われる
+    """
+    refresh = RefreshToken.for_user(self.user)
+    revoked = RefreshToken.for_user(self.user)
+    token_store.revoke(revoked)
+    tokens = [str(refresh.access_token), str(refresh), "invalid", str(revoked)]
+
+    # 呼び出し元のユーザーをキャッシュに読み込んでおく
+    self.post([str(refresh.access_token)], **self.auth)
+    with self.assertNumQueries(1):
+      response = self.post(tokens, **self.auth)
+    self.assertEqual(response.status_code, status.HTTP_200_OK)
+    results = response.data["results"]
+    self.assertEqual([result["valid"] for result in results], [True, True, False, False])
+    self.assertEqual(results[0]["claims"]["user_id"], str(self.user.id))
+    self.assertEqual(results[3]["code"], "token_blacklisted")
+
+  def test_batch_verify_with_invalid_body(self):
+    """
+    トークンが空の時は400エラーが返ってくる
+    """
+    response = self.post([], **self.auth)
+    self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+  def test_batch_verify_requires_authentication(self):
+    """
+    認証していなければ、トークンを検証せずに401エラーになる
+    """
+    with mock.patch("main_app.serializer.UntypedToken") as untyped_token:
+      response = self.post([str(RefreshToken.for_user(self.user))])
+    self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+    untyped_token.assert_not_called()
+
+  @throttle_rates(verify_batch_account="1/min")
+  def test_batch_verify_throttled_per_user(self):
+    """
+    呼び出し元のユーザーごとの回数を超えたら429エラーになる
+    """
+    tokens = [str(RefreshToken.for_user(self.user))]
+    self.assertEqual(self.post(tokens, **self.auth).status_code, status.HTTP_200_OK)
+    self.assertEqual(self.post(tokens, **self.auth).status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+    other = create_default_user(username="Other", email="other@example.com")
+    other_auth = {"HTTP_AUTHORIZATION": JWT_HEADER+" "+get_jwt(other)["access"]}
+    self.assertEqual(self.post(tokens, **other_auth).status_code, status.HTTP_200_OK)
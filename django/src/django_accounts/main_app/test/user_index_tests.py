@@ -0,0 +1,117 @@
+from django.test import TestCase, AsyncRequestFactory
+from django.urls import reverse
+from rest_framework import status
+from unittest import mock
+from ..models import User
+from .helpers import create_default_user
+from ..user_index import BloomFilter, UserExistenceIndex, user_index
+from ..async_views import AsyncSignupView
+import json
+
+class UserExistenceIndexTests(TestCase):
+
+  @classmethod
+  def setUpTestData(cls):
+    create_default_user()
+
+  def test_bloom_filter(self):
+    """
+    追加した値は必ず「存在するかもしれない」と判定される
+    """
+    bloom = BloomFilter(1000, 0.01)
+    for i in range(1000):
+      bloom.add("user%d" % i)
+    self.assertTrue(all("user%d" % i in bloom for i in range(1000)))
+    false_positives = sum("other%d" % i in bloom for i in range(1000))
+    self.assertLess(false_positives, 50)
+
+  def test_taken_fields(self):
+    """
+    登録済みのusername/emailだけが返ってくる。emailのドメインは正規化して確認する
+    """
+    index = UserExistenceIndex(False, 1000, 0.01)
+    self.assertEqual(index.taken_fields(User, {"username": "Test User", "email": "example@EXAMPLE.com"}),
+                     ["username", "email"])
+    self.assertEqual(index.taken_fields(User, {"username": "Other", "email": "example@example.com"}),
+                     ["email"])
+    self.assertEqual(index.taken_fields(User, {"username": "Other", "email": "other@example.com"}), [])
+
+  def test_taken_fields_with_filter_skips_db_for_new_values(self):
+    """
+    フィルタを使う時は、フィルタにない値ならDBを検索しない
+    """
+    index = UserExistenceIndex(True, 1000, 0.01)
+    index.build(User)
+    self.assertEqual(index.taken_fields(User, {"username": "Test User"}), ["username"])
+    with self.assertNumQueries(0):
+      self.assertEqual(index.taken_fields(User, {"username": "Other", "email": "other@example.com"}), [])
+
+    # 登録されたユーザーはフィルタに追加される
+    user = create_default_user(username="Other", email="other@example.com")
+    index.add(user)
+    self.assertEqual(index.taken_fields(User, {"username": "Other"}), ["username"])
+
+  def test_filter_is_built_in_batches(self):
+    """
+    フィルタは主キーの順にbatch_size件ずつ読み込んで作成する
+    """
+    for i in range(4):
+      create_default_user(username="user%d" % i, email="user%d@example.com" % i)
+    index = UserExistenceIndex(True, 1000, 0.01)
+    index.batch_size = 2
+    # 5件を2件ずつ読み込むので3回
+    with self.assertNumQueries(3):
+      index.build(User)
+    self.assertTrue(all(index._key("username", "user%d" % i) in index._filter for i in range(4)))
+
+  def test_filter_is_not_built_in_request(self):
+    """
+    フィルタの作成前は、リクエストの中でテーブル全体を読み込まずにDBで確認し、作成はバックグラウンドで始める
+    """
+    index = UserExistenceIndex(True, 1000, 0.01)
+    with mock.patch.object(index, "start_build") as start_build, self.assertNumQueries(1):
+      self.assertEqual(index.taken_fields(User, {"username": "Other"}), [])
+    start_build.assert_called_once_with(User)
+    with mock.patch("threading.Thread") as thread:
+      index.start_build(User)
+      index.start_build(User)
+    thread.assert_called_once()
+
+  def test_signup_with_duplicate_does_not_hash_password(self):
+    """
+    重複したユーザー登録は、パスワードをハッシュ化する前に400エラーになる
+    """
+    with mock.patch("main_app.hashing.make_password") as make_password:
+      response = self.client.post(reverse("main_app:signup"),
+                                  {"username": "Other",
+                                   "email": "example@example.com",
+                                   "password": "password"},
+                                  content_type="application/json")
+    self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+    self.assertIn("email", response.data)
+    make_password.assert_not_called()
+
+  def test_signup_with_duplicate_missed_by_check(self):
+    """
+    確認で見逃した重複は、DBの一意制約で400エラーになる
+    """
+    with mock.patch.object(user_index, "taken_fields", return_value=[]):
+      response = self.client.post(reverse("main_app:signup"),
+                                  {"username": "Test User",
+                                   "email": "other@example.com",
+                                   "password": "password"},
+                                  content_type="application/json")
+    self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+    self.assertEqual(User.objects.count(), 1)
+
+  async def test_async_signup_with_duplicate(self):
+    """
+    非同期版のsignup_viewでも、重複したユーザー登録は400エラーになる
+    """
+    request = AsyncRequestFactory().post("/", json.dumps({"username": "Test User",
+                                                          "email": "other@example.com",
+                                                          "password": "password"}),
+                                         content_type="application/json")
+    response = await AsyncSignupView.as_view()(request)
+    self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+    self.assertIn("username", json.loads(response.content))
@@ -0,0 +1,79 @@
+from django.db import router
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from rest_framework import status
+from ..models import User
+from ..utils import get_jwt
+from unittest import mock
+import json
+import os
+
+JWT_HEADER = os.environ.get("JWT_AUTH_HEADER_TYPES")
+
+class UserListViewTests(TestCase):
+
+  @classmethod
+  def setUpTestData(cls):
+    cls.admin = User.objects.create_superuser(username="admin",
+                                              email="admin@example.com",
+                                              password="password")
+    # bulk_createではcreated_atが同じになるので、idで順番が決まる
+    User.objects.bulk_create([User(username="user%d" % i, email="user%d@example.com" % i, password="")
+                              for i in range(5)])
+    cls.auth = {"HTTP_AUTHORIZATION": JWT_HEADER+" "+get_jwt(cls.admin)["access"]}
+
+  def setUp(self):
+    self.url = reverse("main_app:user_list")
+
+  def test_user_list_requires_admin(self):
+    """
+    管理者以外は一覧を取得できない
+    """
+    response = self.client.get(self.url)
+    self.assertIn(response.status_code, (status.HTTP_401_UNAUTHORIZED, status.HTTP_403_FORBIDDEN))
+
+  def test_user_list_with_cursor(self):
+    """
+    nextをたどると、全ユーザーが(created_at, id)の順に重複なく返ってくる
+    """
+    usernames = []
+    url = self.url + "?limit=2"
+    while url:
+      response = self.client.get(url, **self.auth)
+      self.assertEqual(response.status_code, status.HTTP_200_OK)
+      self.assertLessEqual(len(response.data["results"]), 2)
+      self.assertNotIn("password", response.data["results"][0])
+      usernames += [user["username"] for user in response.data["results"]]
+      url = response.data["next"]
+    self.assertEqual(usernames, ["admin"] + ["user%d" % i for i in range(5)])
+
+  def test_user_list_with_invalid_cursor(self):
+    response = self.client.get(self.url, {"cursor": "invalid"}, **self.auth)
+    self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+  def test_user_list_ndjson(self):
+    """
+    NDJSONでは、カーソル以降の全ユーザーが1行1件でストリーミングされる
+    """
+    first = self.client.get(self.url, {"limit": 1}, **self.auth)
+    response = self.client.get(self.url, {"cursor": first.data["next"].split("cursor=")[1].split("&")[0]},
+                               HTTP_ACCEPT="application/x-ndjson", **self.auth)
+    self.assertEqual(response.status_code, status.HTTP_200_OK)
+    self.assertTrue(response.streaming)
+    self.assertEqual(response["Content-Type"], "application/x-ndjson")
+    lines = b"".join(response.streaming_content).decode().splitlines()
+    self.assertEqual([json.loads(line)["username"] for line in lines], ["user%d" % i for i in range(5)])
+
+  @override_settings(USER_LIST_STREAM_CHUNK_SIZE=2)
+  def test_user_list_ndjson_in_batches(self):
+    """
+    ストリーミングはチャンクごとに読み込み、読み取り先はリクエストの処理中に決めたものを使う
+    """
+    with mock.patch.object(router, "db_for_read", wraps=router.db_for_read) as db_for_read:
+      response = self.client.get(self.url, HTTP_ACCEPT="application/x-ndjson", **self.auth)
+      calls = db_for_read.call_count
+      # 6件を2件ずつ読み込み、最後は空のチャンクで終わる
+      with self.assertNumQueries(4):
+        lines = b"".join(response.streaming_content).decode().splitlines()
+      self.assertEqual(db_for_read.call_count, calls)
+    self.assertEqual([json.loads(line)["username"] for line in lines], ["admin"] + ["user%d" % i for i in range(5)])
@@ -0,0 +1,97 @@
+from django.test import TestCase
+from django.urls import reverse
+from rest_framework import status
+from ..models import User
+from ..utils import get_jwt
+import os
+
+JWT_HEADER = os.environ.get("JWT_AUTH_HEADER_TYPES")
+from ..pagination import decode_cursor, encode_cursor
+from ..user_search import search_users
+
+def create_users(names):
+  return User.objects.bulk_create([User(username=name, email="%s@example.com" % name.lower(), password="")
+                                   for name in names])
+
+class UserSearchTests(TestCase):
+
+  @classmethod
+  def setUpTestData(cls):
+    create_users(["alice", "Alex", "alfred", "bob", "ALBERT"])
+    cls.admin = User.objects.create_superuser(username="admin",
+                                              email="admin@example.com",
+                                              password="password")
+
+  def setUp(self):
+    self.search_url = reverse("main_app:user_search")
+    self.availability_url = reverse("main_app:user_availability")
+
+  def test_cursor(self):
+    self.assertEqual(decode_cursor(encode_cursor("alice", 3)), ("alice", 3))
+    with self.assertRaises(ValueError):
+      decode_cursor("invalid")
+
+  def test_search_users_is_case_insensitive(self):
+    """
+    大文字小文字を区別せず前方一致したユーザーが、小文字の値の順に返ってくる
+    """
+    result = search_users("username", "AL")
+    self.assertEqual([user["username"] for user in result["results"]],
+                     ["ALBERT", "Alex", "alfred", "alice"])
+    self.assertIsNone(result["next"])
+
+  def test_search_users_with_prefix_ending_in_z_or_9(self):
+    """
+    prefixの最後の文字の次のコードポイントに依存しないので、'z'や'9'で終わるprefixでも検索できる
+    """
+    create_users(["Liz", "lizzy", "user9", "user90", "user8"])
+    self.assertEqual([user["username"] for user in search_users("username", "LIZ")["results"]], ["Liz", "lizzy"])
+    self.assertEqual([user["username"] for user in search_users("username", "user9")["results"]],
+                     ["user9", "user90"])
+    self.assertEqual([user["email"] for user in search_users("email", "lizz")["results"]], ["lizzy@example.com"])
+    self.assertEqual(search_users("username", "al%")["results"], [])
+
+  def test_search_users_with_cursor(self):
+    """
+    nextのカーソルで続きのページが重複なく取得できる
+    """
+    names = []
+    cursor = None
+    while True:
+      result = search_users("username", "al", cursor and decode_cursor(cursor), limit=3)
+      names += [user["username"] for user in result["results"]]
+      cursor = result["next"]
+      if cursor is None:
+        break
+    self.assertEqual(names, ["ALBERT", "Alex", "alfred", "alice"])
+
+  def test_search_view_requires_admin(self):
+    """
+    管理者以外は検索できない
+    """
+    response = self.client.get(self.search_url, {"q": "al"})
+    self.assertIn(response.status_code, (status.HTTP_401_UNAUTHORIZED, status.HTTP_403_FORBIDDEN))
+
+  def test_search_view(self):
+    """
+    管理者はemailの前方一致でユーザーを検索できる
+    """
+    response = self.client.get(self.search_url, {"q": "BO", "field": "email"},
+                               HTTP_AUTHORIZATION=JWT_HEADER+" "+get_jwt(self.admin)["access"])
+    self.assertEqual(response.status_code, status.HTTP_200_OK)
+    self.assertEqual([user["email"] for user in response.data["results"]], ["bob@example.com"])
+
+    response = self.client.get(self.search_url, {"q": "al", "cursor": "invalid"},
+                               HTTP_AUTHORIZATION=JWT_HEADER+" "+get_jwt(self.admin)["access"])
+    self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+  def test_availability_view(self):
+    """
+    登録済みのusername/emailはfalse、未登録ならtrueが返ってくる
+    """
+    response = self.client.get(self.availability_url, {"username": "alice", "email": "new@example.com"})
+    self.assertEqual(response.status_code, status.HTTP_200_OK)
+    self.assertEqual(response.data, {"username": False, "email": True})
+
+    response = self.client.get(self.availability_url)
+    self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
@@ -1,7 +1,8 @@
-from django.test import TestCase
+from django.test import TestCase, override_settings
+from django.core.cache import cache
 from unittest import skip
-from ..models import User
-from ..utils import get_jwt, get_jwt_and_set_cookie, verify_jwt
+from .helpers import create_default_user
+from ..utils import get_jwt, get_jwt_and_set_cookie, verify_jwt, verify_jwt_stateless
 from rest_framework import status
 from rest_framework.response import Response
 from django.http import HttpRequest
@@ -12,17 +13,6 @@ import os
 # 環境変数を読み込む
 JWT_HEADER = os.environ.get("JWT_AUTH_HEADER_TYPES")
 
-def create_default_user(username="Test User",
-                       email="example@example.com",
-                       password="password"):
-  """
- ユーザーを作成する
-  """
-  user= User.objects.create_user(username=username,
-                                 email=email,
-                                 password=password)
-  return user
-
 class UserUtilsTests(TestCase):
 
   def setUp(self):
@@ -99,4 +89,43 @@ class UserUtilsTests(TestCase):
     request = Request(HttpRequest())
     raw_jwt = verify_jwt(request)
     # Noneが返ってくる
-    self.assertFalse(raw_jwt)
\ No newline at end of file
+    self.assertFalse(raw_jwt)
+
+  def test_verify_jwt_stateless_with_valid_jwt(self):
+    """
+    jwtがセットされたリクエストを引数にしてverify_jwt_stateless(request)を実行すると
+    DBを参照せずに検証済みのjwtが返ってくる
+    """
+    request = Request(HttpRequest())
+    jwt = get_jwt(self.user)
+    request.META["HTTP_AUTHORIZATION"]= JWT_HEADER+" "+jwt["access"]
+    with self.assertNumQueries(0):
+      validated_token = verify_jwt_stateless(request)
+    self.assertEqual(validated_token["user_id"], str(self.user.id))
+
+  def test_verify_jwt_stateless_with_invalid_jwt(self):
+    """
+    無効なjwtがセットされたリクエストを引数にしてverify_jwt_stateless(request)を実行すると
+    401エラーが返ってくる
+    """
+    request = Request(HttpRequest())
+    jwt = get_jwt(self.user)
+    request.META["HTTP_AUTHORIZATION"]= JWT_HEADER+" "+jwt["access"]+"invalid"
+    with self.assertRaises(AuthenticationFailed):
+      verify_jwt_stateless(request)
+
+  @override_settings(IS_LOGIN_ACTIVE_CHECK_TTL=60)
+  def test_verify_jwt_stateless_with_inactive_user(self):
+    """
+    IS_LOGIN_ACTIVE_CHECK_TTLが設定されている時、無効なユーザーのjwtではNoneが返ってくる
+    有効状態はキャッシュされ、2回目以降はDBを参照しない
+    """
+    cache.clear()
+    self.user.is_active = False
+    self.user.save()
+    request = Request(HttpRequest())
+    jwt = get_jwt(self.user)
+    request.META["HTTP_AUTHORIZATION"]= JWT_HEADER+" "+jwt["access"]
+    self.assertFalse(verify_jwt_stateless(request))
+    with self.assertNumQueries(0):
+      self.assertFalse(verify_jwt_stateless(request))
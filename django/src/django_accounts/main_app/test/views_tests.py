@@ -1,24 +1,14 @@
-from django.test import TestCase
+from django.test import TestCase, override_settings
 from django.urls import reverse
 from rest_framework import status
 from unittest import skip
 from ..models import User
+from .helpers import create_default_user
 from ..utils import get_jwt
 import os
 
 JWT_HEADER = os.environ.get("JWT_AUTH_HEADER_TYPES")
 
-def create_default_user(username="Test User",
-                       email="example@example.com",
-                       password="password"):
-  """
-  ユーザーを作成する
-  """
-  user= User.objects.create_user(username=username,
-                                       email=email,
-                                       password=password)
-  return user
-
 def create_jwt_headers(user):
   """
   テスト中のリクエストのヘッダに入れるjwtを作成
@@ -27,7 +17,11 @@ def create_jwt_headers(user):
   return {"Authorization": JWT_HEADER+" "+jwt_dict["access"]}
 
 class IsLoginViewsTest(TestCase):
-  
+
+  @classmethod
+  def setUpTestData(cls):
+    cls.test_user = create_default_user()
+
   def setUp(self):
     self.is_login_url = reverse("main_app:is_login")
     self.content_type = "application/json"
@@ -36,8 +30,7 @@ class IsLoginViewsTest(TestCase):
     """
     is_login_viewに有効なjwtを付与してGETメソッドを送ったときにTrueが返ってくる
     """
-    test_user = create_default_user()
-    headers = create_jwt_headers(test_user)
+    headers = create_jwt_headers(self.test_user)
     
     response = self.client.get(self.is_login_url,
                                headers=headers,
@@ -54,8 +47,7 @@ class IsLoginViewsTest(TestCase):
     """
     is_login_viewに無効なjwtを付与してGETメソッドを送ったときに401エラーが返ってくる
     """
-    test_user = create_default_user()
-    headers = create_jwt_headers(test_user)
+    headers = create_jwt_headers(self.test_user)
     # 無効なトークンにする
     headers["Authorization"] += "invalid"
 
@@ -79,6 +71,23 @@ class IsLoginViewsTest(TestCase):
     # レスポンスのデータのloginFlgがFalse
     self.assertFalse(response.data.get("loginFlg"))
 
+  @override_settings(IS_LOGIN_STATELESS=True)
+  def test_is_login_view_get_with_jwt_stateless(self):
+    """
+    IS_LOGIN_STATELESSがTrueの時、is_login_viewはDBを参照せずにTrueを返す
+    """
+    headers = create_jwt_headers(self.test_user)
+
+    with self.assertNumQueries(0):
+      response = self.client.get(self.is_login_url,
+                                 headers=headers,
+                                 content_type=self.content_type)
+
+    # ステータス200が返ってくる
+    self.assertEqual(response.status_code, 200)
+    # レスポンスのデータのloginFlgがTrue
+    self.assertTrue(response.data.get("loginFlg"))
+
 class SignupViewTests(TestCase):
 
   def setUp(self):
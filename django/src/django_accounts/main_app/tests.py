@@ -1,10 +1,12 @@
-from django.test import TestCase
-from .test.models_tests import UserModelTests
-from .test.utils_tests import UserUtilsTests
-from .test.views_tests import IsLoginViewsTest, SignupViewTests
+"""
+main_app/test/の*_tests.pyのテストをすべて読み込む
+    python manage.py test main_app --parallel
+"""
+import os
 
-class Tests(TestCase):
-  UserModelTests()
-  UserUtilsTests()
-  IsLoginViewsTest()
-  SignupViewTests()
\ No newline at end of file
+
+def load_tests(loader, tests, pattern):
+  test_dir = os.path.join(os.path.dirname(__file__), "test")
+  top_level_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+  tests.addTests(loader.discover(test_dir, pattern="*_tests.py", top_level_dir=top_level_dir))
+  return tests
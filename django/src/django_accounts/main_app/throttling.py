@@ -0,0 +1,228 @@
+"""
+ログインとユーザー登録のレート制限
+IPごと・アカウントごと・全体の3つの単位で回数を数え、パスワードのハッシュ化やDBの参照より前に弾く
+回数はCACHES(THROTTLE_CACHE_ALIAS)に保存するので、全ワーカー・全ノードで共有される
+"""
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.settings import api_settings
+from rest_framework.throttling import BaseThrottle
+from .instrumentation import metrics
+from .models import User
+import hashlib
+import math
+import threading
+import time
+
+PERIODS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+
+def get_client_ip(request):
+    """
+    クライアントのアドレスを返す
+    プロキシの数(REST_FRAMEWORKのNUM_PROXIES)が指定されていれば、X-Forwarded-Forの後ろからその数だけ戻ったアドレスを使う
+    指定がなければX-Forwarded-Forは偽装できるので使わず、REMOTE_ADDRを返す
+    (DRFのBaseThrottle.get_identは、NUM_PROXIESがなければX-Forwarded-Forをそのまま使う)
+    """
+    num_proxies = api_settings.NUM_PROXIES
+    xff = request.META.get("HTTP_X_FORWARDED_FOR")
+    if num_proxies and xff:
+        addrs = [addr.strip() for addr in xff.split(",")]
+        return addrs[-min(num_proxies, len(addrs))]
+    return request.META.get("REMOTE_ADDR")
+
+
+def parse_rate(rate):
+    """
+    "10/min"のような文字列を(回数, 秒数)にする。Noneや空文字なら制限しない
+    """
+    if not rate:
+        return None
+    num, period = rate.split("/")
+    return int(num), PERIODS[period[0]]
+
+
+class ThrottleStats:
+    """
+    プロセス内のレート制限の統計(スコープごとの許可・拒否の回数)
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+          self.allowed = {}
+          self.throttled = {}
+
+    def record(self, scope, allowed):
+        with self._lock:
+          counts = self.allowed if allowed else self.throttled
+          counts[scope] = counts.get(scope, 0) + 1
+        # 全プロセスの合計は/metricsで確認する
+        metrics.inc("throttle_allowed" if allowed else "throttle_throttled", scope)
+
+    def snapshot(self):
+        with self._lock:
+          scopes = sorted(set(self.allowed) | set(self.throttled))
+          return {scope: {"allowed": self.allowed.get(scope, 0),
+                          "throttled": self.throttled.get(scope, 0)} for scope in scopes}
+
+
+throttle_stats = ThrottleStats()
+
+
+class SlidingWindowLimiter:
+    """
+    スライディングウィンドウのカウンタ
+    現在と1つ前の固定ウィンドウの回数を、経過時間で重み付けして合計する
+    キャッシュの操作はadd・incr・getだけなので、どのキャッシュでも1回の判定はO(1)で競合しない
+    """
+    key_format = "throttle:%s:%s:%d"
+
+    def __init__(self, alias):
+        self.alias = alias
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def _keys(self, scope, ident, period, now):
+        window = int(now // period)
+        return self.key_format % (scope, ident, window), self.key_format % (scope, ident, window - 1)
+
+    def _wait(self, count, previous, num, period, now):
+        """
+        制限を超えていれば、次に許可されるまでの秒数を返す。超えていなければNoneを返す
+        """
+        elapsed = now % period
+        if previous * (1 - elapsed / period) + count <= num:
+          return None
+        if count > num or previous == 0:
+          return period - elapsed
+        # 1つ前のウィンドウの回数の重みが減って、num回以内に収まるまでの秒数
+        return max(period * (1 - (num - count) / previous) - elapsed, 1)
+
+    def hit(self, scope, ident, rate):
+        num, period = rate
+        now = time.time()
+        current, previous = self._keys(scope, ident, period, now)
+        self.cache.add(current, 0, period * 2)
+        try:
+          count = self.cache.incr(current)
+        except ValueError:
+          # addとincrの間に期限切れになった
+          self.cache.set(current, 1, period * 2)
+          count = 1
+        return self._wait(count, self.cache.get(previous, 0), num, period, now)
+
+    async def ahit(self, scope, ident, rate):
+        num, period = rate
+        now = time.time()
+        current, previous = self._keys(scope, ident, period, now)
+        await self.cache.aadd(current, 0, period * 2)
+        try:
+          count = await self.cache.aincr(current)
+        except ValueError:
+          await self.cache.aset(current, 1, period * 2)
+          count = 1
+        return self._wait(count, await self.cache.aget(previous, 0), num, period, now)
+
+
+limiter = SlidingWindowLimiter(settings.THROTTLE_CACHE_ALIAS)
+
+
+class MultiScopeThrottle(BaseThrottle):
+    """
+    複数のスコープ(DEFAULT_THROTTLE_RATESのキー)を順に確認し、どれか1つでも超えていれば拒否する
+    スコープ名の末尾でキーを決める。_ipならクライアントのIP、_accountならリクエストのアカウント、_globalなら全体
+    """
+    scopes = ()
+
+    def get_account(self, data):
+        return None
+
+    def get_ident(self, request, scope, data):
+        if scope.endswith("_ip"):
+          return get_client_ip(request)
+        if scope.endswith("_account"):
+          account = self.get_account(data)
+          if not account:
+            return None
+          return hashlib.blake2b(str(account).strip().lower().encode(), digest_size=16).hexdigest()
+        return "all"
+
+    def get_checks(self, request, data):
+        rates = api_settings.DEFAULT_THROTTLE_RATES
+        for scope in self.scopes:
+          rate = parse_rate(rates.get(scope))
+          ident = self.get_ident(request, scope, data) if rate else None
+          if ident is not None:
+            yield scope, ident, rate
+
+    def allow_request(self, request, view):
+        return self.check(request, getattr(request, "data", {}))
+
+    def check(self, request, data):
+        self._wait = None
+        for scope, ident, rate in self.get_checks(request, data):
+          self._wait = limiter.hit(scope, ident, rate)
+          throttle_stats.record(scope, self._wait is None)
+          if self._wait is not None:
+            return False
+        return True
+
+    async def acheck(self, request, data):
+        """
+        checkの非同期版
+        """
+        self._wait = None
+        for scope, ident, rate in self.get_checks(request, data):
+          self._wait = await limiter.ahit(scope, ident, rate)
+          throttle_stats.record(scope, self._wait is None)
+          if self._wait is not None:
+            return False
+        return True
+
+    def wait(self):
+        return math.ceil(self._wait) if self._wait is not None else None
+
+
+class LoginThrottle(MultiScopeThrottle):
+    """
+    トークン発行(ログイン)のレート制限
+    """
+    scopes = ("login_ip", "login_account", "login_global")
+
+    def get_account(self, data):
+        if not hasattr(data, "get"):
+          return None
+        return data.get(User.USERNAME_FIELD)
+
+
+class SignupThrottle(MultiScopeThrottle):
+    """
+    ユーザー登録のレート制限
+    """
+    scopes = ("signup_ip", "signup_global")
+
+
+class TokenBatchVerifyThrottle(MultiScopeThrottle):
+    """
+    トークンの一括検証のレート制限
+    1回でJWT_BATCH_VERIFY_MAX件まで署名を検証するので、呼び出し元のユーザー(サービス)ごとに数える
+    """
+    scopes = ("verify_batch_account", "verify_batch_global")
+
+    def get_ident(self, request, scope, data):
+        if scope.endswith("_account"):
+          return "user:%s" % request.user.pk
+        return super().get_ident(request, scope, data)
+
+
+class AvailabilityThrottle(MultiScopeThrottle):
+    """
+    username/emailの登録可否の確認のレート制限
+    """
+    scopes = ("availability_ip", "availability_global")
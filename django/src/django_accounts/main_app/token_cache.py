@@ -0,0 +1,94 @@
+"""
+検証済みjwtのペイロードのキャッシュ
+同じトークンが有効期限まで何度も提示されるので、署名の検証とデコードはプロセスごとに1回だけ行う
+"""
+from collections import OrderedDict
+from django.conf import settings
+import hashlib
+import threading
+import time
+
+
+def token_digest(token):
+    if isinstance(token, str):
+        token = token.encode()
+    return hashlib.sha256(token).digest()
+
+
+class DecodedTokenCache:
+    """
+    トークンのダイジェストをキーにした、サイズ上限付きのLRUキャッシュ
+    エントリはトークンのexpまで有効で、ユーザーの無効化やトークンの失効時には明示的に捨てる
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._user_index = {}
+        self._lock = threading.Lock()
+
+    def get(self, token):
+        """
+        検証済みのペイロードのコピーを返す。なければ(または期限切れなら)None
+        """
+        if(self.max_size <= 0):
+          return None
+        key = token_digest(token)
+        with self._lock:
+          entry = self._entries.get(key)
+          if(entry is None):
+            return None
+          payload, exp, user_id = entry
+          if(exp <= time.time()):
+            self._remove(key)
+            return None
+          self._entries.move_to_end(key)
+        return dict(payload)
+
+    def set(self, token, payload, user_id_claim="user_id"):
+        exp = payload.get("exp")
+        if(self.max_size <= 0 or not isinstance(exp, (int, float))):
+          return
+        key = token_digest(token)
+        user_id = payload.get(user_id_claim)
+        with self._lock:
+          self._entries[key] = (dict(payload), exp, user_id)
+          self._entries.move_to_end(key)
+          if(user_id is not None):
+            self._user_index.setdefault(str(user_id), set()).add(key)
+          while(len(self._entries) > self.max_size):
+            self._remove(next(iter(self._entries)))
+
+    def _remove(self, key):
+        _payload, _exp, user_id = self._entries.pop(key)
+        if(user_id is not None):
+          keys = self._user_index.get(str(user_id))
+          if(keys is not None):
+            keys.discard(key)
+            if(not keys):
+              del self._user_index[str(user_id)]
+
+    def evict(self, token):
+        key = token_digest(token)
+        with self._lock:
+          if(key in self._entries):
+            self._remove(key)
+
+    def evict_user(self, user_id):
+        """
+        ユーザーのトークンをすべて捨てる(無効化・削除時)
+        """
+        with self._lock:
+          for key in list(self._user_index.get(str(user_id), ())):
+            self._remove(key)
+
+    def clear(self):
+        with self._lock:
+          self._entries.clear()
+          self._user_index.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+decoded_token_cache = DecodedTokenCache(max_size=settings.JWT_DECODE_CACHE_SIZE)
@@ -0,0 +1,80 @@
+"""
+リフレッシュトークンの失効リスト
+ローテーションで使用済みになったトークンと、ログアウトなどで失効させたトークンを記録する
+確認は主キー(jtiのハッシュ)の検索だけなので、行数が増えてもO(1)で済む
+"""
+from django.db import IntegrityError, transaction
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import datetime_from_epoch
+from .models import RevokedRefreshToken
+from .token_cache import decoded_token_cache
+import hashlib
+
+
+def hash_jti(jti):
+    """
+    jtiを16バイトのハッシュ(32文字の16進数)にする
+    """
+    return hashlib.blake2b(str(jti).encode(), digest_size=16).hexdigest()
+
+def _build_row(token):
+    return RevokedRefreshToken(jti_hash=hash_jti(token[api_settings.JTI_CLAIM]),
+                               user_id=token.get(api_settings.USER_ID_CLAIM),
+                               exp=datetime_from_epoch(token["exp"]))
+
+def _evict(token):
+    # 検証済みトークンのキャッシュからも捨てる
+    if token.token is not None:
+      decoded_token_cache.evict(token.token)
+
+def revoke(token):
+    """
+    トークンを失効させる
+    既に失効していればFalseを返す。同じトークンで同時に更新された時も、どちらか一方だけがTrueになる
+    """
+    _evict(token)
+    try:
+      with transaction.atomic():
+        _build_row(token).save(force_insert=True)
+    except IntegrityError:
+      return False
+    return True
+
+async def arevoke(token):
+    """
+    revokeの非同期版
+    """
+    _evict(token)
+    try:
+      await _build_row(token).asave(force_insert=True)
+    except IntegrityError:
+      return False
+    return True
+
+def is_revoked(token):
+    return RevokedRefreshToken.objects.filter(jti_hash=hash_jti(token[api_settings.JTI_CLAIM])).exists()
+
+async def ais_revoked(token):
+    return await RevokedRefreshToken.objects.filter(jti_hash=hash_jti(token[api_settings.JTI_CLAIM])).aexists()
+
+def revoked_among(tokens):
+    """
+    複数のトークンのうち失効しているもののjtiのハッシュを、1回の問い合わせでまとめて返す
+    """
+    jti_hashes = {hash_jti(token[api_settings.JTI_CLAIM]) for token in tokens}
+    if not jti_hashes:
+      return set()
+    return set(RevokedRefreshToken.objects.filter(jti_hash__in=jti_hashes).values_list("jti_hash", flat=True))
+
+def sweep_expired(now, chunk_size=10000):
+    """
+    有効期限を過ぎた行をchunk_size件ずつ削除し、削除した件数をチャンクごとに返す
+    一度に大量の行をロックしないように、主キーを取得してから削除する
+    """
+    while True:
+      jti_hashes = list(RevokedRefreshToken.objects.filter(exp__lt=now)
+                                                   .values_list("jti_hash", flat=True)[:chunk_size])
+      if not jti_hashes:
+        return
+      deleted, _ = RevokedRefreshToken.objects.filter(jti_hash__in=jti_hashes).delete()
+      yield deleted
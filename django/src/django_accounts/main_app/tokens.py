@@ -0,0 +1,93 @@
+"""
+main_app.keysの鍵で署名・検証するjwtのクラス達
+JWT_ALGORITHMがRS256/ES256/EdDSAなどの時は最新の鍵で署名してヘッダーにkidを入れ、検証はkidの公開鍵で行う
+HS256などの時はsimplejwtと同じくSIGNING_KEYを使う
+検証済みのペイロードはmain_app.token_cacheに保持し、同じトークンの署名の検証は1回だけ行う
+"""
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt import tokens
+from rest_framework_simplejwt.backends import TokenBackend
+from rest_framework_simplejwt.exceptions import TokenBackendError
+from rest_framework_simplejwt.settings import api_settings
+from .instrumentation import timed
+from .keys import keyring, is_asymmetric
+from .token_cache import decoded_token_cache
+import jwt
+
+
+class KeyRingTokenBackend(TokenBackend):
+
+    def encode(self, payload):
+        with timed("jwt"):
+            return self._encode(payload)
+
+    def _encode(self, payload):
+        if not is_asymmetric(self.algorithm):
+            return super().encode(payload)
+
+        kid, signing_key = keyring.get_signing_key()
+        if signing_key is None:
+            raise TokenBackendError(_("No signing key. Run 'manage.py rotate_signing_key'."))
+
+        jwt_payload = payload.copy()
+        if self.audience is not None:
+            jwt_payload["aud"] = self.audience
+        if self.issuer is not None:
+            jwt_payload["iss"] = self.issuer
+        return jwt.encode(jwt_payload, signing_key, algorithm=self.algorithm,
+                          headers={"kid": kid}, json_encoder=self.json_encoder)
+
+    def decode(self, token, verify=True):
+        if not verify:
+            return super().decode(token, verify=verify)
+
+        payload = decoded_token_cache.get(token)
+        if payload is None:
+            with timed("jwt"):
+                payload = super().decode(token, verify=verify)
+            decoded_token_cache.set(token, payload, api_settings.USER_ID_CLAIM)
+        return payload
+
+    def get_verifying_key(self, token):
+        if not is_asymmetric(self.algorithm):
+            return super().get_verifying_key(token)
+
+        try:
+            kid = jwt.get_unverified_header(token).get("kid")
+        except jwt.InvalidTokenError as e:
+            raise TokenBackendError(_("Token is invalid")) from e
+        algorithm, public_key = keyring.get_public_key(kid)
+        if public_key is None or algorithm != self.algorithm:
+            raise TokenBackendError(_("Token is invalid"))
+        return public_key
+
+
+token_backend = KeyRingTokenBackend(
+    api_settings.ALGORITHM,
+    api_settings.SIGNING_KEY,
+    api_settings.VERIFYING_KEY,
+    api_settings.AUDIENCE,
+    api_settings.ISSUER,
+    api_settings.JWK_URL,
+    api_settings.LEEWAY,
+    api_settings.JSON_ENCODER,
+)
+
+
+class KeyRingTokenMixin:
+
+    @property
+    def token_backend(self):
+        return token_backend
+
+
+class AccessToken(KeyRingTokenMixin, tokens.AccessToken):
+    pass
+
+
+class RefreshToken(KeyRingTokenMixin, tokens.RefreshToken):
+    access_token_class = AccessToken
+
+
+class UntypedToken(KeyRingTokenMixin, tokens.UntypedToken):
+    pass
@@ -1,17 +1,50 @@
+from django.conf import settings
 from django.urls import path
+from django.utils.module_loading import import_string
+from django.views.decorators.csrf import csrf_exempt
 from rest_framework_simplejwt.views import (
-    TokenObtainPairView,
     TokenRefreshView,
     TokenVerifyView,
+    TokenBlacklistView,
 )
-from .views import (IsLoginView,SignupView)
+from .views import (IsLoginView,SignupView,TokenObtainPairView,JWKSView,TokenBatchVerifyView,
+                    UserAvailabilityView)
 
 app_name = "main_app"
 
+def lazy_view(dotted_path, **initkwargs):
+  """
+  最初のリクエストの時にビューをimportする(管理者や監視用など、あまり使わないビューの起動時のimportを省く)
+  """
+  view = None
+
+  def lazy(request, *args, **kwargs):
+    nonlocal view
+    if(view is None):
+      view = import_string(dotted_path).as_view(**initkwargs)
+    return view(request, *args, **kwargs)
+  return csrf_exempt(lazy)
+
+if settings.ASYNC_API_VIEWS:
+  # ASGIで動かす時は非同期版のビューを使う
+  from .async_views import (AsyncIsLoginView as IsLoginView,
+                            AsyncSignupView as SignupView,
+                            AsyncTokenObtainPairView as TokenObtainPairView,
+                            AsyncTokenRefreshView as TokenRefreshView,
+                            AsyncTokenVerifyView as TokenVerifyView)
+
 urlpatterns = [
   path('token/', TokenObtainPairView.as_view(), name='token_obtain_pair'),
   path('token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
   path('token/verify/', TokenVerifyView.as_view(), name='token_verify'),
+  path('token/verify/batch/', TokenBatchVerifyView.as_view(), name='token_verify_batch'),
+  path('token/revoke/', TokenBlacklistView.as_view(), name='token_revoke'),
   path('is_login/', IsLoginView.as_view(), name='is_login'),
   path('signup/', SignupView.as_view(), name='signup'),
-]
\ No newline at end of file
+  path('db_pool_stats/', lazy_view('main_app.admin_views.DBPoolStatsView'), name='db_pool_stats'),
+  path('users/', lazy_view('main_app.admin_views.UserListView'), name='user_list'),
+  path('users/availability/', UserAvailabilityView.as_view(), name='user_availability'),
+  path('users/search/', lazy_view('main_app.admin_views.UserSearchView'), name='user_search'),
+  path('throttle_stats/', lazy_view('main_app.admin_views.ThrottleStatsView'), name='throttle_stats'),
+  path('.well-known/jwks.json', JWKSView.as_view(), name='jwks'),
+]
@@ -0,0 +1,201 @@
+"""
+認証済みユーザーのキャッシュ
+"""
+from collections import OrderedDict
+from django.conf import settings
+from django.core.cache import caches
+from django.db import router
+from rest_framework_simplejwt.utils import get_md5_hash_password
+import copy
+import threading
+import time
+
+
+class UserLRUCache:
+    """
+    プロセス内でユーザーを保持する、サイズ上限と有効期限(TTL)付きのLRUキャッシュ
+    """
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        """
+        キャッシュからユーザーを取り出す
+        存在しないか有効期限が切れていればNoneを返す
+        """
+        key = str(user_id)
+        with self._lock:
+          entry = self._entries.get(key)
+          if(entry is None):
+            return None
+          user, expires_at = entry
+          if(expires_at <= time.monotonic()):
+            del self._entries[key]
+            return None
+          self._entries.move_to_end(key)
+        # リクエスト間でインスタンスを共有しないようにコピーを返す
+        return copy.copy(user)
+
+    def set(self, user_id, user):
+        """
+        ユーザーをキャッシュに格納し、上限を超えたら最も古いものから捨てる
+        """
+        if(self.max_size <= 0 or self.ttl <= 0):
+          return
+        key = str(user_id)
+        with self._lock:
+          self._entries[key] = (copy.copy(user), time.monotonic() + self.ttl)
+          self._entries.move_to_end(key)
+          while(len(self._entries) > self.max_size):
+            self._entries.popitem(last=False)
+
+    def invalidate(self, user_id):
+        """
+        ユーザーをキャッシュから削除する
+        """
+        with self._lock:
+          self._entries.pop(str(user_id), None)
+
+    def clear(self):
+        with self._lock:
+          self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SharedUserCache:
+    """
+    DjangoのCACHES経由で全ワーカー・全ノードから共有するユーザーのスナップショット
+    ユーザーごとのバージョン番号をキーに含めることで、更新時はバージョンを上げるだけで古いスナップショットを無効にする
+    キャッシュミス時はロックを取ったワーカーだけがDBから取得して格納する
+    他のワーカーは1つ前のバージョンのスナップショットがあればそれを使い(ロックの間だけ更新前の内容になる)、
+    なければwait_timeout秒まで格納されるのを待ち、それでもなければDBを参照する
+    存在しないユーザーもmissing_ttl秒だけ記録し、削除されたユーザーのトークンでDBを参照し続けないようにする
+    パスワードのハッシュはスナップショットに含めず、トークンの失効の確認用にそのmd5だけを持つ
+    """
+    version_key = "user_snapshot_version:%s"
+    # スナップショットの形式を変えたら、古い形式を読まないようにキーも変える
+    snapshot_key = "user_snapshot_v2:%s:%s"
+    lock_key = "user_snapshot_lock:%s"
+    missing = "missing"
+    excluded_fields = ("password",)
+
+    def __init__(self, alias, ttl, lock_timeout, missing_ttl, wait_timeout, wait_interval=0.01):
+        self.alias = alias
+        self.ttl = ttl
+        self.lock_timeout = lock_timeout
+        self.missing_ttl = missing_ttl
+        self.wait_timeout = wait_timeout
+        self.wait_interval = wait_interval
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def _new_version(self):
+        # キャッシュからバージョンが消えても、以前の番号と衝突しないように時刻から作る
+        return time.time_ns() // 1000
+
+    def get_version(self, user_id):
+        key = self.version_key % user_id
+        version = self.cache.get(key)
+        if(version is None):
+          self.cache.add(key, self._new_version(), None)
+          version = self.cache.get(key)
+        return version
+
+    def invalidate(self, user_id):
+        """
+        バージョンを上げて、古いスナップショットを参照されないようにする
+        """
+        key = self.version_key % user_id
+        try:
+          self.cache.incr(key)
+        except ValueError:
+          self.cache.set(key, self._new_version(), None)
+
+    def invalidate_many(self, user_ids):
+        """
+        invalidateの一括版。キャッシュへの問い合わせはユーザーの数によらず2回で済む
+        (get_manyとset_manyの間に他から上げられたバージョンとは同じ番号になるが、どちらも更新後に読み込んだ内容になる)
+        """
+        keys = [self.version_key % user_id for user_id in user_ids]
+        versions = self.cache.get_many(keys)
+        self.cache.set_many({key: (versions[key] + 1 if key in versions else self._new_version()) for key in keys},
+                            None)
+
+    def _dump(self, user):
+        snapshot = {field.attname: getattr(user, field.attname) for field in user._meta.concrete_fields
+                    if field.attname not in self.excluded_fields}
+        return {"fields": snapshot, "password_md5": get_md5_hash_password(user.password)}
+
+    def _load(self, model, snapshot):
+        # 含めなかったフィールドは遅延読み込み(deferred)になる
+        fields = snapshot["fields"]
+        names = list(fields)
+        user = model.from_db(router.db_for_read(model), names, [fields[name] for name in names])
+        user.password_md5 = snapshot["password_md5"]
+        return user
+
+    def get_or_load(self, model, user_id):
+        """
+        スナップショットからユーザーを作成する。存在しなければDBから取得して格納する
+        ユーザーが存在しなければNoneを返す
+        """
+        version = self.get_version(user_id)
+        key = self.snapshot_key % (user_id, version)
+        snapshot = self.cache.get(key)
+        if(snapshot == self.missing):
+          return None
+        if(snapshot is not None):
+          return self._load(model, snapshot)
+
+        lock = self.lock_key % user_id
+        if(not self.cache.add(lock, 1, self.lock_timeout)):
+          # 他のワーカーがDBから取得中
+          return self._wait_for_snapshot(model, user_id, version)
+
+        try:
+          user = model.objects.filter(pk=user_id).first()
+          if(user is None):
+            self.cache.set(key, self.missing, self.missing_ttl)
+          else:
+            self.cache.set(key, self._dump(user), self.ttl)
+          return user
+        finally:
+          self.cache.delete(lock)
+
+    def _wait_for_snapshot(self, model, user_id, version):
+        """
+        ロックを取れなかった時に、DBを参照せずに済むスナップショットを探す
+        """
+        previous = self.cache.get(self.snapshot_key % (user_id, version - 1))
+        if(previous is not None and previous != self.missing):
+          return self._load(model, previous)
+
+        key = self.snapshot_key % (user_id, version)
+        deadline = time.monotonic() + self.wait_timeout
+        while(time.monotonic() < deadline):
+          time.sleep(self.wait_interval)
+          snapshot = self.cache.get(key)
+          if(snapshot == self.missing):
+            return None
+          if(snapshot is not None):
+            return self._load(model, snapshot)
+        # ロックを取ったワーカーが遅い時は、これ以上待たせずにDBから取得する
+        return model.objects.filter(pk=user_id).first()
+
+
+user_cache = UserLRUCache(max_size=settings.USER_CACHE_MAX_SIZE,
+                          ttl=settings.USER_CACHE_TTL)
+
+shared_user_cache = SharedUserCache(alias=settings.USER_SNAPSHOT_CACHE_ALIAS,
+                                    ttl=settings.USER_SNAPSHOT_TTL,
+                                    lock_timeout=settings.USER_SNAPSHOT_LOCK_TIMEOUT,
+                                    missing_ttl=settings.USER_SNAPSHOT_MISSING_TTL,
+                                    wait_timeout=settings.USER_SNAPSHOT_WAIT_TIMEOUT)
@@ -0,0 +1,180 @@
+"""
+ユーザー登録前のusername/emailの重複確認
+パスワードのハッシュ化より前に、一意インデックスの検索だけで重複した登録を弾く
+DBの一意制約が最終的な判定で、ここで見逃した重複は登録時のIntegrityErrorで弾かれる
+"""
+from django.conf import settings
+from django.db import connections
+from django.db.models import Q
+import hashlib
+import math
+import threading
+
+
+class BloomFilter:
+    """
+    プロセス内のブルームフィルタ
+    「存在しない」と判定した値は確実に未登録なので、DBを検索せずに済む
+    """
+
+    def __init__(self, capacity, error_rate):
+        self.size = max(int(-capacity * math.log(error_rate) / (math.log(2) ** 2)), 8)
+        self.hash_count = max(int(round(self.size / capacity * math.log(2))), 1)
+        self._bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, value):
+        digest = hashlib.blake2b(value.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hash_count)]
+
+    def add(self, value):
+        for position in self._positions(value):
+            self._bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, value):
+        return all(self._bits[position >> 3] & (1 << (position & 7)) for position in self._positions(value))
+
+
+class UserExistenceIndex:
+    """
+    username/emailが登録済みかを確認する
+    ブルームフィルタを使う設定なら、フィルタが「存在するかもしれない」と判定した値だけをDBで確認する
+    フィルタはワーカーの起動時(gunicorn.conf.pyのpost_worker_init)か最初に使う時に、バックグラウンドのスレッドで
+    DBから作成し、以降は登録時(bulk_createを含む)に追加する。作成が終わるまではすべての値をDBで確認する
+    他のプロセスで登録された値はフィルタに入らないが、その重複はDBの一意制約で弾かれる
+    """
+    fields = ("username", "email")
+    batch_size = 10000
+
+    def __init__(self, use_filter, capacity, error_rate):
+        self.use_filter = use_filter
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self._filter = None
+        self._building = None
+        self._build_started = False
+        self._lock = threading.Lock()
+
+    def _key(self, field, value):
+        # MySQLの照合順序は大文字小文字を区別しないので、フィルタのキーも小文字にそろえる
+        return "%s:%s" % (field, str(value).lower())
+
+    def build(self, model):
+        """
+        DBのusername/emailを主キーのキーセットでbatch_size件ずつ読み込んでフィルタを作成する
+        (QuerySet.iteratorはmysqlclientでは結果をすべてクライアントに読み込むので使わない)
+        作成中に登録されたユーザーも、addで作成中のフィルタに追加される
+        """
+        bloom = BloomFilter(self.capacity, self.error_rate)
+        self._building = bloom
+        try:
+          queryset = model._default_manager.order_by("pk")
+          last_pk = None
+          while True:
+            batch = queryset if last_pk is None else queryset.filter(pk__gt=last_pk)
+            rows = list(batch.values_list("pk", *self.fields)[:self.batch_size])
+            for row in rows:
+              for field, value in zip(self.fields, row[1:]):
+                bloom.add(self._key(field, value))
+            if len(rows) < self.batch_size:
+              break
+            last_pk = rows[-1][0]
+          self._filter = bloom
+        finally:
+          self._building = None
+
+    def start_build(self, model):
+        """
+        フィルタの作成をバックグラウンドのスレッドで始める(プロセスごとに1回だけ)
+        """
+        with self._lock:
+          if not self.use_filter or self._build_started:
+            return
+          self._build_started = True
+        threading.Thread(target=self._build_in_thread, args=(model,), daemon=True,
+                         name="user-existence-filter").start()
+
+    def _build_in_thread(self, model):
+        try:
+          self.build(model)
+        except Exception:
+          # 作成できなければフィルタを使わずにDBで確認し続け、次のstart_buildでやり直す
+          self._build_started = False
+        finally:
+          connections.close_all()
+
+    def add(self, user):
+        """
+        登録されたユーザーをフィルタに追加する(フィルタの作成前なら何もしない)
+        """
+        for bloom in (self._filter, self._building):
+          if bloom is not None:
+            for field in self.fields:
+              bloom.add(self._key(field, getattr(user, field)))
+
+    def add_many(self, users):
+        for user in users:
+          self.add(user)
+
+    def reset(self):
+        self._filter = None
+        self._build_started = False
+
+    def _normalize(self, model, values):
+        values = {field: values[field] for field in self.fields if values.get(field)}
+        if "email" in values:
+          values["email"] = model.objects.normalize_email(values["email"])
+        return values
+
+    def _candidates(self, model, values):
+        """
+        DBで確認が必要な値を返す
+        """
+        values = self._normalize(model, values)
+        if self.use_filter:
+          bloom = self._filter
+          if bloom is None:
+            # リクエストの処理中にはテーブル全体を読み込まず、作成が終わるまではDBで確認する
+            self.start_build(model)
+          else:
+            values = {field: value for field, value in values.items() if self._key(field, value) in bloom}
+        return values
+
+    def _query(self, model, values):
+        # それぞれ一意インデックスで検索し、インデックスに含まれる列だけを取得する
+        condition = Q()
+        for field, value in values.items():
+          condition |= Q(**{field: value})
+        return model._default_manager.filter(condition).values_list(*self.fields)[:len(values)]
+
+    def _taken(self, values, rows):
+        taken = set()
+        for row in rows:
+          for field, value in zip(self.fields, row):
+            if field in values and str(value).lower() == str(values[field]).lower():
+              taken.add(field)
+        return [field for field in self.fields if field in taken]
+
+    def taken_fields(self, model, values):
+        """
+        values(usernameとemailの辞書)のうち、既に登録されているフィールドの名前のリストを返す
+        """
+        values = self._candidates(model, values)
+        if not values:
+          return []
+        return self._taken(values, self._query(model, values))
+
+    async def ataken_fields(self, model, values):
+        """
+        taken_fieldsの非同期版
+        """
+        values = self._candidates(model, values)
+        if not values:
+          return []
+        return self._taken(values, [row async for row in self._query(model, values)])
+
+
+user_index = UserExistenceIndex(settings.USER_EXISTENCE_FILTER,
+                                settings.USER_EXISTENCE_FILTER_CAPACITY,
+                                settings.USER_EXISTENCE_FILTER_ERROR_RATE)
@@ -0,0 +1,54 @@
+"""
+username/emailの前方一致検索
+小文字にしたusername/emailと主キーの複合インデックスを前方一致(LIKE 'prefix%')で範囲検索し、(値, 主キー)のキーセットでページングする
+OFFSETを使わないので、何ページ目でもインデックスの読み込みは1ページ分で済む
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Q
+from django.db.models.functions import Lower
+from .models import User
+from .pagination import encode_cursor
+import hashlib
+import json
+
+SEARCH_FIELDS = ("username", "email")
+
+
+def search_users(field, prefix, cursor=None, limit=20):
+    """
+    fieldがprefixで始まる(大文字小文字を区別しない)ユーザーを、小文字の値と主キーの順に返す
+    {"results": [...], "next": 次のページのカーソル(なければNone)}を返す
+    """
+    prefix = prefix.lower()
+    # 上限の文字列を作って範囲で比べると、コードポイントの順を前提にしてしまう(MySQLの照合順序では'z'の次が'{'ではない)
+    # keyは小文字なので、MySQLでも照合順序のままのLIKEになるistartswithを使う(startswithはLIKE BINARYになりインデックスを使えない)
+    users = User.objects.annotate(key=Lower(field)).filter(key__istartswith=prefix)
+    if cursor is not None:
+        value, pk = cursor
+        users = users.filter(Q(key__gt=value) | Q(key=value, pk__gt=pk))
+
+    rows = list(users.order_by("key", "pk").values_list("key", "pk", "username", "email")[:limit + 1])
+    results = [{"id": pk, "username": username, "email": email} for _key, pk, username, email in rows[:limit]]
+    next_cursor = None
+    if len(rows) > limit:
+        # 次のページはDBで小文字にした値から続ける
+        key, pk = rows[limit - 1][:2]
+        next_cursor = encode_cursor(key, pk)
+    return {"results": results, "next": next_cursor}
+
+def cached_search_users(field, prefix, cursor=None, limit=20):
+    """
+    search_usersの結果をUSER_SEARCH_CACHE_TTL秒だけキャッシュする
+    入力中の補完で同じ検索が繰り返されるので、その間の更新の反映は遅れてもよいものとする
+    """
+    if settings.USER_SEARCH_CACHE_TTL <= 0:
+        return search_users(field, prefix, cursor, limit)
+    digest = hashlib.blake2b(json.dumps([field, prefix.lower(), cursor, limit]).encode(),
+                             digest_size=16).hexdigest()
+    key = "user_search:%s" % digest
+    result = cache.get(key)
+    if result is None:
+        result = search_users(field, prefix, cursor, limit)
+        cache.set(key, result, settings.USER_SEARCH_CACHE_TTL)
+    return result
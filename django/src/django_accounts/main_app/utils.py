@@ -1,10 +1,15 @@
 """
 このアプリで使うカスタムメソッド達
 """
-from rest_framework_simplejwt.tokens import RefreshToken
-from rest_framework_simplejwt.authentication import JWTAuthentication
+from .authentication import CookieJWTAuthentication
+from .db.router import sticky_writes, user_key
+from .tokens import RefreshToken
+from rest_framework_simplejwt.exceptions import TokenBackendError, TokenError
+from rest_framework_simplejwt.settings import api_settings
 from rest_framework import status
 from rest_framework.response import Response
+from django.conf import settings
+from django.core.cache import cache
 import datetime
 import os
 
@@ -21,24 +26,83 @@ def get_jwt(user):
         'refresh': str(refresh),
         'access': str(refresh.access_token),
       }
-    except:
+    except (AttributeError, TypeError, TokenError, TokenBackendError):
+      # 無効なユーザーや署名用の鍵がない時。DBのエラー(イベントループ上での同期のORMなど)は隠さずに送出する
       return {}
 
+def set_jwt_cookie(response, token):
+    """
+    発行したjwtをクッキーにセットする
+    """
+    response.set_cookie(settings.JWT_ACCESS_COOKIE, JWT_HEADER+" "+token["access"], httponly=True, samesite="Lax",
+                        max_age=api_settings.ACCESS_TOKEN_LIFETIME)
+    response.set_cookie(settings.JWT_REFRESH_COOKIE, token["refresh"], httponly=True, samesite="Lax",
+                        max_age=api_settings.REFRESH_TOKEN_LIFETIME)
+    return response
+
 def get_jwt_and_set_cookie(user, response):
     """
     jwtを発行して、クッキーにセットする
     """
     token = get_jwt(user)
     if(token):
-      response.set_cookie("Authorization", JWT_HEADER+" "+token["access"], httponly=True, max_age=datetime.timedelta(minutes=30))
-      response.set_cookie("refresh", token["refresh"], httponly=True, max_age=datetime.timedelta(days=14))
+      set_jwt_cookie(response, token)
     return response
 
 def verify_jwt(request):
     """
-    リクエストのヘッダーにあるjwtを使ってユーザー認証する
+    リクエストのヘッダー(なければクッキー)にあるjwtを使ってユーザー認証する
     jwtが認証成功すれば、[User,payload]
     jwtが認証失敗したら401エラー
     jwtがセットされていなければNoneを返す
     """
-    return JWTAuthentication().authenticate(request)
\ No newline at end of file
+    return CookieJWTAuthentication().authenticate(request)
+
+def is_user_active(user_id):
+    """
+    ユーザーが有効かどうかを返す
+    IS_LOGIN_ACTIVE_CHECK_TTL秒だけ結果をキャッシュし、その間はDBを参照しない
+    """
+    from .models import User
+
+    key = "user_active:%s" % user_id
+    is_active = cache.get(key)
+    if(is_active is None):
+      sticky_writes.check(user_key(user_id))
+      is_active = User.objects.filter(**{api_settings.USER_ID_FIELD: user_id}, is_active=True).exists()
+      cache.set(key, is_active, settings.IS_LOGIN_ACTIVE_CHECK_TTL)
+    return is_active
+
+async def ais_user_active(user_id):
+    """
+    is_user_activeの非同期版
+    """
+    from .models import User
+
+    key = "user_active:%s" % user_id
+    is_active = await cache.aget(key)
+    if(is_active is None):
+      await sticky_writes.acheck(user_key(user_id))
+      is_active = await User.objects.filter(**{api_settings.USER_ID_FIELD: user_id}, is_active=True).aexists()
+      await cache.aset(key, is_active, settings.IS_LOGIN_ACTIVE_CHECK_TTL)
+    return is_active
+
+def verify_jwt_stateless(request):
+    """
+    リクエストのヘッダー(なければクッキー)にあるjwtの署名と有効期限のみを検証する(DBを参照しない)
+    jwtが認証成功すれば、payload
+    jwtが認証失敗したら401エラー
+    jwtがセットされていなければNoneを返す
+    IS_LOGIN_ACTIVE_CHECK_TTLが設定されていれば、キャッシュしたユーザーの有効状態も確認する
+    """
+    authentication = CookieJWTAuthentication()
+    raw_token, _from_cookie = authentication.get_raw_token_from_request(request)
+    if(raw_token is None):
+      return None
+    validated_token = authentication.get_validated_token(raw_token)
+
+    if(settings.IS_LOGIN_ACTIVE_CHECK_TTL > 0):
+      user_id = validated_token.get(api_settings.USER_ID_CLAIM)
+      if(user_id is None or not is_user_active(user_id)):
+        return None
+    return validated_token
@@ -1,11 +1,17 @@
 from django.contrib.auth.hashers import check_password
 from rest_framework import status
-from rest_framework.permissions import AllowAny,IsAuthenticated
+from rest_framework.permissions import AllowAny,IsAuthenticated,IsAdminUser
+from rest_framework.views import APIView
 from rest_framework.generics import RetrieveAPIView, ListAPIView, CreateAPIView, UpdateAPIView, DestroyAPIView
 from rest_framework.response import Response
-from .serializer import UserSerializer
+from .serializer import UserSerializer, TokenBatchVerifySerializer, UserAvailabilitySerializer
+from .throttling import AvailabilityThrottle, LoginThrottle, SignupThrottle, TokenBatchVerifyThrottle
+from rest_framework_simplejwt import views as jwt_views
 from .models import User
-from .utils import get_jwt_and_set_cookie, verify_jwt
+from .keys import keyring
+from django.conf import settings
+from django.utils.cache import patch_cache_control
+from .utils import get_jwt_and_set_cookie, verify_jwt, verify_jwt_stateless
 
 class IsLoginView(RetrieveAPIView):
   """
@@ -15,9 +21,17 @@ class IsLoginView(RetrieveAPIView):
   queryset = User.objects.all()
   serializer_class = UserSerializer
 
+  def perform_authentication(self, request):
+    """
+    jwtはget内で検証するので、DRFによる事前の認証(ユーザーの取得)は行わない
+    """
+    pass
+
   def get(self, request, format=None, *args, **kwargs):
     data={ "loginFlg":False}
-    if(verify_jwt(request)): #jwtが間違っていたら401エラーが、jwtがセットされてなければNoneが変える
+    # IS_LOGIN_STATELESSがTrueならjwtの署名と有効期限のみを検証し、DBを参照しない
+    verify = verify_jwt_stateless if settings.IS_LOGIN_STATELESS else verify_jwt
+    if(verify(request)): #jwtが間違っていたら401エラーが、jwtがセットされてなければNoneが変える
         data["loginFlg"] = True
     response = Response(data = data,
                         status = status.HTTP_200_OK,
@@ -29,6 +43,7 @@ class SignupView(CreateAPIView):
   ユーザー登録用ビュー 
   """
   permission_classes = (AllowAny,)
+  throttle_classes = (SignupThrottle,)
   queryset = User.objects.all()
   serializer_class = UserSerializer
   valid_fields = ("username", "email", "password")
@@ -38,9 +53,61 @@ class SignupView(CreateAPIView):
     if serializer.is_valid(valid_fields=self.valid_fields):
         user = serializer.save()  # UserSerializerのcreateメソッドを呼び出す
 
-        # JWTを発行してクッキーにセットする。そのレスポンスを返す
-        response = Response(serializer.validated_data, status=status.HTTP_201_CREATED)
+        # JWTを発行してクッキーにセットする。そのレスポンスを返す(パスワードはwrite_onlyなので含まれない)
+        response = Response(serializer.data, status=status.HTTP_201_CREATED)
         response = get_jwt_and_set_cookie(user, response)
         return response
         
     return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+class TokenObtainPairView(jwt_views.TokenObtainPairView):
+  """
+  トークン発行(ログイン)用ビュー
+  パスワードを確認する前に、IP・アカウント・全体のレート制限を確認する
+  """
+  throttle_classes = (LoginThrottle,)
+
+class JWKSView(APIView):
+  """
+  jwtを検証する公開鍵(JWKS)を返すビュー
+  他のサービスはこれをキャッシュして、token/verifyを呼ばずにjwtを検証できる
+  """
+  permission_classes = (AllowAny,)
+  authentication_classes = ()
+
+  def get(self, request, format=None, *args, **kwargs):
+    response = Response(data = keyring.get_jwks(),
+                        status = status.HTTP_200_OK)
+    patch_cache_control(response, public=True, max_age=settings.JWT_JWKS_MAX_AGE)
+    return response
+
+class TokenBatchVerifyView(APIView):
+  """
+  複数のトークンをまとめて検証するビュー
+  {"tokens": [...]}を受け取り、トークンごとの有効性とクレームを同じ順番で返す
+  1回で多くの署名を検証するので、認証済みのユーザー(サービス間連携用のアカウントなど)だけが使え、回数も制限する
+  """
+  permission_classes = (IsAuthenticated,)
+  throttle_classes = (TokenBatchVerifyThrottle,)
+
+  def post(self, request, format=None, *args, **kwargs):
+    serializer = TokenBatchVerifySerializer(data=request.data)
+    serializer.is_valid(raise_exception=True)
+    return Response(data = serializer.validated_data,
+                    status = status.HTTP_200_OK)
+
+class UserAvailabilityView(APIView):
+  """
+  username/emailが登録に使えるかを返すビュー(登録フォームの入力中の確認用)
+  ?username=...&email=... を受け取り、{"username": true, "email": false}のように返す
+  """
+  permission_classes = (AllowAny,)
+  authentication_classes = ()
+  throttle_classes = (AvailabilityThrottle,)
+
+  def get(self, request, format=None, *args, **kwargs):
+    serializer = UserAvailabilitySerializer(data=request.query_params)
+    serializer.is_valid(raise_exception=True)
+    return Response(data = serializer.validated_data,
+                    status = status.HTTP_200_OK)
+
@@ -6,6 +6,9 @@ import sys
 
 def main():
     """Run administrative tasks."""
+    # テストはメモリ上のSQLiteと軽いハッシュのテスト用の設定で実行する
+    if sys.argv[1:2] == ['test']:
+        os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'django_accounts.settings_test')
     os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'django_accounts.settings')
     try:
         from django.core.management import execute_from_command_line